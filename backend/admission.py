@@ -0,0 +1,202 @@
+"""Admission control for upstream LLM calls.
+
+Every completion goes through one `AdmissionController`: at most
+LLM_MAX_IN_FLIGHT calls run at once, each username may have at most
+LLM_MAX_PER_USER calls running or waiting, and callers beyond the global limit
+wait in a bounded FIFO queue. A full queue (503), a user over their limit (429)
+or a wait longer than LLM_QUEUE_TIMEOUT (503) fail fast with `Retry-After`.
+
+The controller is thread-safe so the async request path and sync background
+tasks (titles, summaries, parent reports) share the same limits.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager, asynccontextmanager
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "4"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "200"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "15"))
+
+_current_user = contextvars.ContextVar("llm_user", default=None)
+
+
+class Overloaded(HTTPException):
+    """Raised when a call is not admitted; FastAPI turns it into a 429/503 with Retry-After."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+
+def set_user(username: str | None):
+    """Attribute LLM calls made from the current request (or task) to `username`."""
+    _current_user.set(username)
+
+
+class _Waiter:
+    __slots__ = ("user", "wake", "granted")
+
+    def __init__(self, user, wake):
+        self.user = user
+        self.wake = wake
+        self.granted = False
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int, max_per_user: int, max_queue: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._per_user = Counter()  # running + waiting calls per username
+        self._queue: deque[_Waiter] = deque()
+        self._service_ewma = 1.0  # seconds per call, for Retry-After estimates
+        self._counters = {
+            "admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_per_user": 0,
+            "timed_out": 0, "cancelled": 0, "max_queue_depth": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+        }
+
+    def _retry_after_locked(self) -> float:
+        # Time for the current queue to drain through the in-flight slots
+        return self._service_ewma * (len(self._queue) + 1) / max(self.max_in_flight, 1)
+
+    def _reserve(self, user, wake) -> _Waiter | None:
+        """Take a slot (returns None) or a place in the queue (returns the waiter)."""
+        with self._lock:
+            if user is not None and self._per_user[user] >= self.max_per_user:
+                self._counters["rejected_per_user"] += 1
+                raise Overloaded(429, "Too many tutor requests at once, please wait", self._service_ewma)
+            if self._in_flight < self.max_in_flight and not self._queue:
+                self._in_flight += 1
+                self._per_user[user] += 1
+                self._counters["admitted"] += 1
+                return None
+            if len(self._queue) >= self.max_queue:
+                self._counters["rejected_queue_full"] += 1
+                raise Overloaded(503, "Tutor is busy, please retry shortly", self._retry_after_locked())
+            waiter = _Waiter(user, wake)
+            self._queue.append(waiter)
+            self._per_user[user] += 1
+            self._counters["queued"] += 1
+            self._counters["max_queue_depth"] = max(self._counters["max_queue_depth"], len(self._queue))
+            return waiter
+
+    def _abandon(self, waiter: _Waiter, reason: str = "timed_out") -> bool:
+        """Drop a waiter that gave up; False if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queue.remove(waiter)
+            self._release_user_locked(waiter.user)
+            self._counters[reason] += 1
+            return True
+
+    def _release_user_locked(self, user):
+        self._per_user[user] -= 1
+        if self._per_user[user] <= 0:
+            del self._per_user[user]
+
+    def _release(self, user, service_seconds: float):
+        with self._lock:
+            self._release_user_locked(user)
+            self._service_ewma = 0.9 * self._service_ewma + 0.1 * service_seconds
+            waiter = self._queue.popleft() if self._queue else None
+            if waiter is not None:
+                # Hand the slot straight to the next waiter; in-flight count is unchanged
+                waiter.granted = True
+                self._counters["admitted"] += 1
+            else:
+                self._in_flight -= 1
+        if waiter is not None:
+            waiter.wake()
+
+    def _record_wait(self, started: float):
+        waited = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._counters["wait_ms_total"] += waited
+            self._counters["wait_ms_max"] = max(self._counters["wait_ms_max"], waited)
+
+    def _timeout_error(self) -> Overloaded:
+        with self._lock:
+            retry_after = self._retry_after_locked()
+        return Overloaded(503, "Tutor is busy, please retry shortly", retry_after)
+
+    @contextmanager
+    def slot(self):
+        """Hold an upstream slot for the duration of a blocking call."""
+        user = _current_user.get()
+        started = time.perf_counter()
+        event = threading.Event()
+        waiter = self._reserve(user, event.set)
+        if waiter is not None and not event.wait(self.queue_timeout) and self._abandon(waiter):
+            raise self._timeout_error()
+        self._record_wait(started)
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(user, time.perf_counter() - began)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async twin of `slot`; waiting does not block the event loop."""
+        user = _current_user.get()
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        waiter = self._reserve(user, wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    raise self._timeout_error()
+            except asyncio.CancelledError:
+                if not self._abandon(waiter, "cancelled"):
+                    self._release(user, 0.0)
+                raise
+        self._record_wait(started)
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(user, time.perf_counter() - began)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["in_flight"] = self._in_flight
+            out["queue_depth"] = len(self._queue)
+            out["active_users"] = len([u for u in self._per_user if u is not None])
+            out["avg_service_ms"] = round(self._service_ewma * 1000, 1)
+        waited = out.pop("wait_ms_total")
+        out["avg_wait_ms"] = round(waited / out["admitted"], 2) if out["admitted"] else 0.0
+        out["wait_ms_max"] = round(out["wait_ms_max"], 2)
+        out["limits"] = {
+            "max_in_flight": self.max_in_flight, "max_per_user": self.max_per_user,
+            "max_queue": self.max_queue, "queue_timeout": self.queue_timeout,
+        }
+        return out
+
+
+controller = AdmissionController(LLM_MAX_IN_FLIGHT, LLM_MAX_PER_USER, LLM_QUEUE_MAX, LLM_QUEUE_TIMEOUT)
+slot = controller.slot
+aslot = controller.aslot
+stats = controller.stats
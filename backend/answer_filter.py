@@ -0,0 +1,238 @@
+import os
+import re
+import json
+import math
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+ANSWER_FILTER_ENABLED = os.getenv("ANSWER_FILTER_ENABLED", "true").lower() == "true"
+# Skip grading when P(final answer) is below this. Keep it low: a skipped real
+# answer costs the student a point, a graded non-answer only costs an LLM call.
+ANSWER_FILTER_THRESHOLD = float(os.getenv("ANSWER_FILTER_THRESHOLD", "0.15"))
+# Minimum labelled messages before the learned model is trusted
+ANSWER_FILTER_MIN_SAMPLES = int(os.getenv("ANSWER_FILTER_MIN_SAMPLES", "200"))
+# The saved model is retrained at startup once it is this many days old, or once
+# the labelled messages have grown by this fraction since it was trained
+ANSWER_FILTER_RETRAIN_DAYS = float(os.getenv("ANSWER_FILTER_RETRAIN_DAYS", "7"))
+ANSWER_FILTER_RETRAIN_GROWTH = float(os.getenv("ANSWER_FILTER_RETRAIN_GROWTH", "0.2"))
+ANSWER_FILTER_MODEL_PATH = os.getenv(
+    "ANSWER_FILTER_MODEL_PATH",
+    os.path.join(os.path.dirname(__file__), "answer_filter_model.json"),
+)
+
+# Messages that are clearly not an attempt at an answer: made up only of these
+# phrases ("ok thanks!", "hi, can you help me"). A message that merely starts
+# with one ("ok the answer is seven") may be an answer and is not matched.
+_NON_ANSWER = re.compile(
+    r"^(?:(?:hi+|hello|hey|thanks?|thank you|ok(?:ay)?|bye|good (?:morning|night)|"
+    r"i (?:don'?t|do not|dont) (?:understand|know|get it)|idk|help(?: me)?|(?:give me |another )?hint(?: please)?|"
+    r"what|why|how|can you|could you|please explain|explain|teach me|i need help|i'?m (?:confused|stuck))\b[\s,!.?]*)+$",
+    re.I,
+)
+_TOKEN = re.compile(r"\d+(?:[./]\d+)?|[a-z']+|[?=+\-*/×÷]", re.I)
+
+_lock = threading.Lock()
+_counters = {"checked": 0, "skipped_rule": 0, "skipped_model": 0, "passed": 0}
+
+
+def rule_verdict(text: str | None) -> bool | None:
+    """Cheap rules: False for a clear non-answer, None when the rules can't tell."""
+    s = (text or "").strip()
+    if not s:
+        return None  # image-only messages may well be a worked answer
+    if re.search(r"\d", s):
+        return None  # anything with a number may be an answer
+    if s.endswith("?") or _NON_ANSWER.match(s):
+        return False
+    return None
+
+
+def features(text: str | None) -> list[str]:
+    """Bag-of-tokens plus shape features for the naive Bayes model."""
+    s = (text or "").strip().lower()
+    feats = []
+    for tok in _TOKEN.findall(s):
+        if re.fullmatch(r"\d+/\d+", tok):
+            feats.append("<frac>")
+        elif re.fullmatch(r"\d+(?:\.\d+)?", tok):
+            feats.append("<num>")
+        else:
+            feats.append(tok)
+    words = len(s.split())
+    feats.append(f"<len:{min(words, 8)}>")
+    if s.endswith("?"):
+        feats.append("<ends_q>")
+    if re.fullmatch(r"[-\d\s./=x]+", s):
+        feats.append("<only_math>")
+    return feats
+
+
+class NaiveBayes:
+    """Two-class multinomial naive Bayes (final / not final) with Laplace smoothing."""
+
+    def __init__(self, counts: dict | None = None, totals: dict | None = None, docs: dict | None = None):
+        self.counts = counts or {"1": {}, "0": {}}
+        self.totals = totals or {"1": 0, "0": 0}
+        self.docs = docs or {"1": 0, "0": 0}
+
+    @classmethod
+    def train(cls, samples: list[tuple[str, bool]]) -> "NaiveBayes":
+        counts = {"1": Counter(), "0": Counter()}
+        docs = {"1": 0, "0": 0}
+        for text, label in samples:
+            key = "1" if label else "0"
+            counts[key].update(features(text))
+            docs[key] += 1
+        totals = {k: sum(c.values()) for k, c in counts.items()}
+        return cls({k: dict(c) for k, c in counts.items()}, totals, docs)
+
+    @property
+    def size(self) -> int:
+        return self.docs["1"] + self.docs["0"]
+
+    def probability_final(self, text: str | None) -> float:
+        vocab = len(set(self.counts["1"]) | set(self.counts["0"])) or 1
+        scores = {}
+        for key in ("1", "0"):
+            prior = (self.docs[key] + 1) / (self.size + 2)
+            score = math.log(prior)
+            denom = self.totals[key] + vocab
+            for f in features(text):
+                score += math.log((self.counts[key].get(f, 0) + 1) / denom)
+            scores[key] = score
+        top = max(scores.values())
+        e1, e0 = math.exp(scores["1"] - top), math.exp(scores["0"] - top)
+        return e1 / (e1 + e0)
+
+    def to_dict(self) -> dict:
+        return {"counts": self.counts, "totals": self.totals, "docs": self.docs}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NaiveBayes":
+        return cls(data["counts"], data["totals"], data["docs"])
+
+
+_model: NaiveBayes | None = None
+
+
+def _labelled_query(db, *columns):
+    from models.models import Message
+
+    return db.query(*columns).filter(
+        Message.sender == "user", Message.is_final.isnot(None), Message.text.isnot(None)
+    )
+
+
+def labelled_samples(db) -> list[tuple[str, bool]]:
+    """User messages the grader has judged, as (text, is_final) pairs."""
+    from models.models import Message
+
+    rows = _labelled_query(db, Message.text, Message.is_final).all()
+    return [(text, bool(is_final)) for text, is_final in rows]
+
+
+def labelled_count(db) -> int:
+    from sqlalchemy import func
+    from models.models import Message
+
+    return _labelled_query(db, func.count(Message.id)).scalar() or 0
+
+
+def is_stale(model: NaiveBayes, trained_at: float, db) -> bool:
+    """True when the saved model is older than RETRAIN_DAYS or the labels have grown past RETRAIN_GROWTH."""
+    age_days = (time.time() - trained_at) / 86400
+    if age_days >= ANSWER_FILTER_RETRAIN_DAYS:
+        logger.info(f"Answer filter model is {age_days:.1f} days old — retraining")
+        return True
+    count = labelled_count(db)
+    if count >= model.size * (1 + ANSWER_FILTER_RETRAIN_GROWTH):
+        logger.info(f"Answer filter model trained on {model.size} messages, {count} labelled now — retraining")
+        return True
+    return False
+
+
+def train_from_db(db, save: bool = True) -> NaiveBayes | None:
+    """Train on stored grader verdicts; installs the model if there is enough data."""
+    global _model
+    samples = labelled_samples(db)
+    if len(samples) < ANSWER_FILTER_MIN_SAMPLES:
+        logger.info(f"Answer filter: {len(samples)} labelled messages, need {ANSWER_FILTER_MIN_SAMPLES} — rules only")
+        return None
+    model = NaiveBayes.train(samples)
+    _model = model
+    if save:
+        with open(ANSWER_FILTER_MODEL_PATH, "w", encoding="utf-8") as f:
+            json.dump(model.to_dict(), f)
+    logger.info(f"Answer filter trained on {model.size} labelled messages")
+    return model
+
+
+def load_or_train(db) -> None:
+    """Load the saved model, or train one from the messages table (called at startup).
+
+    A saved model that `is_stale` is retrained; if there are not enough
+    labels to retrain, the saved one is kept.
+    """
+    global _model
+    try:
+        if os.path.exists(ANSWER_FILTER_MODEL_PATH):
+            with open(ANSWER_FILTER_MODEL_PATH, "r", encoding="utf-8") as f:
+                _model = NaiveBayes.from_dict(json.load(f))
+            logger.info(f"Answer filter model loaded ({_model.size} samples)")
+            if is_stale(_model, os.path.getmtime(ANSWER_FILTER_MODEL_PATH), db):
+                train_from_db(db)
+        else:
+            train_from_db(db)
+    except Exception as e:
+        logger.error(f"Answer filter model unavailable, using rules only: {e}")
+
+
+def should_skip_grading(text: str | None, threshold: float | None = None, model: NaiveBayes | None = None) -> str | None:
+    """Return why grading can be skipped ("rule"/"model"), or None to grade as usual."""
+    threshold = ANSWER_FILTER_THRESHOLD if threshold is None else threshold
+    model = model or _model
+    if rule_verdict(text) is False:
+        return "rule"
+    if model is not None and (text or "").strip() and model.probability_final(text) < threshold:
+        return "model"
+    return None
+
+
+def check(text: str | None) -> dict | None:
+    """Pre-filter for `check_answer`: a `final=False` judge for non-answers, else None."""
+    if not ANSWER_FILTER_ENABLED:
+        return None
+    reason = should_skip_grading(text)
+    with _lock:
+        _counters["checked"] += 1
+        _counters[f"skipped_{reason}" if reason else "passed"] += 1
+    if reason is None:
+        return None
+    return {"final": False, "correct": False, "feedback": "Not a final answer", "source": "prefilter"}
+
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_counters)
+    skipped = out["skipped_rule"] + out["skipped_model"]
+    out["skip_rate"] = round(skipped / out["checked"], 4) if out["checked"] else 0.0
+    out["model_samples"] = _model.size if _model else 0
+    return out
+
+
+if __name__ == "__main__":
+    # Retrain now instead of waiting for a stale model at startup:
+    #     python answer_filter.py
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    db = SessionLocal()
+    try:
+        sys.exit(0 if train_from_db(db) else 1)
+    finally:
+        db.close()
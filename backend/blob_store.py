@@ -0,0 +1,128 @@
+"""Content-addressed store for chat images.
+
+Uploaded images used to be kept as base64 data URLs in `messages.image`, so
+every chat listing dragged megabytes out of SQLite and through Pydantic.
+`store_image` writes the decoded bytes once to BLOB_DIR under their sha256
+(`ab/abcdef....jpg`) and returns the URL path (`/blobs/ab/abcdef....jpg`)
+that goes into the row instead. Identical uploads map to the same file.
+
+Files never change once written, so `/blobs` is served with a one-year
+`immutable` Cache-Control (see `ImmutableStaticFiles`).
+
+Existing rows are moved over with `migrate_images.py`.
+"""
+import os
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+from starlette.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = Path(os.getenv("BLOB_DIR", str(Path(__file__).resolve().parent / "uploads" / "blobs")))
+BLOB_URL_PREFIX = "/blobs"
+BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# mime type -> file extension, and magic bytes for uploads without a data: prefix
+_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+_MAGIC = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+]
+
+_lock = threading.Lock()
+_counters = {"stored": 0, "deduplicated": 0, "bytes_stored": 0, "failed": 0}
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def is_blob_url(value: str | None) -> bool:
+    return bool(value) and value.startswith(BLOB_URL_PREFIX + "/")
+
+
+def _sniff(data: bytes) -> str | None:
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def decode_image(image: str) -> tuple[bytes, str | None]:
+    """Bytes and mime type of a base64 image or data URL."""
+    mime = None
+    if image.startswith("data:"):
+        header, image = image.split(",", 1)
+        mime = header[5:].split(";", 1)[0] or None
+    data = base64.b64decode(image, validate=False)
+    return data, _sniff(data) or mime
+
+
+def put(data: bytes, mime: str | None = None) -> str:
+    """Write bytes under their sha256 (no-op if already stored); returns the blob URL path."""
+    digest = hashlib.sha256(data).hexdigest()
+    relative = f"{digest[:2]}/{digest}.{_EXTENSIONS.get(mime or '', 'bin')}"
+    path = BLOB_DIR / relative
+    if path.exists():
+        _count("deduplicated")
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        _count("stored")
+        _count("bytes_stored", len(data))
+    return f"{BLOB_URL_PREFIX}/{relative}"
+
+
+def store_image(image: str | None) -> str | None:
+    """Store an uploaded image and return what to keep in `messages.image`.
+
+    Blob URLs are returned unchanged. If the image cannot be decoded it is
+    kept as sent, so nothing the student uploaded is lost.
+    """
+    if not image or is_blob_url(image):
+        return image
+    try:
+        data, mime = decode_image(image)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Could not decode image for the blob store, keeping it inline: {e}")
+        _count("failed")
+        return image
+    if not data:
+        return image
+    return put(data, mime)
+
+
+def path_for(url: str) -> Path:
+    """Local file behind a blob URL."""
+    return BLOB_DIR / url[len(BLOB_URL_PREFIX) + 1:]
+
+
+def stats() -> dict:
+    with _lock:
+        return {"dir": str(BLOB_DIR), **_counters}
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for content-addressed files: cacheable forever by browsers and proxies."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = BLOB_CACHE_CONTROL
+        return response
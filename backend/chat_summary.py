@@ -0,0 +1,92 @@
+import os
+import logging
+import threading
+
+from database import SessionLocal
+from models.models import Chat, Message
+import context_builder
+
+logger = logging.getLogger(__name__)
+
+CHAT_SUMMARY_ENABLED = os.getenv("CHAT_SUMMARY_ENABLED", "true").lower() == "true"
+# Fold messages into the summary once this many have piled up past the kept turns
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "8"))
+# Newest messages always left out of the summary and sent verbatim
+CHAT_SUMMARY_KEEP_TURNS = int(os.getenv("CHAT_SUMMARY_KEEP_TURNS", "4"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "200"))
+# Cap on the transcript sent for one summary update
+_TRANSCRIPT_TOKENS = 2000
+
+_lock = threading.Lock()
+_running: set[int] = set()
+
+
+def hint_context(db, chat: Chat | None, budget: int | None = None, pending: list = ()) -> context_builder.Context:
+    """Summary + the newest unsummarized messages that fit the hint budget.
+
+    `pending` are (sender, text) turns of the current request that are not
+    saved yet; `chat` is None for a chat that doesn't exist yet.
+    """
+    budget = budget or context_builder.CONTEXT_HINT_TOKENS
+    if chat is None:
+        return context_builder.pack(list(pending), budget)
+    if not CHAT_SUMMARY_ENABLED or not chat.summary:
+        return context_builder.pack(context_builder.fetch_recent(db, chat.id) + list(pending), budget)
+    messages = context_builder.fetch_recent(db, chat.id, after_id=chat.summary_upto_id)
+    return context_builder.pack(messages + list(pending), budget, summary=chat.summary)
+
+
+def refresh(chat_id: int):
+    """Fold older unsummarized messages of a chat into its summary.
+
+    Runs as a background task (own session). Does nothing until at least
+    CHAT_SUMMARY_EVERY messages are waiting beyond the kept turns, so it is
+    cheap to schedule after every message.
+    """
+    if not CHAT_SUMMARY_ENABLED:
+        return
+    with _lock:
+        if chat_id in _running:
+            return
+        _running.add(chat_id)
+    db = SessionLocal()
+    try:
+        chat = db.query(Chat).filter(Chat.id == chat_id).first()
+        if not chat:
+            return
+        after = chat.summary_upto_id or 0
+        pending = (
+            db.query(Message.id, Message.sender, Message.text)
+            .filter(Message.chat_id == chat_id, Message.id > after)
+            .order_by(Message.id)
+            .all()
+        )
+        if len(pending) < CHAT_SUMMARY_EVERY + CHAT_SUMMARY_KEEP_TURNS:
+            return
+
+        fold = pending[: len(pending) - CHAT_SUMMARY_KEEP_TURNS]
+        transcript = "\n".join(f"{m.sender.capitalize()}: {m.text}" for m in fold if m.text)
+        transcript = context_builder.fit_text(transcript, _TRANSCRIPT_TOKENS)
+
+        import llm
+        summary = llm.summarize_chat(chat.summary, transcript, max_tokens=CHAT_SUMMARY_MAX_TOKENS)
+        if not summary:
+            return
+
+        # Only write if nobody else moved the summary forward meanwhile
+        unchanged = Chat.summary_upto_id.is_(None) if chat.summary_upto_id is None else Chat.summary_upto_id == chat.summary_upto_id
+        updated = (
+            db.query(Chat)
+            .filter(Chat.id == chat_id, unchanged)
+            .update({Chat.summary: summary, Chat.summary_upto_id: fold[-1].id}, synchronize_session=False)
+        )
+        db.commit()
+        if updated:
+            logger.info(f"Chat {chat_id} summary updated through message {fold[-1].id} ({len(fold)} messages folded)")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Chat summary update failed for chat {chat_id}: {e}")
+    finally:
+        db.close()
+        with _lock:
+            _running.discard(chat_id)
@@ -0,0 +1,88 @@
+import os
+import re
+import logging
+
+from database import SessionLocal
+from models.models import Chat
+
+logger = logging.getLogger(__name__)
+
+# When false, chats keep the local keyword title and no title LLM call is made
+LLM_CHAT_TITLES = os.getenv("LLM_CHAT_TITLES", "true").lower() == "true"
+_MAX_WORDS = 4
+_MAX_LEN = 60
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "then", "so", "of", "to", "in", "on", "at", "by", "for", "with",
+    "from", "into", "about", "is", "are", "was", "were", "be", "been", "am", "do", "does", "did", "can", "could",
+    "will", "would", "should", "shall", "may", "might", "must", "what", "whats", "which", "who", "whom", "whose",
+    "why", "how", "when", "where", "this", "that", "these", "those", "it", "its", "i", "me", "my", "we", "our",
+    "you", "your", "he", "she", "they", "them", "their", "please", "help", "hi", "hello", "hey", "thanks", "thank",
+    "ok", "okay", "tell", "explain", "solve", "find", "calculate", "answer", "question", "want", "need", "know",
+    "get", "give", "not", "dont", "don", "understand", "there", "here", "some", "any", "just", "also", "very",
+    "much", "many", "more", "less", "than", "has", "have", "had", "let", "lets", "us", "same", "way", "like",
+}
+# First match wins; the label is used when the message has no topic word of its own
+_TOPICS = [
+    (re.compile(r"\d\s*/\s*\d|fraction", re.I), "Fractions"),
+    (re.compile(r"percent|%", re.I), "Percentages"),
+    (re.compile(r"\d\s*\.\d|decimal", re.I), "Decimals"),
+    (re.compile(r"\b[a-z]\s*=|=\s*[a-z]\b|\d[a-z]\b|equation", re.I), "Equations"),
+    (re.compile(r"area|perimeter|angle|triangle|circle|square|rectangle|volume", re.I), "Geometry"),
+    (re.compile(r"\d\s*[x×*]\s*\d|multipl|times|product", re.I), "Multiplication"),
+    (re.compile(r"\d\s*÷\s*\d|divi|quotient", re.I), "Division"),
+    (re.compile(r"\d\s*[-−]\s*\d|subtract|minus|difference", re.I), "Subtraction"),
+    (re.compile(r"\d\s*\+\s*\d|\badd|\bsum\b|plus", re.I), "Addition"),
+]
+
+
+def local_title(text: str | None) -> str:
+    """Cheap chat title from the first message: a math topic plus a few keywords."""
+    s = (text or "").strip()
+    if not s:
+        return "Image Chat"
+    keywords = []
+    for word in re.findall(r"[A-Za-z]+", s):
+        w = word.lower()
+        if len(w) > 2 and w not in _STOPWORDS and w not in (k.lower() for k in keywords):
+            keywords.append(word.capitalize())
+    topic = next((label for pattern, label in _TOPICS if pattern.search(s)), None)
+    words = keywords[:_MAX_WORDS]
+    if topic and not any(topic[:5].lower() in w.lower() or w.lower()[:5] in topic.lower() for w in words):
+        words = [topic] + words[: _MAX_WORDS - 1]
+    title = " ".join(words) if words else s
+    return title[:_MAX_LEN]
+
+
+def _clean_llm_title(title: str | None) -> str | None:
+    if not title or title.startswith("Error:"):
+        return None
+    title = title.strip().strip("\"'*#").strip()
+    title = title.splitlines()[0] if title else ""
+    return title[:_MAX_LEN] or None
+
+
+def refine_title(chat_id: int, text: str | None, placeholder: str):
+    """Replace a chat's local title with an LLM-generated one.
+
+    Runs as a background task after the first reply (own session). The title
+    is only patched if it still is the local placeholder.
+    """
+    if not LLM_CHAT_TITLES or not (text or "").strip():
+        return
+    import llm
+
+    title = _clean_llm_title(llm.get_chat_title(text))
+    if not title or title == placeholder:
+        return
+    db = SessionLocal()
+    try:
+        db.query(Chat).filter(Chat.id == chat_id, Chat.title == placeholder).update(
+            {Chat.title: title}, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Could not update title of chat {chat_id}: {e}")
+    finally:
+        db.close()
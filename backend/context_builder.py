@@ -0,0 +1,182 @@
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from sqlalchemy import desc
+
+logger = logging.getLogger(__name__)
+
+# Token budgets for the chat history packed into each kind of prompt
+CONTEXT_HINT_TOKENS = int(os.getenv("CONTEXT_HINT_TOKENS", "400"))
+CONTEXT_GRADER_TOKENS = int(os.getenv("CONTEXT_GRADER_TOKENS", "600"))
+# Upper bound on messages loaded from the DB before packing
+CONTEXT_FETCH_LIMIT = int(os.getenv("CONTEXT_FETCH_LIMIT", "30"))
+
+# Rough per-message framing cost (role, separators) and a flat cost per image
+_MESSAGE_OVERHEAD = 4
+_IMAGE_TOKENS = 258
+_SUMMARY_LABEL = "Summary of earlier conversation: "
+
+_lock = threading.Lock()
+_counters = {"calls": 0, "prompt_tokens": 0, "max_prompt_tokens": 0}
+
+
+def estimate_tokens(text: str | None) -> int:
+    """Fast local token estimate: ~4 bytes of UTF-8 per token.
+
+    Within ~10-20% of real tokenizers for English chat and math, and heavier
+    for non-Latin scripts (which really do cost more tokens per character).
+    """
+    if not text:
+        return 0
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def estimate_message_tokens(messages: list) -> int:
+    """Estimate the prompt tokens of a chat-completion `messages` list."""
+    total = 0
+    for m in messages:
+        total += _MESSAGE_OVERHEAD
+        content = m.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += estimate_tokens(part.get("text"))
+                else:
+                    total += _IMAGE_TOKENS
+    return total
+
+
+def _tail(text: str, budget: int) -> str:
+    """Keep the end of `text` within `budget` tokens (the latest part matters most)."""
+    max_bytes = budget * 4
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    return "…" + data[-(max_bytes - 3):].decode("utf-8", errors="ignore").lstrip()
+
+
+@dataclass
+class Context:
+    """Chat history packed newest-first into a token budget, kept oldest-first."""
+    turns: list = field(default_factory=list)  # [(sender, text)]
+    tokens: int = 0
+    dropped: int = 0  # older messages that did not fit
+    summary: str | None = None  # rolling summary of everything before `turns`
+
+    @property
+    def text(self) -> str:
+        """`Sender: text` lines, the format the hint prompt uses."""
+        lines = [f"{sender.capitalize()}: {text}" for sender, text in self.turns]
+        if self.summary:
+            lines.insert(0, f"{_SUMMARY_LABEL}{self.summary}")
+        return "\n".join(lines)
+
+    @property
+    def conversation(self) -> list:
+        """Chat-completion turns, the format the grader uses."""
+        return [
+            {"role": "assistant" if sender == "bot" else "user", "content": text}
+            for sender, text in self.turns
+        ]
+
+
+def pack(messages: list, budget: int, summary: str | None = None) -> Context:
+    """Pack the newest messages (oldest-first `Message` rows or (sender, text) pairs) into `budget` tokens.
+
+    The newest message is always kept, trimmed to its tail if it alone is over
+    budget. A `summary` of older history is placed first and counts against
+    the budget (it may use at most half of it).
+    """
+    turns = []
+    used = 0
+    if summary:
+        summary = _tail(summary, budget // 2)
+        used = estimate_tokens(_SUMMARY_LABEL + summary) + 1
+    items = [(m.sender, m.text) if hasattr(m, "sender") else tuple(m) for m in messages]
+    items = [(sender, text) for sender, text in items if text]
+    for idx in range(len(items) - 1, -1, -1):
+        sender, text = items[idx]
+        cost = estimate_tokens(f"{sender.capitalize()}: {text}") + 1
+        if used + cost > budget:
+            if not turns:
+                text = _tail(text, max(budget - used - 4, 1))
+                turns.append((sender, text))
+                used += estimate_tokens(f"{sender.capitalize()}: {text}") + 1
+                idx -= 1
+            return Context(list(reversed(turns)), used, idx + 1, summary)
+        turns.append((sender, text))
+        used += cost
+    return Context(list(reversed(turns)), used, 0, summary)
+
+
+def fit_text(text: str | None, budget: int) -> str:
+    """Trim a prebuilt `Sender: text` context to `budget` tokens, dropping whole old lines first."""
+    if not text or estimate_tokens(text) <= budget:
+        return text or ""
+    lines = text.split("\n")
+    kept = []
+    used = 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            if not kept:
+                kept.append(_tail(line, budget))
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(reversed(kept))
+
+
+def fit_conversation(conversation: list, budget: int) -> list:
+    """Keep the newest string-content turns of `conversation` within `budget` tokens."""
+    kept = []
+    used = 0
+    for turn in reversed(conversation):
+        content = turn.get("content")
+        cost = _MESSAGE_OVERHEAD + (estimate_tokens(content) if isinstance(content, str) else _IMAGE_TOKENS)
+        if used + cost > budget:
+            if not kept and isinstance(content, str):
+                kept.append({**turn, "content": _tail(content, max(budget - _MESSAGE_OVERHEAD, 1))})
+            break
+        kept.append(turn)
+        used += cost
+    return list(reversed(kept))
+
+
+def fetch_recent(db, chat_id: int, limit: int | None = None, after_id: int | None = None) -> list:
+    """Load the latest `limit` messages of a chat (newer than `after_id`), oldest first."""
+    from models.models import Message
+
+    query = db.query(Message).filter(Message.chat_id == chat_id)
+    if after_id:
+        query = query.filter(Message.id > after_id)
+    rows = (
+        query
+        .order_by(desc(Message.id))
+        .limit(limit or CONTEXT_FETCH_LIMIT)
+        .all()
+    )
+    rows.reverse()
+    return rows
+
+
+def record_prompt(messages: list) -> int:
+    """Estimate and count the tokens of a prompt about to be sent upstream."""
+    tokens = estimate_message_tokens(messages)
+    with _lock:
+        _counters["calls"] += 1
+        _counters["prompt_tokens"] += tokens
+        _counters["max_prompt_tokens"] = max(_counters["max_prompt_tokens"], tokens)
+    return tokens
+
+
+def stats() -> dict:
+    """Estimated prompt tokens sent upstream (total, average, largest)."""
+    with _lock:
+        out = dict(_counters)
+    out["avg_prompt_tokens"] = round(out["prompt_tokens"] / out["calls"], 1) if out["calls"] else 0.0
+    return out
@@ -0,0 +1,163 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+
+from database import SessionLocal
+from models.models import HintCache
+
+logger = logging.getLogger(__name__)
+
+HINT_CACHE_ENABLED = os.getenv("HINT_CACHE_ENABLED", "true").lower() == "true"
+HINT_CACHE_TTL_SECONDS = float(os.getenv("HINT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+HINT_CACHE_MAX_ENTRIES = int(os.getenv("HINT_CACHE_MAX_ENTRIES", "10000"))
+# Run LRU eviction every N writes instead of counting rows on every put
+_EVICT_EVERY = 50
+# Write a hit's last_used_at at most this often per entry (LRU order only needs
+# coarse times); hits in between are counted in memory and added on that write
+_TOUCH_EVERY_SECONDS = 60
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+_puts_since_evict = 0
+_pending_hits: dict[str, int] = {}
+
+
+def normalize_question(text: str | None) -> str:
+    """Normalize question text so trivially different phrasings share a key.
+
+    Lower-cases, folds unicode (e.g. full-width digits), maps ×/÷ to * and /,
+    removes spaces around operators and strips trailing punctuation.
+    """
+    if not text:
+        return ""
+    s = unicodedata.normalize("NFKC", text).lower()
+    s = s.replace("×", "*").replace("÷", "/").replace("−", "-")
+    s = re.sub(r"\s+", " ", s).strip()
+    s = re.sub(r"\s*([+\-*/=^()])\s*", r"\1", s)
+    return s.rstrip("?!. ")
+
+
+def make_key(class_number: int, question: str | None, last_context: str = "", image_b64: str | None = None) -> str:
+    """Build the cache key from class, normalized question and a context digest."""
+    context_digest = hashlib.sha256(normalize_question(last_context).encode("utf-8")).hexdigest()
+    parts = [str(class_number), normalize_question(question), context_digest]
+    if image_b64:
+        parts.append(hashlib.sha256(image_b64.encode("utf-8")).hexdigest())
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def record_bypass():
+    _count("bypassed")
+
+
+def get(key: str) -> str | None:
+    """Return the cached hint for `key`, or None on miss/expiry."""
+    db = SessionLocal()
+    try:
+        row = db.query(HintCache).filter(HintCache.key == key).first()
+        now = time.time()
+        if row is None:
+            _count("misses")
+            return None
+        if now - row.created_at > HINT_CACHE_TTL_SECONDS:
+            db.delete(row)
+            db.commit()
+            _count("misses")
+            return None
+        response = row.response
+        with _lock:
+            hits = _pending_hits.pop(key, 0) + 1
+            touch = now - (row.last_used_at or 0) >= _TOUCH_EVERY_SECONDS
+            if not touch:
+                _pending_hits[key] = hits
+        if touch:
+            row.last_used_at = now
+            row.hits = (row.hits or 0) + hits
+            db.commit()
+        _count("hits")
+        return response
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Hint cache lookup failed: {e}")
+        _count("misses")
+        return None
+    finally:
+        db.close()
+
+
+def put(key: str, class_number: int, question: str | None, response: str):
+    """Store a generated hint and periodically evict expired / least recently used rows."""
+    global _puts_since_evict
+    db = SessionLocal()
+    try:
+        now = time.time()
+        with _lock:
+            _pending_hits.pop(key, None)  # the new row starts at hits=0
+        db.merge(HintCache(
+            key=key,
+            class_number=class_number,
+            question=normalize_question(question),
+            response=response,
+            created_at=now,
+            last_used_at=now,
+            hits=0,
+        ))
+        db.commit()
+        _count("stores")
+
+        with _lock:
+            _puts_since_evict += 1
+            due = _puts_since_evict >= _EVICT_EVERY
+            if due:
+                _puts_since_evict = 0
+        if due:
+            _evict(db, now)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Hint cache store failed: {e}")
+    finally:
+        db.close()
+
+
+def _evict(db, now: float):
+    expired = (
+        db.query(HintCache)
+        .filter(HintCache.created_at < now - HINT_CACHE_TTL_SECONDS)
+        .delete(synchronize_session=False)
+    )
+    overflow = db.query(HintCache).count() - HINT_CACHE_MAX_ENTRIES
+    lru = 0
+    if overflow > 0:
+        oldest = (
+            db.query(HintCache.key)
+            .order_by(HintCache.last_used_at)
+            .limit(overflow)
+            .subquery()
+        )
+        lru = (
+            db.query(HintCache)
+            .filter(HintCache.key.in_(db.query(oldest.c.key)))
+            .delete(synchronize_session=False)
+        )
+    db.commit()
+    if expired or lru:
+        _count("evictions", expired + lru)
+        logger.info(f"Hint cache evicted {expired} expired and {lru} LRU entries")
+
+
+def stats() -> dict:
+    """Return cache counters plus the hit rate over cacheable lookups."""
+    with _lock:
+        out = dict(_counters)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+    return out
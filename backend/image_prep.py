@@ -0,0 +1,164 @@
+"""Shrink uploaded images before they are sent to the LLM.
+
+Students upload full-resolution phone photos (often several MB of base64).
+`prepare` decodes one, applies the EXIF orientation, downsizes it to
+IMAGE_MAX_DIM, converts it to grayscale and re-encodes it as JPEG or WebP.
+Results are kept in a small in-memory LRU keyed by the hash of the original
+bytes, so the same worksheet photo sent again (retries, hint + grader,
+follow-up questions) is only processed once.
+"""
+import io
+import os
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "true").lower() == "true"
+# Longest side in pixels after downscaling; worksheet text stays legible at ~1024
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "1024"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()  # jpeg | webp
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() == "true"
+IMAGE_PREP_CACHE_SIZE = int(os.getenv("IMAGE_PREP_CACHE_SIZE", "256"))
+
+_MIME = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png", "gif": "image/gif"}
+
+_lock = threading.Lock()
+_cache: "OrderedDict[str, PreparedImage]" = OrderedDict()
+_counters = {"processed": 0, "reused": 0, "passthrough": 0, "failed": 0, "rejected": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+class ImageTooLarge(HTTPException):
+    """The image's pixel count is over Pillow's decompression-bomb limit; served as a 413."""
+
+    def __init__(self):
+        super().__init__(status_code=413, detail="Image is too large, please upload a smaller photo")
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    b64: str
+    mime: str
+    digest: str  # sha256 of the bytes that are sent
+    width: int | None = None
+    height: int | None = None
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{self.b64}"
+
+
+def _strip_data_url(image: str) -> str:
+    return image.split(",", 1)[1] if image.startswith("data:") else image
+
+
+def _passthrough(b64: str, raw: bytes | None, mime: str = "image/png") -> PreparedImage:
+    digest = hashlib.sha256(raw if raw is not None else b64.encode("utf-8")).hexdigest()
+    return PreparedImage(b64=b64, mime=mime, digest=digest)
+
+
+def _encode(img: Image.Image) -> bytes:
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((IMAGE_MAX_DIM, IMAGE_MAX_DIM), Image.LANCZOS)
+    if IMAGE_GRAYSCALE:
+        img = img.convert("L")
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    out = io.BytesIO()
+    if IMAGE_FORMAT == "webp":
+        img.save(out, "WEBP", quality=IMAGE_QUALITY, method=4)
+    else:
+        img.save(out, "JPEG", quality=IMAGE_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def prepare(image: str) -> PreparedImage:
+    """Downscaled, recompressed version of a base64 image (or data URL).
+
+    Images that cannot be decoded are passed through unchanged, as is the
+    original when re-encoding would not make it smaller. Images over Pillow's
+    pixel limit (`Image.MAX_IMAGE_PIXELS`) raise `ImageTooLarge` rather than
+    being sent upstream.
+    """
+    b64 = _strip_data_url(image)
+    try:
+        raw = base64.b64decode(b64, validate=False)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Image is not valid base64, sending as-is: {e}")
+        _count("failed")
+        return _passthrough(b64, None)
+    if not IMAGE_PREP_ENABLED:
+        return _passthrough(b64, raw)
+
+    key = hashlib.sha256(raw).hexdigest()
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            _counters["reused"] += 1
+            return cached
+
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            original_mime = _MIME.get((img.format or "").lower(), "image/png")
+            original_size = img.size
+            data = _encode(img)
+            with Image.open(io.BytesIO(data)) as out:
+                size = out.size
+    except Image.DecompressionBombError as e:
+        logger.warning(f"Rejected uploaded image over the pixel limit: {e}")
+        _count("rejected")
+        raise ImageTooLarge() from e
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning(f"Could not decode uploaded image, sending as-is: {e}")
+        _count("failed")
+        return _passthrough(b64, raw)
+
+    if len(data) >= len(raw) and max(original_size) <= IMAGE_MAX_DIM:
+        # Already small (e.g. a tiny PNG diagram); keep the original bytes
+        prepared = PreparedImage(b64=b64, mime=original_mime, digest=key, width=original_size[0], height=original_size[1])
+        name = "passthrough"
+    else:
+        prepared = PreparedImage(
+            b64=base64.b64encode(data).decode("ascii"),
+            mime=_MIME["webp" if IMAGE_FORMAT == "webp" else "jpeg"],
+            digest=hashlib.sha256(data).hexdigest(),
+            width=size[0],
+            height=size[1],
+        )
+        name = "processed"
+        logger.info(
+            f"Image {original_size[0]}x{original_size[1]} {len(raw) // 1024}KB -> "
+            f"{size[0]}x{size[1]} {len(data) // 1024}KB {prepared.mime}"
+        )
+
+    with _lock:
+        _counters[name] += 1
+        _counters["bytes_in"] += len(raw)
+        _counters["bytes_out"] += len(raw) if name == "passthrough" else len(data)
+        _cache[key] = prepared
+        while len(_cache) > IMAGE_PREP_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return prepared
+
+
+def stats() -> dict:
+    """Images processed, reused from cache or passed through, and bytes saved."""
+    with _lock:
+        out = dict(_counters)
+        out["cached"] = len(_cache)
+    out["bytes_saved"] = out["bytes_in"] - out["bytes_out"]
+    return out
@@ -0,0 +1,214 @@
+"""Tolerant extraction of a JSON object from raw LLM output.
+
+LLM graders wrap JSON in code fences or prose, use single quotes or Python
+literals, leave trailing commas, add comments, or get cut off by `max_tokens`.
+`extract_json_object` finds the first balanced `{...}` in one left-to-right
+pass and repairs those mistakes while copying it, instead of running a
+cascade of regex rewrites over the whole text.
+"""
+import json
+
+_OPEN_QUOTES = {'"': '"', "'": "'", "“": "”", "”": "”", "‘": "’", "’": "’"}
+_CLOSE_QUOTES = {'"': '"“”', "'": "'‘’", "”": '"“”', "’": "'‘’"}
+_LITERALS = {"true": "true", "false": "false", "null": "null", "none": "null"}
+_VALID_ESCAPES = set('"\\/bfnrtu')
+
+
+def _next_significant(text: str, i: int) -> str:
+    """Next non-whitespace character at or after `i` ('' at end of text)."""
+    n = len(text)
+    while i < n and text[i] in " \t\r\n":
+        i += 1
+    return text[i] if i < n else ""
+
+
+def _read_string(text: str, i: int) -> tuple[str, int]:
+    """Read a quoted string starting at `text[i]`; return (JSON string literal, next index).
+
+    A quote only closes the string when followed by a JSON delimiter, so
+    unescaped inner quotes and apostrophes ("it's") survive.
+    """
+    closers = _CLOSE_QUOTES[_OPEN_QUOTES[text[i]]]
+    out = []
+    i += 1
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n:
+            nxt = text[i + 1]
+            if nxt in _VALID_ESCAPES:
+                out.append(ch + nxt)
+            elif nxt == "'":
+                out.append("'")
+            else:
+                out.append("\\\\" + nxt)
+            i += 2
+            continue
+        if ch in closers and _next_significant(text, i + 1) in (",", "}", "]", ":", ""):
+            return '"' + "".join(out) + '"', i + 1
+        if ch == '"':
+            out.append('\\"')
+        elif ch == "\n":
+            out.append("\\n")
+        elif ch == "\r":
+            out.append("\\r")
+        elif ch == "\t":
+            out.append("\\t")
+        else:
+            out.append(ch)
+        i += 1
+    # Truncated inside a string: close it
+    return '"' + "".join(out) + '"', n
+
+
+def _drop_trailing(out: list, chars: str) -> None:
+    """Remove trailing whitespace and one trailing char from `chars` in `out`."""
+    j = len(out)
+    while j and out[j - 1].isspace():
+        j -= 1
+    if j and out[j - 1] in chars:
+        del out[j - 1:]
+
+
+def _last_significant(out: list) -> str:
+    for piece in reversed(out):
+        if not piece.isspace():
+            return piece[-1]
+    return ""
+
+
+def repair_object(text: str, start: int) -> tuple[str, int]:
+    """Copy the object starting at `text[start] == '{'` as repaired JSON.
+
+    Returns (json_text, end_index). Unclosed objects (truncated output) are
+    closed at the end of the text.
+    """
+    out = []
+    stack = []
+    key_at = None  # index in `out` of a key still waiting for its value
+    value_key_at = None  # index in `out` of the key whose value is being read
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch in _OPEN_QUOTES:
+            literal, i = _read_string(text, i)
+            if stack and stack[-1] == "}" and _last_significant(out) in "{,":
+                key_at = len(out)
+            out.append(literal)
+            continue
+        if ch == ":":
+            value_key_at, key_at = key_at, None
+        if ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing(out, ",")
+            if _last_significant(out) == ":":
+                out.append("null")
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                return "".join(out), i + 1
+        elif ch == ",":
+            if _last_significant(out) not in ",{[":  # drop doubled/leading commas
+                out.append(ch)
+        elif ch == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif ch == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        elif ch.isdigit() or ch in "-+.":
+            j = i
+            while j < n and text[j] not in ",}]\n":
+                j += 1
+            token = text[i:j].strip()
+            try:
+                json.loads(token)
+                out.append(token)
+            except ValueError:
+                out.append(json.dumps(token))  # e.g. an unquoted 7/8
+            i = j
+            continue
+        elif ch.isalpha() or ch == "_":
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            if _next_significant(text, j) == ":":
+                if stack and stack[-1] == "}" and _last_significant(out) in "{,":
+                    key_at = len(out)
+                out.append(json.dumps(word))  # unquoted key
+            elif _next_significant(text, j) == "" and any(lit.startswith(word.lower()) for lit in _LITERALS if lit != word.lower()):
+                # Cut off inside true/false/null ("fa"): the value is unknown, so
+                # drop the whole field rather than turn it into a truthy string
+                if value_key_at is not None and _last_significant(out) == ":":
+                    del out[value_key_at:]
+            elif word.lower() in _LITERALS:
+                out.append(_LITERALS[word.lower()])
+            else:
+                # Bare word value: keep the rest of the value as a string
+                k = j
+                while k < n and text[k] not in ",}]\n":
+                    k += 1
+                out.append(json.dumps(text[i:k].strip()))
+                j = k
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # Truncated output: drop a dangling key, finish the last value and close
+    # every open bracket
+    if key_at is not None:
+        del out[key_at:]
+    _drop_trailing(out, ",")
+    if _last_significant(out) == ":":
+        out.append("null")
+    while stack:
+        _drop_trailing(out, ",")
+        out.append(stack.pop())
+    return "".join(out), n
+
+
+def extract_json_object(text: str | None, strict: bool = False) -> dict | None:
+    """Return the first JSON object that can be recovered from `text`, or None.
+
+    With `strict`, surrounding prose and code fences are still skipped, but
+    the first object must be valid, complete JSON as written: anything that
+    needs a repair (truncation, quotes, trailing commas...) gives None.
+    """
+    if not text:
+        return None
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        try:
+            obj = json.loads(stripped)
+            if type(obj) is dict:
+                return obj
+        except ValueError:
+            pass
+
+    pos = 0
+    while True:
+        start = text.find("{", pos)
+        if start == -1:
+            return None
+        candidate, end = repair_object(text, start)
+        if strict:
+            try:
+                obj = json.loads(text[start:end])
+            except ValueError:
+                return None
+            return obj if type(obj) is dict else None
+        try:
+            obj = json.loads(candidate)
+            if type(obj) is dict:
+                return obj
+        except ValueError:
+            pass
+        pos = start + 1
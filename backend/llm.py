@@ -1,20 +1,66 @@
 import os
-import json, re
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from functools import lru_cache
 import logging
+import httpx
+import litellm
 from dotenv import load_dotenv
-from litellm import completion
+from fastapi import HTTPException
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from litellm import completion, acompletion
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+from prompt_registry import PromptRegistry
+import hint_cache
+import context_builder
+import admission
+import resilience
+import json_extract
+import local_grader
+import image_prep
+import llm_transport
+import prompt_cache
+import llm_metrics
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Use gemini-2.0-flash (free tier available) instead of gemma-3-12b which doesn't exist via Gemini API
-MODEL_NAME = "gemini/gemini-2.5-flash-lite"  # format for LiteLLM Gemini
+MODEL_NAME = os.getenv("LLM_MODEL", "gemini/gemini-2.5-flash-lite")  # format for LiteLLM Gemini
 API_KEY = os.getenv("GEMINI_API_KEY")
+# Tried in order when the primary fails or its circuit is open (LiteLLM model names)
+FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if m.strip()]
+# Hint tiers: easy hints go to LLM_CHEAP_MODEL (unset = no tiering), the rest
+# and escalations to LLM_STRONG_MODEL (defaults to LLM_MODEL)
+LLM_CHEAP_MODEL = os.getenv("LLM_CHEAP_MODEL") or None
+LLM_STRONG_MODEL = os.getenv("LLM_STRONG_MODEL") or None
+LLM_CHEAP_MAX_CLASS = int(os.getenv("LLM_CHEAP_MAX_CLASS", "5"))
+LLM_CHEAP_MAX_CHARS = int(os.getenv("LLM_CHEAP_MAX_CHARS", "200"))
+# Optional endpoint override (an OpenAI-compatible proxy, or the offline fake server)
+LLM_API_BASE = os.getenv("LLM_API_BASE") or None
+# Total time budget for one call, across fallbacks and hedges
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
 
+# Shared async HTTP pool for the `a*` entry points. One pooled client per worker
+# keeps TLS connections to the provider warm instead of opening one per request.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+_async_client: AsyncHTTPHandler | None = None
+_aiohttp_session = None
 
 
 
-def load_prompt_for_class(class_number: int) -> dict:
+
+def _build_prompt_for_class(class_number: int) -> dict:
+    """Read the prompt and syllabus files and build the system message for a class.
+
+    This does the file I/O and JSON parsing; callers should go through
+    `load_prompt_for_class`, which serves prebuilt prompts from `PROMPTS`.
+    """
     # Map class_number to a prompt file. Default to class_5 style prompt if not found.
     mapping = {
         1: "prompts/one.json",
@@ -127,21 +173,509 @@ def load_prompt_for_class(class_number: int) -> dict:
     return prompt
 
 
+_BASE_DIR = os.path.dirname(__file__)
+PROMPTS = PromptRegistry(
+    _build_prompt_for_class,
+    source_files=[
+        os.path.join(_BASE_DIR, "prompts", "two.json"),
+        os.path.join(_BASE_DIR, "syllabus", "topics.json"),
+        os.path.join(_BASE_DIR, "syllabus", "class6-12.json"),
+    ],
+)
 
-def generate_hint(question: str,  last_context: str = "", image_b64 :str | None = None, user_class: int | str | None = None, parent_feedback: str | None = None, **kwargs) -> str:
-    """Generate a concise hint using a class-specific prompt.
-    Args:
-        question: The student's question text.
-        last_context: Recent chat context to include.
-        image_b64: Optional base64 PNG image string.
-        user_class: Class level (int like 5 or string like 'class_5' or '5').
 
-    Returns:
-        The LLM's reply string.    """
+def load_prompt_for_class(class_number: int) -> dict:
+    """Return the system message for a class from the prompt registry."""
+    try:
+        cls_num = int(class_number)
+    except Exception:
+        cls_num = 5
+    return PROMPTS.get(cls_num).as_message()
+
+
+def _get_async_client() -> AsyncHTTPHandler:
+    """Return the process-wide pooled async HTTP client, creating it lazily.
+
+    It has to be created inside a running event loop, so this is only called
+    from the async entry points.
+    """
+    global _async_client, _aiohttp_session
+    if _async_client is None:
+        import aiohttp  # installed with litellm
+
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=LLM_MAX_CONNECTIONS, limit_per_host=LLM_MAX_CONNECTIONS)
+        )
+        _async_client = AsyncHTTPHandler(
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+            shared_session=_aiohttp_session,
+        )
+        # OpenAI-compatible providers read the shared session from litellm directly
+        litellm.aclient_session = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        )
+    return _async_client
+
+
+async def aclose_clients() -> None:
+    """Close the pooled async clients (called on app shutdown)."""
+    global _async_client, _aiohttp_session
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _aiohttp_session is not None:
+        await _aiohttp_session.close()
+        _aiohttp_session = None
+    if litellm.aclient_session is not None:
+        await litellm.aclient_session.aclose()
+        litellm.aclient_session = None
+
+
+# --- Resilience: deadlines, circuit breakers, hedging, fallback models ---
+_breakers: dict[str, resilience.CircuitBreaker] = {}
+_latency: dict[str, resilience.LatencyTracker] = {}
+_resilience_counters = {"fallback_calls": 0, "hedged_calls": 0, "deadline_exceeded": 0, "circuit_rejections": 0}
+_resilience_lock = threading.Lock()
+
+
+def _models(tier: str | None = None) -> list:
+    """Models to try in order: the tier's model (if any), the primary, then fallbacks."""
+    models = [_tier_model(tier), MODEL_NAME, *FALLBACK_MODELS]
+    return list(dict.fromkeys(m for m in models if m))
+
+
+def _breaker(model: str) -> resilience.CircuitBreaker:
+    if model not in _breakers:
+        _breakers[model] = resilience.CircuitBreaker(model)
+    return _breakers[model]
+
+
+def _tracker(model: str) -> resilience.LatencyTracker:
+    if model not in _latency:
+        _latency[model] = resilience.LatencyTracker()
+    return _latency[model]
+
+
+def _count(name: str):
+    with _resilience_lock:
+        _resilience_counters[name] += 1
+
+
+def _model_kwargs(model: str, kwargs: dict, timeout: float, is_async: bool = False) -> dict:
+    """Per-model provider settings on top of the caller's completion kwargs."""
+    kw = dict(kwargs)
+    if model.startswith("gemini/"):
+        kw.setdefault("api_key", API_KEY)
+        if is_async:
+            kw.setdefault("client", _get_async_client())
+    elif is_async:
+        _get_async_client()
+    if LLM_API_BASE:
+        kw.setdefault("api_base", LLM_API_BASE)
+    # No SDK-level retries: a failing model falls through to the next one instead
+    kw.setdefault("max_retries", 0)
+    kw["timeout"] = timeout
+    return kw
+
+
+def _live_completion(model: str, messages: list, **kwargs):
+    # Provider-side prompt caching applies to real calls only, so the
+    # record/replay transport keys on the full messages
+    sent, kw = prompt_cache.apply(model, messages, kwargs)
+    try:
+        return completion(model=model, messages=sent, **kw)
+    except Exception as e:
+        if "cached_content" not in kw or not prompt_cache.is_cache_error(e):
+            raise
+        prompt_cache.invalidate(kw["cached_content"])
+        return completion(model=model, messages=messages, **kwargs)
+
+
+async def _live_acompletion(model: str, messages: list, **kwargs):
+    sent, kw = prompt_cache.apply(model, messages, kwargs)
+    try:
+        return await acompletion(model=model, messages=sent, **kw)
+    except Exception as e:
+        if "cached_content" not in kw or not prompt_cache.is_cache_error(e):
+            raise
+        prompt_cache.invalidate(kw["cached_content"])
+        return await acompletion(model=model, messages=messages, **kwargs)
+
+
+def _no_model_left(error: Exception | None, deadline: float, timed_out: bool, tier: str | None = None) -> Exception:
+    """The error to raise once every model was tried, skipped or the deadline hit."""
+    if timed_out:
+        _count("deadline_exceeded")
+        return TimeoutError(f"LLM call exceeded its {deadline:g}s deadline")
+    if error is None:
+        _count("circuit_rejections")
+        return resilience.CircuitOpen(min(_breaker(m).retry_after() for m in _models(tier)))
+    return error
+
+
+def _on_hedge():
+    _count("hedged_calls")
+    llm_metrics.note_hedged()
+
+
+def _text(response) -> str:
+    return response["choices"][0]["message"]["content"].strip()
+
+
+def _complete_upstream(messages: list, deadline: float | None = None, tier: str | None = None, **kwargs) -> str:
+    """Run a blocking completion and return the stripped reply text.
+
+    Tries the `tier`'s model (see `choose_tier`), the primary model, then each
+    fallback, skipping models whose circuit is open, all within one
+    `deadline` (seconds).
+    """
+    tokens = context_builder.record_prompt(messages)
+    logger.info(f"LLM call prompt≈{tokens} tokens")
+    deadline = deadline or LLM_DEADLINE
+    deadline_at = time.monotonic() + deadline
+    error = None
+    timed_out = False
+    with admission.slot():
+        models = _models(tier)
+        for model in models:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            breaker = _breaker(model)
+            if not breaker.allow():
+                continue
+            start = time.perf_counter()
+            try:
+                response = llm_transport.completion(_live_completion, model, messages, **_model_kwargs(model, kwargs, remaining))
+            except Exception as e:
+                breaker.record_failure()
+                logger.warning(f"LLM call to {model} failed: {e}")
+                error = e
+                continue
+            elapsed = time.perf_counter() - start
+            breaker.record_success(elapsed)
+            _tracker(model).add(elapsed)
+            if model != models[0]:
+                _count("fallback_calls")
+            text = _text(response)
+            llm_metrics.note_response(model, messages, response, text, tier=tier, elapsed=elapsed)
+            return text
+    raise _no_model_left(error, deadline, timed_out or deadline_at <= time.monotonic(), tier)
+
+
+async def _acall_model(model: str, messages: list, kwargs: dict, timeout: float, tier: str | None = None) -> str:
+    start = time.perf_counter()
+    response = await llm_transport.acompletion(_live_acompletion, model, messages, **_model_kwargs(model, kwargs, timeout, is_async=True))
+    elapsed = time.perf_counter() - start
+    _tracker(model).add(elapsed)
+    text = _text(response)
+    llm_metrics.note_response(model, messages, response, text, tier=tier, elapsed=elapsed)
+    return text
+
+
+async def _acomplete_upstream(messages: list, deadline: float | None = None, tier: str | None = None, **kwargs) -> str:
+    """Async twin of `_complete_upstream` built on `acompletion` and the shared pool.
+
+    Slow calls are hedged: once a model's recent p95 latency has passed
+    without a reply, a second identical request races the first.
+    """
+    tokens = context_builder.record_prompt(messages)
+    logger.info(f"LLM call prompt≈{tokens} tokens")
+    deadline = deadline or LLM_DEADLINE
+    deadline_at = time.monotonic() + deadline
+    error = None
+    timed_out = False
+    async with admission.aslot():
+        models = _models(tier)
+        for model in models:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            breaker = _breaker(model)
+            if not breaker.allow():
+                continue
+            start = time.perf_counter()
+            try:
+                text = await asyncio.wait_for(
+                    resilience.hedged(
+                        lambda: _acall_model(model, messages, kwargs, remaining, tier),
+                        resilience.hedge_delay(_tracker(model)),
+                        on_hedge=_on_hedge,
+                    ),
+                    remaining,
+                )
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                logger.warning(f"LLM call to {model} failed: {e!r}")
+                error = e
+                continue
+            breaker.record_success(time.perf_counter() - start)
+            if model != models[0]:
+                _count("fallback_calls")
+            return text
+    raise _no_model_left(error, deadline, timed_out or deadline_at <= time.monotonic(), tier)
+
+
+def resilience_stats() -> dict:
+    """Circuit state and latency percentiles per model, plus fallback/hedge counts."""
+    with _resilience_lock:
+        out = dict(_resilience_counters)
+    out["models"] = {}
+    for model in dict.fromkeys(_models() + [m for m in (LLM_CHEAP_MODEL, LLM_STRONG_MODEL) if m]):
+        tracker = _tracker(model)
+        p50, p95 = tracker.percentile(50), tracker.percentile(95)
+        out["models"][model] = {
+            **_breaker(model).stats(),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+    return out
+
+
+# --- Single-flight coalescing ---
+# Identical requests that are in flight at the same time (e.g. a whole class
+# sending the projected question) share one upstream call. Followers wait for
+# the leader's result instead of issuing their own request.
+_inflight_async: dict[str, asyncio.Task] = {}
+_inflight_sync: dict[str, "_SyncFlight"] = {}
+_inflight_lock = threading.Lock()
+_coalesce_counters = {"upstream_calls": 0, "coalesced_calls": 0}
 
+
+class _SyncFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: str | None = None
+        self.error: BaseException | None = None
+
+
+def _fingerprint(messages: list, kwargs: dict) -> str:
+    """Stable hash of everything that determines the completion's output."""
+    params = {k: v for k, v in kwargs.items() if k not in ("client", "deadline")}
+    payload = json.dumps([MODEL_NAME, messages, params], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _count_flight(name: str):
+    with _inflight_lock:
+        _coalesce_counters[name] += 1
+
+
+def coalescing_stats() -> dict:
+    """Upstream calls made vs. calls saved by joining an in-flight request."""
+    with _inflight_lock:
+        out = dict(_coalesce_counters)
+        out["in_flight"] = len(_inflight_async) + len(_inflight_sync)
+    return out
+
+
+def _complete(messages: list, **kwargs) -> str:
+    """Blocking completion, coalesced with identical in-flight requests."""
+    key = _fingerprint(messages, kwargs)
+    with _inflight_lock:
+        flight = _inflight_sync.get(key)
+        leader = flight is None
+        if leader:
+            flight = _SyncFlight()
+            _inflight_sync[key] = flight
+            _coalesce_counters["upstream_calls"] += 1
+        else:
+            _coalesce_counters["coalesced_calls"] += 1
+
+    if not leader:
+        llm_metrics.note_cache("coalesced")
+        flight.done.wait()
+        if flight.error is not None:
+            llm_metrics.note_error(flight.error)
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = _complete_upstream(messages, **kwargs)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        llm_metrics.note_error(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_sync.pop(key, None)
+        flight.done.set()
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # Mark a failed shared task's exception as retrieved so it is not logged
+    # as "never retrieved" when every waiter has gone away.
+    if not task.cancelled():
+        task.exception()
+
+
+async def _acomplete(messages: list, **kwargs) -> str:
+    """Async completion, coalesced with identical in-flight requests.
+
+    The upstream call runs in its own task and is shielded, so a cancelled
+    caller does not cancel the request other waiters depend on.
+    """
+    key = _fingerprint(messages, kwargs)
+    task = _inflight_async.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_acomplete_upstream(messages, **kwargs))
+        _inflight_async[key] = task
+        task.add_done_callback(lambda t: _inflight_async.pop(key, None))
+        task.add_done_callback(_retrieve_exception)
+        _count_flight("upstream_calls")
+    else:
+        _count_flight("coalesced_calls")
+        llm_metrics.note_cache("coalesced")
+    try:
+        return await asyncio.shield(task)
+    except Exception as e:
+        # Callers like check_answer swallow errors; the call still counts as failed
+        llm_metrics.note_error(e)
+        raise
+
+
+async def _astream(messages: list, deadline: float | None = None, tier: str | None = None, **kwargs):
+    """Stream a completion, yielding text deltas as they arrive.
+
+    Logs time-to-first-token, the latency students actually perceive. Until
+    the first token is out, a failing model falls through to the next one
+    (within `deadline`); after that an error ends the stream.
+    """
+    tokens = context_builder.record_prompt(messages)
+    deadline = deadline or LLM_DEADLINE
+    deadline_at = time.monotonic() + deadline
+    error = None
+    timed_out = False
+    # The slot is held until the stream is fully consumed (or abandoned)
+    async with admission.aslot():
+        models = _models(tier)
+        for model in models:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            breaker = _breaker(model)
+            if not breaker.allow():
+                continue
+            start = time.perf_counter()
+            first_token_at = None
+            streamed = []
+            try:
+                response = await asyncio.wait_for(
+                    llm_transport.acompletion(_live_acompletion, model, messages, stream=True, **_model_kwargs(model, kwargs, remaining, is_async=True)),
+                    remaining,
+                )
+                async for chunk in response:
+                    delta = chunk["choices"][0]["delta"].get("content") if chunk["choices"] else None
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        delta = delta.lstrip()
+                        if not delta:
+                            continue
+                        first_token_at = time.perf_counter()
+                        logger.info(f"LLM stream {model} ttft={(first_token_at - start) * 1000:.0f}ms prompt≈{tokens} tokens")
+                    streamed.append(delta)
+                    yield delta
+            except (asyncio.CancelledError, GeneratorExit):
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                if first_token_at is not None:
+                    llm_metrics.note_response(model, messages, text="".join(streamed), tier=tier, elapsed=time.perf_counter() - start)
+                    raise
+                logger.warning(f"LLM stream from {model} failed before the first token: {e!r}")
+                error = e
+                continue
+            # Time-to-first-token is what decides whether a streaming call was slow
+            breaker.record_success((first_token_at or time.perf_counter()) - start)
+            if model != models[0]:
+                _count("fallback_calls")
+            llm_metrics.note_response(model, messages, text="".join(streamed), tier=tier, elapsed=time.perf_counter() - start)
+            logger.info(f"LLM stream total={(time.perf_counter() - start) * 1000:.0f}ms")
+            return
+    raise _no_model_left(error, deadline, timed_out or deadline_at <= time.monotonic(), tier)
+
+
+# --- Model tiers for hints ---
+
+_LOW_CONFIDENCE = re.compile(
+    r"i(?:'| a)m not (?:sure|certain)|i can(?:no|')t (?:help|determine|see|read|tell)|unable to|"
+    r"not enough information|(?:is|seems) unclear|could you (?:clarify|provide|share)|as an ai",
+    re.I,
+)
+_ASK_AGAIN = re.compile(
+    r"\b(?:again|still (?:don'?t|do not|not) (?:get|understand)|(?:don'?t|didn'?t|do not) (?:get|understand)|"
+    r"confused|another (?:hint|way)|explain (?:it )?(?:more|differently))\b",
+    re.I,
+)
+_MIN_HINT_CHARS = 20
+
+
+def _tier_model(tier: str | None) -> str | None:
+    if tier == "cheap":
+        return LLM_CHEAP_MODEL
+    if tier == "strong":
+        return LLM_STRONG_MODEL or MODEL_NAME
+    return None
+
+
+def choose_tier(question: str | None, user_class: int | str | None = None, has_image: bool = False, repeat: bool = False) -> str | None:
+    """Pick the model tier for a hint; None when tiering is off (no LLM_CHEAP_MODEL).
+
+    Lower-class, text-only, short questions go to the cheap model. Images,
+    higher classes, long questions and repeat asks go to the strong one.
+    """
+    from helper import normalize_class_to_number
+
+    if not LLM_CHEAP_MODEL:
+        return None
+    if has_image or normalize_class_to_number(user_class) > LLM_CHEAP_MAX_CLASS or len(question or "") > LLM_CHEAP_MAX_CHARS:
+        return "strong"
+    if repeat:
+        llm_metrics.note_escalation("cheap", "repeat")
+        return "strong"
+    return "cheap"
+
+
+def _asked_again(question: str | None, last_context: str = "") -> bool:
+    """Whether the student is repeating a question or saying the last hint didn't help."""
+    q = hint_cache.normalize_question(question)
+    if not q:
+        return False
+    if _ASK_AGAIN.search(question):
+        return True
+    # The current message is usually already the last "User:" line of the context
+    previous = [hint_cache.normalize_question(line[6:]) for line in (last_context or "").splitlines() if line.startswith("User: ")]
+    return previous.count(q) > (1 if previous and previous[-1] == q else 0)
+
+
+def _low_confidence(text: str) -> bool:
+    return len(text.strip()) < _MIN_HINT_CHARS or bool(_LOW_CONFIDENCE.search(text))
+
+
+def _escalate(text: str) -> bool:
+    """Whether a cheap-tier hint should be redone on the strong tier."""
+    if not _low_confidence(text):
+        return False
+    logger.info("Cheap-tier hint looked low-confidence, escalating to the strong tier")
+    llm_metrics.note_escalation("cheap", "low_confidence")
+    return True
+
+
+def _hint_messages(question: str, last_context: str = "", image_b64: str | None = None, user_class: int | str | None = None, parent_feedback: str | None = None) -> list:
+    """Build the system + user messages for a hint request."""
     # Import helper locally to avoid circular imports
     from helper import normalize_class_to_number
-    
+
     # Normalize/parse user_class into an integer class number used by prompt loader
     class_number = normalize_class_to_number(user_class)
     system_prompt = load_prompt_for_class(class_number)
@@ -149,6 +683,8 @@ def generate_hint(question: str,  last_context: str = "", image_b64 :str | None
     # Build message content and include the student class in the prompt
     # Include parent feedback in the prompt if present to give the LLM extra context
     feedback_section = f"\nParent feedback: {parent_feedback}" if parent_feedback else ""
+    # Callers may pass any amount of history; keep the newest lines within budget
+    last_context = context_builder.fit_text(last_context, context_builder.CONTEXT_HINT_TOKENS)
 
     content = [
         {
@@ -157,62 +693,182 @@ def generate_hint(question: str,  last_context: str = "", image_b64 :str | None
         }
     ]
 
-    # If an image is provided, attach it
+    # If an image is provided, attach it (downscaled and recompressed, see image_prep)
     if image_b64:
-        # Wrap in data URL format required by Gemini
-        image_data_url = f"data:image/png;base64,{image_b64}"
-        content.append({"type": "image_url", "image_url": image_data_url})
+        content.append({"type": "image_url", "image_url": image_prep.prepare(image_b64).data_url})
 
     # Build final messages
-    messages = [
+    return [
         system_prompt,
         {"role": "user", "content": content}
     ]
-    response = completion(
-        model=MODEL_NAME,
-        messages=messages,
-        api_key=API_KEY,
-    )
 
-    return response["choices"][0]["message"]["content"].strip()
 
+async def _aprepare_image(image_b64: str | None):
+    # Decode/resize off the event loop; `_hint_messages` then reuses the cached result
+    if image_b64:
+        await asyncio.to_thread(image_prep.prepare, image_b64)
+
+
+def _hint_cache_key(question, last_context, image_b64, user_class, parent_feedback, use_cache, cache_personalized) -> str | None:
+    """Return the hint cache key for a request, or None when it must bypass the cache.
+
+    Requests carrying an image or parent feedback are personal to one student
+    and only cached when `cache_personalized` is set explicitly.
+    """
+    from helper import normalize_class_to_number
+
+    if not hint_cache.HINT_CACHE_ENABLED or not use_cache:
+        return None
+    if (image_b64 or parent_feedback) and not cache_personalized:
+        hint_cache.record_bypass()
+        return None
+    context = last_context
+    if parent_feedback:
+        context = f"{last_context}\nParent feedback: {parent_feedback}"
+    return hint_cache.make_key(normalize_class_to_number(user_class), question, context, image_b64)
+
+
+@llm_metrics.instrument("generate_hint")
+def generate_hint(question: str,  last_context: str = "", image_b64 :str | None = None, user_class: int | str | None = None, parent_feedback: str | None = None, use_cache: bool = True, cache_personalized: bool = False, **kwargs) -> str:
+    """Generate a concise hint using a class-specific prompt.
+    Args:
+        question: The student's question text.
+        last_context: Recent chat context to include.
+        image_b64: Optional base64 image (any Pillow format; downscaled by `image_prep`).
+        user_class: Class level (int like 5 or string like 'class_5' or '5').
+        use_cache: Look the hint up in (and store it to) the hint response cache.
+        cache_personalized: Also cache requests with an image or parent feedback.
+
+    The model tier comes from `choose_tier`; a low-confidence cheap-tier reply
+    is redone on the strong tier.
+
+    Returns:
+        The LLM's reply string.    """
+    from helper import normalize_class_to_number
+
+    repeat = _asked_again(question, last_context)
+    tier = choose_tier(question, user_class, bool(image_b64), repeat)
+    key = _hint_cache_key(question, last_context, image_b64, user_class, parent_feedback, use_cache, cache_personalized)
+    # Asking again means the cached hint didn't help
+    if key and not repeat:
+        cached = hint_cache.get(key)
+        if cached is not None:
+            llm_metrics.note_cache("hint_cache")
+            return cached
+
+    messages = _hint_messages(question, last_context, image_b64, user_class, parent_feedback)
+    text = _complete(messages, tier=tier)
+    if tier == "cheap" and _escalate(text):
+        text = _complete(messages, tier="strong")
+    if key:
+        hint_cache.put(key, normalize_class_to_number(user_class), question, text)
+    return text
 
 
+@llm_metrics.instrument("generate_hint")
+async def agenerate_hint(question: str, last_context: str = "", image_b64: str | None = None, user_class: int | str | None = None, parent_feedback: str | None = None, use_cache: bool = True, cache_personalized: bool = False, **kwargs) -> str:
+    """Async variant of `generate_hint`."""
+    from helper import normalize_class_to_number
+
+    repeat = _asked_again(question, last_context)
+    tier = choose_tier(question, user_class, bool(image_b64), repeat)
+    key = _hint_cache_key(question, last_context, image_b64, user_class, parent_feedback, use_cache, cache_personalized)
+    if key and not repeat:
+        cached = await asyncio.to_thread(hint_cache.get, key)
+        if cached is not None:
+            llm_metrics.note_cache("hint_cache")
+            return cached
+
+    await _aprepare_image(image_b64)
+    messages = _hint_messages(question, last_context, image_b64, user_class, parent_feedback)
+    text = await _acomplete(messages, tier=tier)
+    if tier == "cheap" and _escalate(text):
+        text = await _acomplete(messages, tier="strong")
+    if key:
+        await asyncio.to_thread(hint_cache.put, key, normalize_class_to_number(user_class), question, text)
+    return text
+
+
+@llm_metrics.instrument("stream_hint")
+async def astream_hint(question: str, last_context: str = "", image_b64: str | None = None, user_class: int | str | None = None, parent_feedback: str | None = None, use_cache: bool = True, cache_personalized: bool = False, **kwargs):
+    """Streaming variant of `generate_hint`: yields the reply in text chunks.
+
+    A cache hit is yielded as a single chunk. A completed stream is stored in
+    the hint cache; a cancelled one is not. Streamed text can't be taken
+    back, so the tier is fixed up front (no low-confidence escalation).
+    """
+    from helper import normalize_class_to_number
+
+    repeat = _asked_again(question, last_context)
+    tier = choose_tier(question, user_class, bool(image_b64), repeat)
+    key = _hint_cache_key(question, last_context, image_b64, user_class, parent_feedback, use_cache, cache_personalized)
+    if key and not repeat:
+        cached = await asyncio.to_thread(hint_cache.get, key)
+        if cached is not None:
+            llm_metrics.note_cache("hint_cache")
+            yield cached
+            return
+
+    await _aprepare_image(image_b64)
+    messages = _hint_messages(question, last_context, image_b64, user_class, parent_feedback)
+    parts = []
+    async for delta in _astream(messages, tier=tier):
+        parts.append(delta)
+        yield delta
+    text = "".join(parts).strip()
+    if key and text:
+        await asyncio.to_thread(hint_cache.put, key, normalize_class_to_number(user_class), question, text)
+
+
+def _title_messages(text: str) -> list:
+    return [
+        {"role": "system", "content": "Generate an appropriate title for this message to be saved as chat title in the database, it will have more messages from user and llm, give most appropriate title in very short 3 or 4 words"},
+        {"role": "user", "content": text}
+    ]
+
+
+@llm_metrics.instrument("chat_title")
 def get_chat_title(text: str) -> str:
-    
+
     try:
-        messages = [
-            {"role": "system", "content": "Generate an appropriate title for this message to be saved as chat title in the database, it will have more messages from user and llm, give most appropriate title in very short 3 or 4 words"},
-            {"role": "user", "content": text}
-        ]
-        response = completion(
-            model=MODEL_NAME,
-            messages=messages,
-            api_key=API_KEY,
-        )
-        return response["choices"][0]["message"]["content"].strip()
+        return _complete(_title_messages(text))
     except Exception as e:
         return f"Error: {str(e)}"
-    
-def check_answer(conversation=None, question=None, answer=None, context=None, class_topics=None):
 
-    """
-    Evaluates if the student's last message is a final answer and whether it's correct.
-    Uses LiteLLM to call Gemini (or any configured model).
-    """
 
-    # --- Build conversation if not provided ---
-    if conversation is None:
-        conversation = []
-        if question:
-            conversation.append({"role": "assistant", "content": question})
-        if answer:
-            conversation.append({"role": "user", "content": answer})
-        if context:
-            conversation.append({"role": "system", "content": f"Context: {context}"})
+@llm_metrics.instrument("chat_title")
+async def aget_chat_title(text: str) -> str:
+    """Async variant of `get_chat_title`."""
+    try:
+        return await _acomplete(_title_messages(text))
+    except Exception as e:
+        return f"Error: {str(e)}"
 
-   
-    system_prompt = """
+
+SUMMARY_SYSTEM_PROMPT = """
+You keep a running summary of a maths tutoring chat between a student and a tutor.
+Merge the previous summary with the new messages into one updated summary.
+Keep: the problems worked on and their answers, what the student got right or wrong,
+misconceptions and hints already given, and the problem currently being solved.
+Drop greetings and small talk. Plain text, at most 120 words.
+"""
+
+
+def _summary_messages(previous_summary: str | None, transcript: str) -> list:
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Previous summary: {previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
+
+
+@llm_metrics.instrument("summarize_chat")
+def summarize_chat(previous_summary: str | None, transcript: str, max_tokens: int = 200) -> str:
+    """Fold `transcript` (`Sender: text` lines) into the chat's running summary."""
+    return _complete(_summary_messages(previous_summary, transcript), temperature=0.2, max_tokens=max_tokens)
+
+
+JUDGE_SYSTEM_PROMPT = """
 You are NOT a tutor or assistant. You are a grading engine that outputs only JSON.
 Do NOT write explanations, greetings, or questions.
 If you cannot determine the answer, still return valid JSON with false values.
@@ -227,84 +883,249 @@ Output format (must match exactly):
 }
 """
 
+
+def _build_conversation(conversation=None, question=None, answer=None, context=None) -> list:
+    # --- Build conversation if not provided ---
+    if conversation is None:
+        conversation = []
+        if question:
+            conversation.append({"role": "assistant", "content": question})
+        if answer:
+            conversation.append({"role": "user", "content": answer})
+        if context:
+            conversation.append({"role": "system", "content": f"Context: {context}"})
+    return conversation
+
+
+def _judge_messages(conversation: list) -> list:
+    return [
+        {"role": "system", "content": JUDGE_SYSTEM_PROMPT},
+        *context_builder.fit_conversation(conversation, context_builder.CONTEXT_GRADER_TOKENS)
+    ]
+
+
+def _parse_judge_output(text: str) -> dict:
+    """Turn the grader's raw reply into a judge dict, repairing common JSON slips."""
+    # Debug: log raw output so we can inspect failure cases
+    logger.debug(f"check_answer raw output: {repr(text[:2000])}")
+
+    result = json_extract.extract_json_object(text)
+    # A grade is only applied when both verdicts are real booleans; a truncated
+    # or odd reply must not count as a (wrong or right) final answer
+    if result is not None and type(result.get("final")) is bool and type(result.get("correct")) is bool:
+        return result
+
+    # If parsing ultimately failed, return a safe structured response with raw feedback
+    if result is None:
+        logger.warning("check_answer could not recover a JSON object from the grader output")
+    else:
+        logger.warning(f"check_answer output is missing a boolean final/correct: {result}")
+    return {"final": False, "correct": False, "feedback": "Error or invalid JSON", "raw": text}
+
+
+@lru_cache(maxsize=None)
+def _supports_json_mode(model: str) -> bool:
     try:
-        response = completion(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                *conversation
-            ],
-            api_key=API_KEY,
-            temperature=0.0,
-            max_tokens=300,
-        )
+        return "response_format" in (litellm.get_supported_openai_params(model) or [])
+    except Exception:
+        return False
 
-        text = response["choices"][0]["message"]["content"].strip()
 
-        # Debug: log raw output so we can inspect failure cases
-        logger.debug(f"check_answer raw output: {repr(text[:2000])}")
+def _json_mode_kwargs() -> dict:
+    """Ask the provider for a JSON-only reply when the model supports it."""
+    if _supports_json_mode(MODEL_NAME):
+        return {"response_format": {"type": "json_object"}}
+    return {}
 
-        # Remove fenced code blocks (```json ... ``` or ``` ... ```)
-        m_code = re.search(r"```(?:json)?\s*(.*?)\s*```", text, re.S | re.I)
-        if m_code:
-            text = m_code.group(1).strip()
 
-        # If still not obviously JSON, try to extract the first {...} block
-        match = re.search(r"\{.*\}", text, re.S)
-        if match:
-            text = match.group(0)
-        else:
-            # Fallback: try substring from first '{' to last '}' if present
-            first = text.find('{')
-            last = text.rfind('}')
-            if first != -1 and last != -1 and last > first:
-                text = text[first:last+1]
+@llm_metrics.instrument("check_answer")
+def check_answer(conversation=None, question=None, answer=None, context=None, class_topics=None):
+
+    """
+    Evaluates if the student's last message is a final answer and whether it's correct.
+    Simple numeric answers are graded locally by `local_grader`; everything
+    else uses LiteLLM to call Gemini (or any configured model).
+    """
+    conversation = _build_conversation(conversation, question, answer, context)
+    # Plain arithmetic/fraction/linear-equation answers are graded in-process
+    local = local_grader.grade(conversation)
+    if local is not None:
+        local_grader.record("local")
+        llm_metrics.note_cache("local_grader")
+        return local
+    local_grader.record("llm")
 
-        text = text.strip()
+    try:
+        text = _complete(
+            _judge_messages(conversation),
+            temperature=0.0,
+            max_tokens=300,
+            **_json_mode_kwargs(),
+        )
+        return _parse_judge_output(text)
 
-        # Try direct JSON parse first
-        try:
-            result = json.loads(text)
-            return result
-        except Exception as e:
-            # Attempt common sanitizations and retry
-            san = text
-            # Replace single quotes with double quotes when appropriate
-            if san.count("'") > san.count('"'):
-                san = san.replace("'", '"')
-            # Replace Python booleans/None to JSON equivalents
-            san = re.sub(r"\bTrue\b", "true", san)
-            san = re.sub(r"\bFalse\b", "false", san)
-            san = re.sub(r"\bNone\b", "null", san)
-            # Remove trailing commas before } or ]
-            san = re.sub(r",\s*([}\]])", r"\1", san)
+    except HTTPException:
+        # Overloaded / circuit open: fail fast with 429/503 instead of an ungraded "not final"
+        raise
+    except Exception as e:
+        logger.error(f"check_answer error: {e}")
+        return {"final": False, "correct": False, "feedback": "Error or invalid JSON"}
 
-            try:
-                result = json.loads(san)
-                return result
-            except Exception as e2:
-                logger.warning(f"check_answer parse retry failed: {e2}")
-                logger.debug(f"final sanitized attempt contents: {repr(san[:2000])}")
 
-        # If parsing ultimately failed, return a safe structured response with raw feedback
-        return {"final": False, "correct": False, "feedback": "Error or invalid JSON", "raw": text}
+@llm_metrics.instrument("check_answer")
+async def acheck_answer(conversation=None, question=None, answer=None, context=None, class_topics=None):
+    """Async variant of `check_answer`."""
+    conversation = _build_conversation(conversation, question, answer, context)
+    # Plain arithmetic/fraction/linear-equation answers are graded in-process
+    local = local_grader.grade(conversation)
+    if local is not None:
+        local_grader.record("local")
+        llm_metrics.note_cache("local_grader")
+        return local
+    local_grader.record("llm")
 
+    try:
+        text = await _acomplete(
+            _judge_messages(conversation),
+            temperature=0.0,
+            max_tokens=300,
+            **_json_mode_kwargs(),
+        )
+        return _parse_judge_output(text)
+
+    except HTTPException:
+        # Overloaded / circuit open: fail fast with 429/503 instead of an ungraded "not final"
+        raise
     except Exception as e:
         logger.error(f"check_answer error: {e}")
         return {"final": False, "correct": False, "feedback": "Error or invalid JSON"}
 
 
-def generate_parent_report(child: dict, comparison: dict | None = None) -> str:
-    """Generate a short descriptive, encouraging report for a parent.
+# --- Combined grade-and-hint mode ---
+# "combined": one structured completion returns the grade JSON and the hint;
+# "separate": the grader and the tutor run as two (concurrent) completions.
+GRADE_HINT_MODE = os.getenv("LLM_GRADE_HINT_MODE", "separate").lower()
+
+COMBINED_SYSTEM_PROMPT = """
+Besides tutoring, you also grade the student's latest message.
+"final" is whether the latest message is a final answer to your last question;
+"correct" is whether that final answer is correct (false if it is not final).
+Reply with ONLY a JSON object — no markdown, text, or code fences — in exactly this format:
+{
+  "final": true or false,
+  "correct": true or false,
+  "feedback": "short grading reasoning (1–2 lines)",
+  "correct_answer": "the correct answer, or empty string",
+  "hint": "your tutoring reply to the student, following all tutoring rules above"
+}
+"""
+
+
+class GradeAndHint(BaseModel):
+    """Schema of the combined grade-and-hint reply."""
+    final: bool
+    correct: bool
+    feedback: str = ""
+    correct_answer: str = ""
+    hint: str = Field(..., min_length=1)
+
+    @field_validator("correct_answer", mode="before")
+    @classmethod
+    def stringify_answer(cls, v):
+        # Models often return numeric answers as JSON numbers
+        return "" if v is None else str(v)
+
+
+def _combined_messages(conversation: list, question: str, image_b64: str | None = None, user_class: int | str | None = None, parent_feedback: str | None = None) -> list:
+    # The history turns carry the context, so the tutoring request itself
+    # only restates the latest question (plus image / parent feedback).
+    system_prompt, user_turn = _hint_messages(question, "", image_b64, user_class, parent_feedback)
+    return [
+        system_prompt,
+        {"role": "system", "content": COMBINED_SYSTEM_PROMPT},
+        *context_builder.fit_conversation(conversation[:-1], context_builder.CONTEXT_GRADER_TOKENS),
+        user_turn,
+    ]
 
-    Args:
-        child: Dict of child's stats with keys like name, username, class_level/level,
-               score, accuracy, total_attempts, correct_attempts, current_streak, max_streak.
-        comparison: Optional dict containing class-wide metrics (avg_score, rank, percentile, etc.).
+
+def _combined_kwargs() -> dict:
+    kwargs = {"temperature": 0.2}
+    if litellm.supports_response_schema(MODEL_NAME):
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "grade_and_hint", "schema": GradeAndHint.model_json_schema()},
+        }
+    return kwargs
+
+
+def _parse_combined(text: str) -> tuple[dict, str] | None:
+    """Validate the combined reply; None means fall back to the two-call path.
+
+    Only a reply whose JSON closed on its own is used: a repaired one may be
+    cut off mid-hint or mid-verdict.
+    """
+    logger.debug(f"grade_and_hint raw output: {repr(text[:2000])}")
+    data = json_extract.extract_json_object(text, strict=True)
+    if data is None:
+        logger.warning("grade_and_hint reply is not complete JSON (truncated or malformed)")
+        return None
+    try:
+        # Strict: no "true"/1 coerced into a verdict
+        reply = GradeAndHint.model_validate(data, strict=True)
+    except ValidationError as e:
+        logger.warning(f"grade_and_hint reply failed validation: {e.error_count()} errors")
+        return None
+    judge = {
+        "final": reply.final,
+        "correct": reply.correct and reply.final,
+        "feedback": reply.feedback,
+        "correct_answer": reply.correct_answer,
+    }
+    return judge, reply.hint.strip()
+
+
+@llm_metrics.instrument("grade_and_hint")
+async def agrade_and_hint(conversation: list, question: str, last_context: str = "", image_b64: str | None = None, user_class: int | str | None = None, parent_feedback: str | None = None) -> tuple[dict, str]:
+    """Grade the latest answer and produce the hint with one structured completion.
+
+    Answers the local grader can handle only need the hint. If the combined
+    reply is not valid JSON matching `GradeAndHint`, falls back to running
+    `acheck_answer` and `agenerate_hint` concurrently.
 
     Returns:
-        The report string.
+        (judge dict in `check_answer` format, hint text)
     """
+    hint_kwargs = dict(question=question, last_context=last_context, image_b64=image_b64, user_class=user_class, parent_feedback=parent_feedback)
+    local = local_grader.grade(conversation)
+    if local is not None:
+        local_grader.record("local")
+        llm_metrics.note_cache("local_grader")
+        return local, await agenerate_hint(**hint_kwargs)
+
+    await _aprepare_image(image_b64)
+    try:
+        text = await _acomplete(
+            _combined_messages(conversation, question, image_b64, user_class, parent_feedback),
+            **_combined_kwargs(),
+        )
+        parsed = _parse_combined(text)
+        if parsed is not None:
+            local_grader.record("llm")
+            return parsed
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"grade_and_hint error: {e}")
+
+    logger.info("grade_and_hint falling back to separate grade + hint calls")
+    judge, hint = await asyncio.gather(
+        acheck_answer(conversation=conversation),
+        agenerate_hint(**hint_kwargs),
+    )
+    return judge, hint
+
+
+def _parent_report_messages(child: dict, comparison: dict | None = None) -> list:
     # Prepare child summary lines safely
     name = child.get("name") or child.get("username") or "Child"
     cls = child.get("class_level") or child.get("level")
@@ -348,10 +1169,28 @@ def generate_parent_report(child: dict, comparison: dict | None = None) -> str:
         "Child Stats:\n" + child_summary + ("\n\nComparison:\n" + comparison_summary if comparison_summary else "")
     )
 
-    messages = [
+    return [
         system_prompt,
         {"role": "user", "content": user_content},
     ]
 
-    resp = completion(model=MODEL_NAME, messages=messages, api_key=API_KEY)
-    return resp["choices"][0]["message"]["content"].strip()
\ No newline at end of file
+
+@llm_metrics.instrument("parent_report")
+def generate_parent_report(child: dict, comparison: dict | None = None) -> str:
+    """Generate a short descriptive, encouraging report for a parent.
+
+    Args:
+        child: Dict of child's stats with keys like name, username, class_level/level,
+               score, accuracy, total_attempts, correct_attempts, current_streak, max_streak.
+        comparison: Optional dict containing class-wide metrics (avg_score, rank, percentile, etc.).
+
+    Returns:
+        The report string.
+    """
+    return _complete(_parent_report_messages(child, comparison))
+
+
+@llm_metrics.instrument("parent_report")
+async def agenerate_parent_report(child: dict, comparison: dict | None = None) -> str:
+    """Async variant of `generate_parent_report`."""
+    return await _acomplete(_parent_report_messages(child, comparison))
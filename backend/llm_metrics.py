@@ -0,0 +1,360 @@
+"""Per-call instrumentation of the LLM layer.
+
+Public `llm.py` functions are wrapped with `@instrument("<op>")`. Each call
+gets a `CallRecord` (held in a context variable) that the upstream code fills
+in: model, prompt/completion tokens, time-to-first-token, cache source and
+errors. When the call returns, the record is aggregated in memory by
+(op, route) and by model. The route comes from the `tag_route` app dependency.
+"""
+import os
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from collections import defaultdict, deque
+
+import litellm
+from fastapi import Request, HTTPException
+
+import context_builder
+
+logger = logging.getLogger(__name__)
+
+# Seconds between "LLM metrics" summary log lines (0 disables)
+LLM_METRICS_LOG_SECONDS = float(os.getenv("LLM_METRICS_LOG_SECONDS", "300"))
+_LATENCY_SAMPLES = 500
+
+_route = contextvars.ContextVar("llm_route", default="-")
+_record = contextvars.ContextVar("llm_record", default=None)
+
+
+class CallRecord:
+    __slots__ = ("op", "route", "model", "prompt_tokens", "completion_tokens", "cached_tokens", "cost", "ttft", "cache", "outcome", "hedged")
+
+    def __init__(self, op: str, route: str):
+        self.op = op
+        self.route = route
+        self.model = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0  # prompt tokens served from the provider's prompt cache
+        self.cost = 0.0
+        self.ttft = None
+        self.cache = None  # "hint_cache", "coalesced", "local_grader" when no upstream call was made
+        self.outcome = None  # set on failure; "ok" otherwise
+        self.hedged = False
+
+
+def _new_bucket() -> dict:
+    return {
+        "calls": 0, "errors": 0, "cache_hits": 0, "upstream_calls": 0, "hedged": 0,
+        "wall_ms_total": 0.0, "ttft_ms_total": 0.0, "ttft_count": 0,
+        "prompt_tokens": 0, "completion_tokens": 0, "cached_prompt_tokens": 0, "cost_usd": 0.0,
+        "outcomes": defaultdict(int), "latency_ms": deque(maxlen=_LATENCY_SAMPLES),
+    }
+
+
+def _new_tier_bucket() -> dict:
+    return {
+        "upstream_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+        "escalations": defaultdict(int), "latency_ms": deque(maxlen=_LATENCY_SAMPLES),
+    }
+
+
+_lock = threading.Lock()
+_by_endpoint: dict[tuple, dict] = defaultdict(_new_bucket)
+_by_model: dict[str, dict] = defaultdict(_new_bucket)
+_by_tier: dict[str, dict] = defaultdict(_new_tier_bucket)
+_started_at = time.time()
+
+
+async def tag_route(request: Request):
+    """App-wide dependency: tag LLM calls made while serving this request with its route."""
+    route = request.scope.get("route")
+    _route.set(f"{request.method} {getattr(route, 'path', request.url.path)}")
+
+
+def current() -> CallRecord | None:
+    return _record.get()
+
+
+def _classify(error: BaseException) -> str:
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    if isinstance(error, HTTPException):
+        return "rejected"  # admission control / open circuit
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    return "error"
+
+
+# --- Hooks called from llm.py ---
+
+def note_cache(source: str):
+    rec = _record.get()
+    if rec is not None:
+        rec.cache = source
+
+
+def note_error(error: BaseException):
+    """Mark the current call failed, even if the caller later swallows the error."""
+    rec = _record.get()
+    if rec is not None:
+        rec.outcome = _classify(error)
+
+
+def note_hedged():
+    rec = _record.get()
+    if rec is not None:
+        rec.hedged = True
+
+
+def _cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    try:
+        prompt_cost, completion_cost = litellm.cost_per_token(
+            model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            cache_read_input_tokens=cached_tokens or None,
+        )
+        return prompt_cost + completion_cost
+    except Exception:
+        return 0.0  # model missing from LiteLLM's price map
+
+
+def note_escalation(tier: str, reason: str):
+    with _lock:
+        _by_tier[tier]["escalations"][reason] += 1
+
+
+def note_response(model: str, messages: list, response=None, text: str | None = None,
+                  tier: str | None = None, elapsed: float | None = None):
+    """Record the model and token usage of a served upstream call.
+
+    Uses the provider's `usage` when present, else local estimates. Calls
+    routed to a model tier are also added to that tier's latency and spend.
+    """
+    rec = _record.get()
+    if rec is None and tier is None:
+        return
+    usage = None
+    try:
+        usage = response.get("usage") if response is not None else None
+    except Exception:
+        pass
+    prompt_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+    completion_tokens = getattr(usage, "completion_tokens", None) if usage is not None else None
+    details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    if not prompt_tokens:
+        prompt_tokens = context_builder.estimate_message_tokens(messages)
+    if not completion_tokens:
+        completion_tokens = context_builder.estimate_tokens(text)
+    cost = _cost(model, prompt_tokens, completion_tokens, cached_tokens)
+    if tier is not None:
+        with _lock:
+            bucket = _by_tier[tier]
+            bucket["upstream_calls"] += 1
+            bucket["prompt_tokens"] += prompt_tokens
+            bucket["completion_tokens"] += completion_tokens
+            bucket["cost_usd"] += cost
+            if elapsed is not None:
+                bucket["latency_ms"].append(elapsed * 1000)
+    if rec is None:
+        return
+    rec.model = model
+    rec.prompt_tokens += prompt_tokens
+    rec.completion_tokens += completion_tokens
+    rec.cached_tokens += cached_tokens
+    rec.cost += cost
+
+
+# --- Aggregation ---
+
+def _add(bucket: dict, rec: CallRecord, wall: float):
+    bucket["calls"] += 1
+    bucket["outcomes"][rec.outcome] += 1
+    if rec.outcome != "ok":
+        bucket["errors"] += 1
+    if rec.cache:
+        bucket["cache_hits"] += 1
+    if rec.model:
+        bucket["upstream_calls"] += 1
+    if rec.hedged:
+        bucket["hedged"] += 1
+    bucket["wall_ms_total"] += wall * 1000
+    bucket["latency_ms"].append(wall * 1000)
+    if rec.ttft is not None:
+        bucket["ttft_ms_total"] += rec.ttft * 1000
+        bucket["ttft_count"] += 1
+    bucket["prompt_tokens"] += rec.prompt_tokens
+    bucket["completion_tokens"] += rec.completion_tokens
+    bucket["cached_prompt_tokens"] += rec.cached_tokens
+    bucket["cost_usd"] += rec.cost
+
+
+def _finish(rec: CallRecord, wall: float, error: BaseException | None = None):
+    if error is not None:
+        rec.outcome = _classify(error)
+    elif rec.outcome is None:
+        rec.outcome = "ok"
+    with _lock:
+        _add(_by_endpoint[(rec.op, rec.route)], rec, wall)
+        if rec.model:
+            _add(_by_model[rec.model], rec, wall)
+    logger.debug(
+        f"LLM {rec.op} route={rec.route} model={rec.model} outcome={rec.outcome} cache={rec.cache} "
+        f"wall={wall * 1000:.0f}ms tokens={rec.prompt_tokens}/{rec.completion_tokens}"
+    )
+
+
+def instrument(op: str):
+    """Decorator: record one `CallRecord` per call of a sync, async or async-generator function."""
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen_wrapper(*args, **kwargs):
+                rec = CallRecord(op, _route.get())
+                started = time.perf_counter()
+                error = None
+                agen = fn(*args, **kwargs)
+                try:
+                    while True:
+                        # The generator body runs in the caller's context, so the record
+                        # is set for each step only and reset before the item goes out
+                        token = _record.set(rec)
+                        try:
+                            item = await agen.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _record.reset(token)
+                        if rec.ttft is None:
+                            rec.ttft = time.perf_counter() - started
+                        yield item
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    token = _record.set(rec)
+                    try:
+                        await agen.aclose()
+                    finally:
+                        _record.reset(token)
+                        _finish(rec, time.perf_counter() - started, error)
+            return agen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                rec = CallRecord(op, _route.get())
+                token = _record.set(rec)
+                started = time.perf_counter()
+                error = None
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _finish(rec, time.perf_counter() - started, error)
+                    _record.reset(token)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def sync_wrapper(*args, **kwargs):
+            rec = CallRecord(op, _route.get())
+            token = _record.set(rec)
+            started = time.perf_counter()
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _finish(rec, time.perf_counter() - started, error)
+                _record.reset(token)
+        return sync_wrapper
+    return decorator
+
+
+def _percentile(samples, p: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _summarize(bucket: dict) -> dict:
+    calls = bucket["calls"]
+    return {
+        "calls": calls,
+        "errors": bucket["errors"],
+        "cache_hits": bucket["cache_hits"],
+        "upstream_calls": bucket["upstream_calls"],
+        "hedged": bucket["hedged"],
+        "outcomes": dict(bucket["outcomes"]),
+        "avg_ms": round(bucket["wall_ms_total"] / calls, 1) if calls else 0.0,
+        "p50_ms": _round(_percentile(bucket["latency_ms"], 50)),
+        "p95_ms": _round(_percentile(bucket["latency_ms"], 95)),
+        "avg_ttft_ms": round(bucket["ttft_ms_total"] / bucket["ttft_count"], 1) if bucket["ttft_count"] else None,
+        "prompt_tokens": bucket["prompt_tokens"],
+        "completion_tokens": bucket["completion_tokens"],
+        "cached_prompt_tokens": bucket["cached_prompt_tokens"],
+        "cost_usd": round(bucket["cost_usd"], 6),
+    }
+
+
+def _summarize_tier(bucket: dict) -> dict:
+    return {
+        "upstream_calls": bucket["upstream_calls"],
+        "escalations": dict(bucket["escalations"]),
+        "p50_ms": _round(_percentile(bucket["latency_ms"], 50)),
+        "p95_ms": _round(_percentile(bucket["latency_ms"], 95)),
+        "prompt_tokens": bucket["prompt_tokens"],
+        "completion_tokens": bucket["completion_tokens"],
+        "cost_usd": round(bucket["cost_usd"], 6),
+    }
+
+
+def _round(value: float | None) -> float | None:
+    return round(value, 1) if value is not None else None
+
+
+def stats() -> dict:
+    """Aggregated call metrics per (op, route) and per model since startup."""
+    with _lock:
+        endpoints = [{"op": op, "route": route, **_summarize(b)} for (op, route), b in _by_endpoint.items()]
+        models = {model: _summarize(b) for model, b in _by_model.items()}
+        tiers = {tier: _summarize_tier(b) for tier, b in _by_tier.items()}
+    endpoints.sort(key=lambda e: e["cost_usd"] + e["prompt_tokens"] * 1e-9, reverse=True)
+    return {"since": _started_at, "by_endpoint": endpoints, "by_model": models, "by_tier": tiers}
+
+
+def summary_line() -> str:
+    """One-line rollup for the periodic log."""
+    data = stats()
+    eps = data["by_endpoint"]
+    calls = sum(e["calls"] for e in eps)
+    errors = sum(e["errors"] for e in eps)
+    hits = sum(e["cache_hits"] for e in eps)
+    tokens_in = sum(e["prompt_tokens"] for e in eps)
+    tokens_out = sum(e["completion_tokens"] for e in eps)
+    cost = sum(e["cost_usd"] for e in eps)
+    top = ", ".join(f"{e['op']}@{e['route']}={e['calls']} calls/{e['p95_ms']}ms p95" for e in eps[:3])
+    return (
+        f"LLM metrics: {calls} calls, {errors} errors, {hits} cache hits, "
+        f"tokens {tokens_in} in / {tokens_out} out, cost ${cost:.4f}; top: {top or '-'}"
+    )
+
+
+async def log_periodically():
+    """Log `summary_line()` every LLM_METRICS_LOG_SECONDS (run as a startup task)."""
+    while True:
+        await asyncio.sleep(LLM_METRICS_LOG_SECONDS)
+        try:
+            logger.info(summary_line())
+        except Exception as e:
+            logger.error(f"LLM metrics log failed: {e}")
@@ -0,0 +1,221 @@
+"""Pluggable transport under `llm.py`: live, record or replay LLM calls.
+
+LLM_TRANSPORT selects the mode:
+- live: call the provider (default).
+- record: call the provider and append each request/response pair to the
+  LLM_CASSETTE JSONL file.
+- replay: answer from the cassette without any network. Requests are matched
+  by a hash of the messages and sampling params; the model, keys and timeouts
+  are ignored, so a cassette recorded with one model replays under any.
+  Repeated requests get the recorded replies in order, cycling. Latency is
+  the recorded one, or a fixed LLM_REPLAY_LATENCY_MS.
+
+This lets the load and latency suites run offline and reproducibly:
+    LLM_TRANSPORT=record LLM_CASSETTE=runs/hints.jsonl uvicorn main:app   # once, with a key
+    LLM_TRANSPORT=replay LLM_CASSETTE=runs/hints.jsonl uvicorn main:app   # then as often as needed
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+
+from litellm import ModelResponse
+from litellm.types.utils import Delta, ModelResponseStream, StreamingChoices, Usage
+
+logger = logging.getLogger(__name__)
+
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT", "live").lower()  # live | record | replay
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", "llm_cassette.jsonl")
+# "recorded" replays each call with the latency it had when recorded; a number fixes it (ms)
+LLM_REPLAY_LATENCY_MS = os.getenv("LLM_REPLAY_LATENCY_MS", "recorded")
+# Streamed replays yield the reply in chunks of this many characters
+_REPLAY_CHUNK_CHARS = 16
+
+# Provider/connection settings that don't change the reply
+_IGNORED_PARAMS = {"client", "api_key", "api_base", "timeout", "max_retries", "stream"}
+
+
+class CassetteMiss(LookupError):
+    """Replay mode got a request that is not in the cassette."""
+
+
+def _redact(messages: list) -> list:
+    # Images are only stored as a digest to keep cassettes small
+    out = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            content = [
+                {"type": "image_url", "image_url": "sha256:" + hashlib.sha256(str(part.get("image_url")).encode()).hexdigest()}
+                if part.get("type") == "image_url" else part
+                for part in content
+            ]
+        out.append({**m, "content": content})
+    return out
+
+
+def request_key(messages: list, params: dict) -> str:
+    """Stable hash of what determines the reply (messages + sampling params)."""
+    kept = {k: v for k, v in params.items() if k not in _IGNORED_PARAMS}
+    payload = json.dumps([messages, kept], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _usage(response) -> dict | None:
+    try:
+        usage = response.get("usage")
+    except Exception:
+        return None
+    if usage is None:
+        return None
+    return {"prompt_tokens": getattr(usage, "prompt_tokens", 0), "completion_tokens": getattr(usage, "completion_tokens", 0)}
+
+
+class Cassette:
+    """JSONL file of recorded calls, one `{"key", "model", "request", "reply", ...}` per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, list] = defaultdict(list)
+        self._cursor: dict[str, int] = defaultdict(int)
+        self.counters = {"recorded": 0, "replayed": 0, "misses": 0}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+
+    def __len__(self):
+        return sum(len(v) for v in self._entries.values())
+
+    def lookup(self, key: str) -> dict:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.counters["misses"] += 1
+                raise CassetteMiss(f"No recorded LLM reply for request {key[:12]} in {self.path}")
+            entry = entries[self._cursor[key] % len(entries)]
+            self._cursor[key] += 1
+            self.counters["replayed"] += 1
+            return entry
+
+    def append(self, key: str, model: str, messages: list, params: dict, reply: str, usage: dict | None,
+               latency: float, ttft: float | None = None):
+        entry = {
+            "key": key,
+            "model": model,
+            "request": {"messages": _redact(messages), "params": {k: v for k, v in params.items() if k not in _IGNORED_PARAMS}},
+            "reply": reply,
+            "usage": usage,
+            "latency_ms": round(latency * 1000, 1),
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+        }
+        line = json.dumps(entry, default=str, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._entries[key].append(entry)
+            self.counters["recorded"] += 1
+
+
+_cassette: Cassette | None = None
+_cassette_lock = threading.Lock()
+
+
+def cassette() -> Cassette:
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None or _cassette.path != LLM_CASSETTE:
+            _cassette = Cassette(LLM_CASSETTE)
+            if LLM_TRANSPORT == "replay":
+                logger.info(f"Replaying LLM calls from {LLM_CASSETTE} ({len(_cassette)} recorded)")
+        return _cassette
+
+
+def _replay_delay(entry: dict, field: str = "latency_ms") -> float:
+    if LLM_REPLAY_LATENCY_MS != "recorded":
+        return float(LLM_REPLAY_LATENCY_MS) / 1000
+    return (entry.get(field) or entry.get("latency_ms") or 0) / 1000
+
+
+def _response(entry: dict, model: str) -> ModelResponse:
+    usage = entry.get("usage")
+    return ModelResponse(
+        model=model,
+        choices=[{"message": {"role": "assistant", "content": entry["reply"]}, "finish_reason": "stop"}],
+        usage=Usage(**usage) if usage else None,
+    )
+
+
+async def _replay_stream(entry: dict):
+    text = entry["reply"]
+    chunks = [text[i:i + _REPLAY_CHUNK_CHARS] for i in range(0, len(text), _REPLAY_CHUNK_CHARS)] or [""]
+    ttft = _replay_delay(entry, "ttft_ms")
+    rest = max(_replay_delay(entry) - ttft, 0.0) / max(len(chunks) - 1, 1)
+    for i, chunk in enumerate(chunks):
+        await asyncio.sleep(ttft if i == 0 else rest)
+        yield ModelResponseStream(choices=[StreamingChoices(delta=Delta(content=chunk))])
+
+
+async def _record_stream(stream, key: str, model: str, messages: list, params: dict, started: float):
+    parts = []
+    ttft = None
+    async for chunk in stream:
+        delta = chunk["choices"][0]["delta"].get("content") if chunk["choices"] else None
+        if delta:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(delta)
+        yield chunk
+    # Only complete streams are recorded
+    cassette().append(key, model, messages, params, "".join(parts).strip(), None, time.perf_counter() - started, ttft)
+
+
+def completion(live, model: str, messages: list, **kwargs):
+    """`litellm.completion` through the configured transport; `live` is the real function."""
+    if LLM_TRANSPORT == "live":
+        return live(model=model, messages=messages, **kwargs)
+    key = request_key(messages, kwargs)
+    if LLM_TRANSPORT == "replay":
+        entry = cassette().lookup(key)
+        time.sleep(_replay_delay(entry))
+        return _response(entry, model)
+    started = time.perf_counter()
+    response = live(model=model, messages=messages, **kwargs)
+    cassette().append(key, model, messages, kwargs, response["choices"][0]["message"]["content"].strip(),
+                      _usage(response), time.perf_counter() - started)
+    return response
+
+
+async def acompletion(live, model: str, messages: list, **kwargs):
+    """`litellm.acompletion` through the configured transport (plain or `stream=True`)."""
+    if LLM_TRANSPORT == "live":
+        return await live(model=model, messages=messages, **kwargs)
+    key = request_key(messages, kwargs)
+    if LLM_TRANSPORT == "replay":
+        entry = cassette().lookup(key)
+        if kwargs.get("stream"):
+            return _replay_stream(entry)
+        await asyncio.sleep(_replay_delay(entry))
+        return _response(entry, model)
+    started = time.perf_counter()
+    response = await live(model=model, messages=messages, **kwargs)
+    if kwargs.get("stream"):
+        return _record_stream(response, key, model, messages, kwargs, started)
+    cassette().append(key, model, messages, kwargs, response["choices"][0]["message"]["content"].strip(),
+                      _usage(response), time.perf_counter() - started)
+    return response
+
+
+def stats() -> dict:
+    out = {"mode": LLM_TRANSPORT}
+    if LLM_TRANSPORT != "live":
+        c = cassette()
+        out.update(cassette=c.path, entries=len(c), **c.counters)
+    return out
@@ -0,0 +1,298 @@
+import os
+import re
+import ast
+import logging
+import threading
+from fractions import Fraction
+
+logger = logging.getLogger(__name__)
+
+LOCAL_GRADER_ENABLED = os.getenv("LOCAL_GRADER_ENABLED", "true").lower() == "true"
+
+# Questions with these words need more than a value comparison (form, rounding,
+# units, word problems...) — leave them to the LLM grader.
+_SKIP_WORDS = re.compile(
+    r"\b(simplif\w*|lowest|round\w*|nearest|estimat\w*|approx\w*|express|convert|percent\w*|remainder|"
+    r"factor\w*|expand|prime|mixed|words?|explain|why|how many|which|compare|greater|smaller|bigger|less|more|"
+    r"of|reciprocal|square\w*|cube\w*|double|half|twice|times|if)\b|%|√",
+    re.I,
+)
+# The only words allowed right next to the expression; anything else ("2/3 of 12",
+# "double 3+4") changes what is asked and is left to the LLM grader
+_SCAFFOLD_WORDS = {"what", "what's", "whats", "is", "find", "calculate", "compute", "evaluate", "solve", "out"}
+# A given value ("x = 3") means the expression has to be evaluated with it
+_GIVEN_VALUE = re.compile(r"^[a-z]\s*=\s*-?\d+(?:[.,]\d+)*$", re.I)
+# A run of math-looking text: numbers, isolated single letters (variables), operators
+_MATH_RUN = re.compile(r"(?:\d+(?:[.,]\d+)*|(?<![A-Za-z])[a-z](?![A-Za-z])|[+\-*/^()=×÷−\s])+")
+_ANSWER_PREFIX = re.compile(
+    r"^(?:(?:so|ok|okay|um+|hmm+)[\s,]+)?(?:i think\s+)?(?:the\s+)?(?:final\s+)?(?:answer|ans)?\s*(?:is|=|:)?\s*(?:it'?s\s+|it is\s+)?",
+    re.I,
+)
+_NUMBER = re.compile(r"^-?\d+(?:\.\d+)?$")
+_FRACTION = re.compile(r"^(-?\d+)\s*/\s*(\d+)$")
+_MAX_POW = 10
+
+_lock = threading.Lock()
+_counters = {"local": 0, "llm": 0}
+
+
+class _Unsupported(Exception):
+    """Raised for anything the safe evaluator will not handle."""
+
+
+def _to_fraction(node) -> Fraction:
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return Fraction(str(node.value))
+    raise _Unsupported(ast.dump(node))
+
+
+def _eval_linear(node, var: str | None) -> tuple[Fraction, Fraction]:
+    """Evaluate `node` as a*var + b and return (a, b) using exact fractions."""
+    if isinstance(node, ast.Constant):
+        return Fraction(0), _to_fraction(node)
+    if isinstance(node, ast.Name):
+        if var is None or node.id != var:
+            raise _Unsupported(node.id)
+        return Fraction(1), Fraction(0)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        a, b = _eval_linear(node.operand, var)
+        return (-a, -b) if isinstance(node.op, ast.USub) else (a, b)
+    if isinstance(node, ast.BinOp):
+        la, lb = _eval_linear(node.left, var)
+        ra, rb = _eval_linear(node.right, var)
+        if isinstance(node.op, ast.Add):
+            return la + ra, lb + rb
+        if isinstance(node.op, ast.Sub):
+            return la - ra, lb - rb
+        if isinstance(node.op, ast.Mult):
+            if la and ra:
+                raise _Unsupported("non-linear")
+            return la * rb + ra * lb, lb * rb
+        if isinstance(node.op, ast.Div):
+            if ra or rb == 0:
+                raise _Unsupported("division by variable or zero")
+            return la / rb, lb / rb
+        if isinstance(node.op, ast.Pow):
+            if la or ra or rb.denominator != 1 or abs(rb) > _MAX_POW or abs(lb) > 10**6:
+                raise _Unsupported("pow")
+            if lb == 0 and rb < 0:
+                raise _Unsupported("division by zero")
+            return Fraction(0), lb ** int(rb)
+    raise _Unsupported(ast.dump(node))
+
+
+def _prepare(expr: str, var: str | None) -> str:
+    s = expr.strip().replace("×", "*").replace("÷", "/").replace("−", "-").replace("^", "**")
+    s = re.sub(r"(?<=\d),(?=\d{3}\b)", "", s)  # 1,000 -> 1000
+    if var != "x":
+        s = re.sub(r"(?<=[\d)])\s*x\s*(?=[\d(])", "*", s)  # 3 x 4 -> 3*4
+    if var:
+        s = re.sub(rf"(?<=[\d)])\s*(?={var}\b)", "*", s)  # 2x -> 2*x
+        s = re.sub(rf"(?<=\b{var})\s*(?=[\d(])", "*", s)
+    s = re.sub(r"(?<=[\d)])\s*(?=\()", "*", s)  # 2(3+4) -> 2*(3+4)
+    return s
+
+
+def _parse(expr: str, var: str | None) -> tuple[Fraction, Fraction]:
+    try:
+        tree = ast.parse(_prepare(expr, var), mode="eval")
+    except SyntaxError as e:
+        raise _Unsupported(str(e))
+    return _eval_linear(tree.body, var)
+
+
+def _has_operator(expr: str) -> bool:
+    return bool(re.search(r"(?<=[\w)])\s*(?:[+\-*/^×÷−]|\bx\b)\s*(?=[\w(])", expr))
+
+
+def solve_expression(expr: str) -> tuple[Fraction, str | None] | None:
+    """Return (value, variable) for an arithmetic expression or a linear equation.
+
+    `variable` is None for plain arithmetic. Returns None when the text is not
+    something we can evaluate exactly.
+    """
+    expr = expr.strip().rstrip("=").strip()
+    letters = set(re.findall(r"(?<![A-Za-z])[a-z](?![A-Za-z])", expr))
+    try:
+        if "=" in expr:
+            if expr.count("=") != 1 or len(letters) != 1:
+                return None
+            var = letters.pop()
+            left, right = expr.split("=")
+            la, lb = _parse(left, var)
+            ra, rb = _parse(right, var)
+            if la == ra:
+                return None
+            return (rb - lb) / (la - ra), var
+        if letters - {"x"} or not _has_operator(expr):
+            return None
+        a, b = _parse(expr, None)
+        return b, None
+    except (_Unsupported, ZeroDivisionError, OverflowError, RecursionError, ValueError):
+        return None
+
+
+def _question_sentence(text: str) -> str | None:
+    """Return the last sentence of a bot message that asks something."""
+    sentences = [s for s in re.split(r"(?<=[?!])\s+|\n+|(?<=\.)\s+(?=\D)", text) if s.strip()]
+    for sentence in reversed(sentences):
+        if "?" in sentence or re.search(r"\b(solve|calculate|compute|evaluate|find|work out|what is|what's)\b", sentence, re.I):
+            return sentence
+    return None
+
+
+def extract_problem(question_text: str) -> str | None:
+    """Find the single math expression/equation the bot's last message asks about.
+
+    Only bare questions qualify ("What is 7 + 5?", "Solve 2x + 3 = 11"): any
+    other word touching the expression, or a given value like "x = 3", means
+    the text asks something a plain evaluation would get wrong.
+    """
+    sentence = _question_sentence(question_text or "")
+    if not sentence or _SKIP_WORDS.search(sentence):
+        return None
+    candidates = []
+    for m in _MATH_RUN.finditer(sentence):
+        run = m.group().strip().rstrip("=").strip()
+        if not re.search(r"\d", run):
+            continue
+        if _GIVEN_VALUE.match(run):
+            return None
+        before = re.search(r"([A-Za-z']+)\s*$", sentence[:m.start()])
+        after = re.match(r"\s*([A-Za-z']+)", sentence[m.end():])
+        if any(w and w.group(1).lower() not in _SCAFFOLD_WORDS for w in (before, after)):
+            return None
+        if solve_expression(run) is not None:
+            candidates.append(run)
+    if len(set(candidates)) != 1:
+        return None
+    return candidates[0]
+
+
+def student_problem(text: str) -> str | None:
+    """The one math problem a student's message poses ("what is 7+5", "2x + 3 = 11"), if any."""
+    if not text or _SKIP_WORDS.search(text):
+        return None
+    candidates = set()
+    for m in _MATH_RUN.finditer(text):
+        run = m.group().strip().rstrip("=").strip()
+        # A bare value or "x = 4" is an answer, not a problem
+        if _GIVEN_VALUE.match(run) or not re.search(r"\d", run):
+            continue
+        if solve_expression(run) is not None:
+            candidates.add(run)
+    return candidates.pop() if len(candidates) == 1 else None
+
+
+def _same_problem(a: str, b: str) -> bool:
+    return re.sub(r"\s+", "", _prepare(a, None)) == re.sub(r"\s+", "", _prepare(b, None))
+
+
+def parse_student_answer(text: str, var: str | None = None) -> Fraction | None:
+    """Parse a message that is only a numeric answer ("12", "x = 4", "7/8", "answer is 0.5")."""
+    s = (text or "").strip().lower()
+    if not s or "?" in s:
+        return None
+    s = re.sub(r"[\s!.]+$", "", s)
+    s = _ANSWER_PREFIX.sub("", s, count=1).strip()
+    if var:
+        s = re.sub(rf"^{var}\s*=\s*", "", s)
+    s = re.sub(r"(?<=\d),(?=\d{3}\b)", "", s).replace("−", "-")
+    m = _FRACTION.match(s)
+    if m:
+        if int(m.group(2)) == 0:
+            return None
+        value = Fraction(int(m.group(1)), int(m.group(2)))
+        # Unreduced forms like 14/16 may be marked down for form — let the LLM decide
+        if value.denominator != int(m.group(2)):
+            return None
+        return value
+    if _NUMBER.match(s):
+        return Fraction(s)
+    return None
+
+
+def _terminates(value: Fraction) -> bool:
+    d = value.denominator
+    for p in (2, 5):
+        while d % p == 0:
+            d //= p
+    return d == 1
+
+
+def _format(value: Fraction, as_decimal: bool = False) -> str:
+    if value.denominator == 1:
+        return str(value.numerator)
+    if as_decimal and _terminates(value):
+        return f"{float(value):.10f}".rstrip("0")
+    return f"{value.numerator}/{value.denominator}"
+
+
+def grade(conversation: list | None) -> dict | None:
+    """Grade the student's last message locally, or return None to fall back to the LLM.
+
+    Only the problem the student brought is graded here: the bot's question
+    must ask exactly the problem of the student's latest earlier message that
+    posed one. A sub-step the tutor asks along the way ("First, what is
+    4 x 2?") is not a final answer, so it is left to the LLM grader.
+
+    Returns the same shape as `llm.check_answer`:
+    {"final", "correct", "feedback", "correct_answer"}.
+    """
+    if not LOCAL_GRADER_ENABLED or not conversation:
+        return None
+
+    answer_text = question_text = asked = None
+    for turn in reversed(conversation):
+        role, content = turn.get("role"), turn.get("content")
+        if not isinstance(content, str):
+            continue
+        if answer_text is None:
+            if role != "user":
+                return None
+            answer_text = content
+        elif question_text is None:
+            if role == "assistant":
+                question_text = content
+        elif role == "user":
+            asked = student_problem(content)
+            if asked is not None:
+                break
+    if not question_text or asked is None:
+        return None
+
+    problem = extract_problem(question_text)
+    if problem is None or not _same_problem(problem, asked):
+        return None
+    expected, var = solve_expression(problem)
+    given = parse_student_answer(answer_text, var)
+    if given is None:
+        return None
+
+    correct = given == expected
+    if not correct and "." in answer_text and not _terminates(expected) and abs(given - expected) < Fraction(1, 100):
+        # A rounded decimal for a recurring value — rounding rules are the LLM's call
+        return None
+
+    value = _format(expected, as_decimal="." in problem)
+    shown = f"{var} = {value}" if var else value
+    if correct:
+        feedback = f"Correct! {problem} gives {shown}."
+    else:
+        feedback = f"Not quite: {problem} gives {shown}."
+    return {"final": True, "correct": correct, "feedback": feedback, "correct_answer": shown}
+
+
+def record(source: str):
+    """Count a grade as served `local`ly or by the `llm`."""
+    with _lock:
+        _counters[source] += 1
+
+
+def stats() -> dict:
+    """Grades served locally vs. by the LLM, and the local fraction."""
+    with _lock:
+        out = dict(_counters)
+    total = out["local"] + out["llm"]
+    out["local_fraction"] = round(out["local"] / total, 4) if total else 0.0
+    return out
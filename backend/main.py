@@ -1,8 +1,9 @@
 import sys
+import asyncio
 import logging
 from pathlib import Path
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import StreamingResponse
 from database import Base, engine
@@ -29,7 +30,9 @@ BASE_DIR = Path(__file__).resolve().parent
 if str(BASE_DIR) not in sys.path:
     sys.path.insert(0, str(BASE_DIR))
 
-from routers import user, chat, history, explore, syllabus, topics, parent, quotes_router, teacher
+from routers import user, chat, history, explore, syllabus, topics, parent, quotes_router, teacher, metrics
+import llm_metrics
+import blob_store
 from fastapi.middleware.cors import CORSMiddleware
 # create tables
 def ensure_streak_columns():
@@ -60,11 +63,105 @@ def ensure_streak_columns():
         logger.error(f"DB migration error (non-fatal): {e}")
 
 
+def ensure_message_columns():
+    """Add the `is_final` grading label column to `messages` if missing (SQLite)."""
+    try:
+        conn = engine.connect()
+        try:
+            res = conn.execute(text("PRAGMA table_info('messages')")).mappings().all()
+            cols = [r["name"] for r in res]
+            stmts = []
+            if cols and "is_final" not in cols:
+                stmts.append("ALTER TABLE messages ADD COLUMN is_final BOOLEAN")
+            for s in stmts:
+                conn.execute(text(s))
+            if stmts:
+                logger.info(f"DB migration applied: added columns -> {stmts}")
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"DB migration error (non-fatal): {e}")
+
+
+def ensure_chat_columns():
+    """Add the rolling summary and `last_message_id` columns to `chats` if missing (SQLite)."""
+    try:
+        conn = engine.connect()
+        try:
+            res = conn.execute(text("PRAGMA table_info('chats')")).mappings().all()
+            cols = [r["name"] for r in res]
+            stmts = []
+            if cols and "summary" not in cols:
+                stmts.append("ALTER TABLE chats ADD COLUMN summary TEXT")
+            if cols and "summary_upto_id" not in cols:
+                stmts.append("ALTER TABLE chats ADD COLUMN summary_upto_id INTEGER")
+            if cols and "last_message_id" not in cols:
+                stmts.append("ALTER TABLE chats ADD COLUMN last_message_id INTEGER")
+                stmts.append("CREATE INDEX IF NOT EXISTS ix_chats_last_message_id ON chats (last_message_id)")
+                # Backfill from the messages already stored
+                stmts.append(
+                    "UPDATE chats SET last_message_id = "
+                    "(SELECT MAX(id) FROM messages WHERE messages.chat_id = chats.id)"
+                )
+            for s in stmts:
+                conn.execute(text(s))
+            conn.commit()  # the backfill UPDATE runs in a transaction, unlike the DDL
+            if stmts:
+                logger.info(f"DB migration applied: added columns -> {stmts}")
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"DB migration error (non-fatal): {e}")
+
+
 # Ensure schema exists and run lightweight migrations
 ensure_streak_columns()
+ensure_message_columns()
+ensure_chat_columns()
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+# Tags LLM calls with the route that triggered them (see /metrics/llm)
+app = FastAPI(dependencies=[Depends(llm_metrics.tag_route)])
+
+
+@app.on_event("startup")
+def build_prompt_registry():
+    """Prebuild the per-class tutoring prompts so no hint pays for file I/O."""
+    import llm
+    llm.PROMPTS.warm()
+
+
+@app.on_event("startup")
+def load_answer_filter():
+    """Load (or train from stored grader verdicts) the final-answer pre-filter."""
+    import answer_filter
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        answer_filter.load_or_train(db)
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+async def start_llm_metrics_log():
+    """Log an LLM call rollup (calls, tokens, cost, slowest endpoints) every few minutes."""
+    if llm_metrics.LLM_METRICS_LOG_SECONDS > 0:
+        app.state.llm_metrics_task = asyncio.create_task(llm_metrics.log_periodically())
+
+
+@app.on_event("shutdown")
+async def stop_llm_metrics_log():
+    task = getattr(app.state, "llm_metrics_task", None)
+    if task is not None:
+        task.cancel()
+
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    """Release the pooled LLM HTTP connections."""
+    import llm
+    await llm.aclose_clients()
 
 # Get allowed origins from environment variable (comma-separated)
 # Default to localhost for development, but warn if using wildcard in production
@@ -160,6 +257,10 @@ for subdir in ["documents", "images", "thumbnails"]:
     subdir_path.mkdir(parents=True, exist_ok=True)
     app.mount(f"/uploads/{subdir}", StaticFiles(directory=str(subdir_path)), name=f"uploads_{subdir}")
 
+# Content-addressed chat images; a blob never changes, so it is cached as immutable
+blob_store.BLOB_DIR.mkdir(parents=True, exist_ok=True)
+app.mount(blob_store.BLOB_URL_PREFIX, blob_store.ImmutableStaticFiles(directory=str(blob_store.BLOB_DIR)), name="blobs")
+
 # routers
 app.include_router(user.router)
 app.include_router(chat.router)
@@ -170,3 +271,4 @@ app.include_router(topics.router)
 app.include_router(parent.router)
 app.include_router(teacher.router)
 app.include_router(quotes_router.router)
+app.include_router(metrics.router)
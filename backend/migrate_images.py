@@ -0,0 +1,89 @@
+"""Move inline base64 images in `messages.image` to the blob store.
+
+Walks the table in id order, `--batch-size` rows at a time, writes each
+image to the content-addressed store and replaces the column value with
+its `/blobs/...` URL, committing once per batch. It can be stopped and
+re-run at any time: converted rows are skipped and blobs are deduplicated.
+
+Run from the backend folder (uses DATABASE_URL from database.py):
+    python migrate_images.py --batch-size 200
+    python migrate_images.py --dry-run
+    python migrate_images.py --vacuum    # give the freed space back to the OS afterwards
+"""
+import argparse
+import logging
+import sys
+import time
+
+from sqlalchemy import text
+
+import blob_store
+from database import engine
+
+logger = logging.getLogger("migrate_images")
+
+_SELECT = text(
+    "SELECT id, image FROM messages "
+    "WHERE id > :after AND image IS NOT NULL AND image != '' AND image NOT LIKE :prefix "
+    "ORDER BY id LIMIT :limit"
+)
+_UPDATE = text("UPDATE messages SET image = :image WHERE id = :id")
+
+
+def migrate(batch_size: int = 200, dry_run: bool = False, pause: float = 0.0) -> dict:
+    """Convert every inline image; returns counts of rows seen/converted/kept inline."""
+    totals = {"rows": 0, "converted": 0, "kept": 0, "bytes_before": 0, "batches": 0}
+    after = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                _SELECT, {"after": after, "prefix": blob_store.BLOB_URL_PREFIX + "/%", "limit": batch_size}
+            ).all()
+            if not rows:
+                break
+            updates = []
+            for row_id, image in rows:
+                totals["rows"] += 1
+                totals["bytes_before"] += len(image)
+                url = image if dry_run else blob_store.store_image(image)
+                if dry_run or url != image:
+                    updates.append({"id": row_id, "image": url})
+                else:
+                    totals["kept"] += 1  # not decodable; left as it was
+            if updates and not dry_run:
+                conn.execute(_UPDATE, updates)
+            totals["converted"] += len(updates)
+            after = rows[-1][0]
+        totals["batches"] += 1
+        logger.info(f"Batch {totals['batches']}: up to message id {after}, {totals['converted']} converted so far")
+        if pause:
+            # Let request traffic take the write lock between batches
+            time.sleep(pause)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would be converted")
+    parser.add_argument("--vacuum", action="store_true", help="run VACUUM afterwards (SQLite) to shrink the file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    totals = migrate(args.batch_size, args.dry_run, args.pause)
+    verb = "Would convert" if args.dry_run else "Converted"
+    logger.info(
+        f"{verb} {totals['converted']} of {totals['rows']} inline images "
+        f"({totals['bytes_before'] / 1e6:.1f} MB of base64) in {totals['batches']} batches; "
+        f"{totals['kept']} could not be decoded and were kept inline"
+    )
+    if args.vacuum and not args.dry_run and engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+        logger.info("VACUUM done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, Boolean
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -36,6 +36,11 @@ class Chat(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     session_id = Column(String, index=True, nullable=True, unique=True)  # indexed and unique for performance
+    # Rolling summary of the messages up to and including `summary_upto_id`
+    summary = Column(Text, nullable=True)
+    summary_upto_id = Column(Integer, nullable=True)
+    # Newest message in the chat; orders chat history by last activity (see pagination.py)
+    last_message_id = Column(Integer, nullable=True, index=True)
 
     messages = relationship("Message", back_populates="chat", cascade="all, delete")
 
@@ -47,7 +52,9 @@ class Message(Base):
     text = Column(Text, nullable=True)
     image = Column(Text, nullable=True)
     sender = Column(String, nullable=False)  # "user" or "bot"
-    
+    # Grader verdict for user messages ("is this a final answer?"); training label for answer_filter
+    is_final = Column(Boolean, nullable=True)
+
     chat_id = Column(Integer, ForeignKey("chats.id"), index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)  # indexed for performance
     chat = relationship("Chat", back_populates="messages")
@@ -127,4 +134,19 @@ class Video(Base):
     
     # Metadata
     upload_date = Column(String, nullable=False)  # ISO format date
-    view_count = Column(Integer, default=0)
\ No newline at end of file
+    view_count = Column(Integer, default=0)
+
+# ---------- Hint response cache ----------
+class HintCache(Base):
+    __tablename__ = "hint_cache"
+
+    # sha256 of class number + normalized question + context digest
+    key = Column(String, primary_key=True)
+    class_number = Column(Integer, nullable=False)
+    question = Column(Text, nullable=False)  # normalized question text
+    response = Column(Text, nullable=False)
+
+    # Epoch seconds, used for TTL expiry and LRU eviction
+    created_at = Column(Float, nullable=False)
+    last_used_at = Column(Float, nullable=False, index=True)
+    hits = Column(Integer, default=0)
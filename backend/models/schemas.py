@@ -1,5 +1,5 @@
 from pydantic import BaseModel, field_validator, Field
-from typing import List, Optional
+from typing import List, Optional, Union
 import re
 
 
@@ -81,6 +81,50 @@ class Chat(BaseModel):
     messages: List[Message]
 
 
+class MessageOut(BaseModel):
+    id: int
+    text: Optional[str] = None
+    image: Optional[str] = None
+    sender: str
+    user_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+class MessagePage(BaseModel):
+    messages: List[MessageOut]  # oldest first
+    # Pass as `before` to load the next older page; None once the start of the chat is reached
+    before: Optional[int] = None
+    # Pass as `after` to load messages newer than this page
+    after: Optional[int] = None
+
+
+class ChatDelta(MessagePage):
+    """One turn of a chat: only the messages it added (`/chat/send/...?mode=delta`)."""
+    id: int
+    title: str
+    session_id: Optional[str] = None
+
+
+class ChatListItem(BaseModel):
+    """A chat in list mode: no message bodies, just a preview of the last one."""
+    id: int
+    title: str
+    session_id: Optional[str] = None
+    last_message_id: Optional[int] = None
+    last_sender: Optional[str] = None
+    preview: Optional[str] = None
+    has_image: bool = False
+
+
+class ChatPage(BaseModel):
+    chats: List[Union[ChatListItem, Chat]]  # most recently active first
+    # Cursors over the chats' last_message_id, as in MessagePage
+    before: Optional[int] = None
+    after: Optional[int] = None
+
+
 # ---------- Explore ----------
 class Progress(BaseModel):
     percentage: int
@@ -0,0 +1,91 @@
+"""Keyset (cursor) pagination for chat and message history.
+
+Pages are cut on an indexed, increasing key instead of OFFSET, so every page
+costs the same however far back it is:
+- messages by `Message.id`
+- chats by `Chat.last_message_id` (the newest message in the chat, so chats
+  come in order of last activity)
+
+Each page carries two cursors, named after the query parameter they feed:
+`before` (fetch the next older page; None once the start is reached) and
+`after` (fetch anything newer than this page, e.g. for polling).
+"""
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+from models.models import Chat, Message
+from models.schemas import Chat as ChatSchema, ChatListItem, ChatPage, MessageOut, MessagePage
+
+PAGE_DEFAULT = 20
+PAGE_MAX = 200
+# Characters of the last message shown in list mode
+PREVIEW_CHARS = 120
+
+
+def keyset(query, key, limit: int, before: int | None = None, after: int | None = None, key_of=None):
+    """Rows of `query` between the cursors, in ascending `key` order, plus (before, after) cursors.
+
+    Without cursors (or with `before`) the newest `limit` rows are taken; with
+    only `after`, the oldest `limit` rows newer than it.
+    """
+    key_of = key_of or (lambda row: getattr(row, key.key))
+    limit = max(1, min(limit, PAGE_MAX))
+    if before is not None:
+        query = query.filter(key < before)
+    if after is not None:
+        query = query.filter(key > after)
+    forward = after is not None and before is None
+    # One extra row tells us whether there is another page
+    rows = query.order_by(key.asc() if forward else key.desc()).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+    if not rows:
+        return rows, None, after
+    older = forward or more
+    return rows, key_of(rows[0]) if older else None, key_of(rows[-1])
+
+
+def message_page(db, chat_id: int, limit: int = 50, before: int | None = None, after: int | None = None) -> MessagePage:
+    query = db.query(Message).filter(Message.chat_id == chat_id)
+    rows, before_cursor, after_cursor = keyset(query, Message.id, limit, before, after)
+    return MessagePage(messages=[MessageOut.model_validate(m) for m in rows], before=before_cursor, after=after_cursor)
+
+
+def chat_page(db, user_id: int | None = None, limit: int = PAGE_DEFAULT, before: int | None = None,
+              after: int | None = None, mode: str = "list") -> ChatPage:
+    """Chats (all, or those `user_id` wrote in), most recently active first.
+
+    `mode="list"` returns titles and a preview of the last message only;
+    `mode="full"` returns each chat with its messages.
+    """
+    filters = [Chat.last_message_id.isnot(None)]
+    if user_id is not None:
+        filters.append(
+            Chat.messages.any((Message.user_id == user_id) & (Message.sender == "user"))
+        )
+
+    if mode == "full":
+        query = db.query(Chat).filter(*filters).options(selectinload(Chat.messages))
+        rows, before_cursor, after_cursor = keyset(query, Chat.last_message_id, limit, before, after)
+        chats = [ChatSchema.model_validate(c, from_attributes=True) for c in rows]
+    else:
+        # Only the first characters of the last message are read, never message bodies or images
+        query = (
+            db.query(
+                Chat.id,
+                Chat.title,
+                Chat.session_id,
+                Chat.last_message_id,
+                Message.sender.label("last_sender"),
+                func.substr(Message.text, 1, PREVIEW_CHARS).label("preview"),
+                Message.image.isnot(None).label("has_image"),
+            )
+            .join(Message, Message.id == Chat.last_message_id)
+            .filter(*filters)
+        )
+        rows, before_cursor, after_cursor = keyset(query, Chat.last_message_id, limit, before, after)
+        chats = [ChatListItem(**row._asdict()) for row in rows]
+    # Newest activity first, like the rest of the history views
+    return ChatPage(chats=chats[::-1], before=before_cursor, after=after_cursor)
@@ -0,0 +1,174 @@
+"""Provider-side caching of the static system-prompt prefix (Gemini cached content).
+
+The per-class tutoring prompt is byte-identical for every student in a class
+(see `PromptRegistry`). For Gemini models, `apply` swaps the leading system
+messages of a request for a `cached_content` handle that holds them on the
+provider side, so only the per-request part is sent and billed at full
+price.
+
+Handles are created and refreshed off the request path. The first request
+for a prefix goes out uncached and triggers a background create; later ones
+use the handle. Its TTL is extended when less than a quarter of it is left.
+Prefixes below the provider's minimum cacheable size are never cached.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+
+import httpx
+
+import context_builder
+
+logger = logging.getLogger(__name__)
+
+LLM_PROMPT_CACHE_ENABLED = os.getenv("LLM_PROMPT_CACHE_ENABLED", "true").lower() == "true"
+LLM_PROMPT_CACHE_TTL_SECONDS = int(os.getenv("LLM_PROMPT_CACHE_TTL_SECONDS", "3600"))
+# Gemini rejects cached contents smaller than this (model dependent)
+LLM_PROMPT_CACHE_MIN_TOKENS = int(os.getenv("LLM_PROMPT_CACHE_MIN_TOKENS", "1024"))
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+# Don't hand out a handle this close to its expiry
+_EXPIRY_MARGIN = 60
+# Wait this long after a failed create/refresh before trying again
+_RETRY_SECONDS = 300
+
+
+@dataclass
+class _Handle:
+    name: str | None = None
+    expires_at: float = 0.0
+    retry_at: float = 0.0
+    busy: bool = False
+
+
+_lock = threading.Lock()
+_handles: dict[tuple[str, str], _Handle] = {}
+_counters = {"hits": 0, "misses": 0, "skipped_small": 0, "created": 0, "refreshed": 0, "failed": 0, "invalidated": 0}
+
+
+def _count(name: str):
+    with _lock:
+        _counters[name] += 1
+
+
+def _prefix(messages: list) -> list[str]:
+    """Text of the leading system messages (the shared, cacheable part)."""
+    parts = []
+    for m in messages:
+        if m.get("role") != "system" or not isinstance(m.get("content"), str):
+            break
+        parts.append(m["content"])
+    return parts
+
+
+def _ttl() -> str:
+    return f"{LLM_PROMPT_CACHE_TTL_SECONDS}s"
+
+
+def _create(model: str, parts: list[str], api_key: str, digest: str) -> str:
+    body = {
+        "model": f"models/{model.split('/', 1)[1]}",
+        "systemInstruction": {"parts": [{"text": p} for p in parts]},
+        "ttl": _ttl(),
+        "displayName": f"toeho-prompt-{digest[:16]}",
+    }
+    r = httpx.post(f"{GEMINI_API_BASE}/cachedContents", params={"key": api_key}, json=body, timeout=10)
+    r.raise_for_status()
+    return r.json()["name"]
+
+
+def _refresh(name: str, api_key: str):
+    r = httpx.patch(
+        f"{GEMINI_API_BASE}/{name}", params={"key": api_key, "updateMask": "ttl"}, json={"ttl": _ttl()}, timeout=10
+    )
+    r.raise_for_status()
+
+
+def _ensure(handle: _Handle, model: str, parts: list[str], api_key: str, digest: str):
+    """Create or extend a handle (runs in a background thread)."""
+    try:
+        if handle.name:
+            try:
+                _refresh(handle.name, api_key)
+                name, counter = handle.name, "refreshed"
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in (403, 404):
+                    raise
+                name, counter = _create(model, parts, api_key, digest), "created"  # expired or deleted
+        else:
+            name, counter = _create(model, parts, api_key, digest), "created"
+        with _lock:
+            handle.name = name
+            handle.expires_at = time.monotonic() + LLM_PROMPT_CACHE_TTL_SECONDS
+            _counters[counter] += 1
+        logger.info(f"Prompt cache {counter} {name} for {model} ({digest[:12]})")
+    except Exception as e:
+        with _lock:
+            handle.retry_at = time.monotonic() + _RETRY_SECONDS
+            _counters["failed"] += 1
+        logger.warning(f"Could not create/refresh prompt cache for {model}: {e}")
+    finally:
+        with _lock:
+            handle.busy = False
+
+
+def _lookup(model: str, parts: list[str], api_key: str) -> str | None:
+    digest = hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+    now = time.monotonic()
+    with _lock:
+        handle = _handles.setdefault((model, digest), _Handle())
+        remaining = handle.expires_at - now
+        usable = handle.name is not None and remaining > _EXPIRY_MARGIN
+        if not handle.busy and now >= handle.retry_at and (not usable or remaining < LLM_PROMPT_CACHE_TTL_SECONDS / 4):
+            handle.busy = True
+            threading.Thread(target=_ensure, args=(handle, model, parts, api_key, digest), daemon=True).start()
+        _counters["hits" if usable else "misses"] += 1
+        return handle.name if usable else None
+
+
+def apply(model: str, messages: list, kwargs: dict) -> tuple[list, dict]:
+    """Replace the system prefix with a cached-content handle when one is live.
+
+    Returns the (messages, kwargs) to send; unchanged for non-Gemini models,
+    custom endpoints, small prefixes or while the handle is being created.
+    """
+    if not LLM_PROMPT_CACHE_ENABLED or not model.startswith("gemini/") or kwargs.get("api_base") or not kwargs.get("api_key"):
+        return messages, kwargs
+    parts = _prefix(messages)
+    if not parts or len(parts) == len(messages):
+        return messages, kwargs
+    if sum(context_builder.estimate_tokens(p) for p in parts) < LLM_PROMPT_CACHE_MIN_TOKENS:
+        _count("skipped_small")
+        return messages, kwargs
+    name = _lookup(model, parts, kwargs["api_key"])
+    if name is None:
+        return messages, kwargs
+    return messages[len(parts):], {**kwargs, "cached_content": name}
+
+
+def invalidate(name: str):
+    """Forget a handle the provider no longer accepts; it is recreated on next use."""
+    with _lock:
+        for handle in _handles.values():
+            if handle.name == name:
+                handle.name = None
+                handle.expires_at = 0.0
+                _counters["invalidated"] += 1
+
+
+def is_cache_error(error: Exception) -> bool:
+    text = str(error).lower()
+    return "cachedcontent" in text or "cached content" in text or "cached_content" in text
+
+
+def stats() -> dict:
+    now = time.monotonic()
+    with _lock:
+        out = dict(_counters)
+        out["handles"] = [
+            {"model": model, "prefix": digest[:12], "name": h.name, "expires_in": round(max(h.expires_at - now, 0.0))}
+            for (model, digest), h in _handles.items()
+        ]
+    return out
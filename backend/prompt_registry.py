@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Iterable, Mapping
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) `get()` is allowed to stat the source files for changes
+PROMPT_RELOAD_CHECK_SECONDS = float(os.getenv("PROMPT_RELOAD_CHECK_SECONDS", "5"))
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """A fully built system message for one class.
+
+    `content` is either the final prompt string or a read-only mapping for
+    structured prompts. `fingerprint` is the sha256 of the serialized message.
+    """
+    class_number: int
+    role: str
+    content: str | Mapping
+    fingerprint: str
+
+    def as_message(self) -> dict:
+        """Return a fresh message dict that is safe to hand to LiteLLM."""
+        content = self.content if type(self.content) is str else dict(self.content)
+        return {"role": self.role, "content": content}
+
+
+def compile_prompt(class_number: int, message: dict) -> CompiledPrompt:
+    """Freeze a prompt dict built by a loader into a `CompiledPrompt`."""
+    content = message.get("content", "")
+    frozen = content if type(content) is str else MappingProxyType(dict(content))
+    serialized = json.dumps(message, sort_keys=True, ensure_ascii=False)
+    return CompiledPrompt(
+        class_number=class_number,
+        role=message.get("role", "system"),
+        content=frozen,
+        fingerprint=hashlib.sha256(serialized.encode("utf-8")).hexdigest(),
+    )
+
+
+class PromptRegistry:
+    """Per-class cache of prebuilt system prompts with file-change invalidation.
+
+    Prompts are built once by `builder` and served from memory. At most every
+    `check_interval` seconds the source files are stat'ed; a changed mtime
+    triggers a hash comparison and the cache is only dropped when a file's
+    contents really changed.
+    """
+
+    def __init__(self, builder: Callable[[int], dict], source_files: Iterable[str], classes: Iterable[int] = range(1, 13), check_interval: float = PROMPT_RELOAD_CHECK_SECONDS):
+        self._builder = builder
+        self._source_files = list(source_files)
+        self._classes = list(classes)
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._prompts: dict[int, CompiledPrompt] = {}
+        self._mtimes: dict[str, int | None] = {}
+        self._hashes: dict[str, str | None] = {}
+        self._last_check = 0.0
+
+    def _stat(self, path: str) -> int | None:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _hash(self, path: str) -> str | None:
+        try:
+            with open(path, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def _snapshot_sources(self):
+        self._mtimes = {p: self._stat(p) for p in self._source_files}
+        self._hashes = {p: self._hash(p) for p in self._source_files}
+        self._last_check = time.monotonic()
+
+    def _sources_changed(self) -> bool:
+        changed = False
+        for path in self._source_files:
+            mtime = self._stat(path)
+            if mtime == self._mtimes.get(path):
+                continue
+            self._mtimes[path] = mtime
+            digest = self._hash(path)
+            if digest != self._hashes.get(path):
+                self._hashes[path] = digest
+                changed = True
+        self._last_check = time.monotonic()
+        return changed
+
+    def _build(self, class_number: int) -> CompiledPrompt:
+        return compile_prompt(class_number, self._builder(class_number))
+
+    def warm(self) -> None:
+        """Build prompts for every configured class (call at startup)."""
+        with self._lock:
+            self._snapshot_sources()
+            self._prompts = {n: self._build(n) for n in self._classes}
+        logger.info(f"Prompt registry built for classes {self._classes}")
+
+    def get(self, class_number: int) -> CompiledPrompt:
+        """Return the prebuilt prompt for `class_number`, reloading if sources changed."""
+        now = time.monotonic()
+        if now - self._last_check >= self._check_interval:
+            with self._lock:
+                if now - self._last_check >= self._check_interval and self._sources_changed():
+                    logger.info("Prompt source files changed, rebuilding prompt registry")
+                    self._prompts = {}
+
+        prompt = self._prompts.get(class_number)
+        if prompt is None:
+            with self._lock:
+                prompt = self._prompts.get(class_number)
+                if prompt is None:
+                    if not self._mtimes:
+                        self._snapshot_sources()
+                    prompt = self._build(class_number)
+                    self._prompts[class_number] = prompt
+        return prompt
@@ -0,0 +1,173 @@
+"""Circuit breakers, latency tracking and request hedging for upstream LLM calls.
+
+Used by `llm.py`, which walks an ordered list of models (primary + fallbacks)
+and skips any whose breaker is open.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Open the breaker after this many consecutive failures (slow calls count as failures)
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_SLOW_CALL_SECONDS = float(os.getenv("LLM_SLOW_CALL_SECONDS", "20"))
+# How long an open breaker rejects calls before letting one probe through
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+# Hedge after this latency percentile of recent calls, once enough samples exist
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+_LATENCY_WINDOW = 200
+
+
+class CircuitOpen(HTTPException):
+    """Every model's breaker is open; served as a 503 with Retry-After."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=503,
+            detail="Tutor is temporarily unavailable, please retry shortly",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe -> closed."""
+
+    def __init__(self, name: str, failures: int = LLM_BREAKER_FAILURES, slow_seconds: float = LLM_SLOW_CALL_SECONDS,
+                 reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.slow_seconds = slow_seconds
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.counters = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go to this model now (claims the probe when half-open)."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "closed" or (self.state == "half_open" and not self._probing):
+                self._probing = self.state == "half_open"
+                self.counters["calls"] += 1
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(self.reset_seconds - (time.monotonic() - self._opened_at), 0.0)
+
+    def _open_locked(self):
+        if self.state != "open":
+            self.counters["opened"] += 1
+            logger.warning(f"LLM circuit for {self.name} opened after {self._consecutive} failed/slow calls")
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._probing = False
+
+    def record_success(self, elapsed: float):
+        with self._lock:
+            if elapsed > self.slow_seconds:
+                self.counters["slow_calls"] += 1
+                self._record_failure_locked()
+                return
+            if self.state != "closed":
+                logger.info(f"LLM circuit for {self.name} closed")
+            self.state = "closed"
+            self._consecutive = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.counters["failures"] += 1
+            self._record_failure_locked()
+
+    def _record_failure_locked(self):
+        self._consecutive += 1
+        if self.state == "half_open" or self._consecutive >= self.failures:
+            self._open_locked()
+
+    def release_probe(self):
+        """Give back a half-open probe that ended without a verdict (e.g. cancelled)."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self._consecutive, **self.counters}
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies (seconds)."""
+
+    def __init__(self, size: int = _LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))
+        return samples[idx]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+def hedge_delay(tracker: LatencyTracker) -> float | None:
+    """Seconds to wait before a hedged second request, or None to not hedge."""
+    if not LLM_HEDGE_ENABLED or len(tracker) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    return tracker.percentile(LLM_HEDGE_PERCENTILE)
+
+
+async def hedged(make_call, delay: float | None, on_hedge=None):
+    """Run `make_call()`; if it hasn't finished after `delay`, race a second one.
+
+    Returns the first successful result and cancels the other attempt. Raises
+    the last error if every attempt fails.
+    """
+    tasks = {asyncio.ensure_future(make_call())}
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if on_hedge:
+                    on_hedge()
+                tasks.add(asyncio.ensure_future(make_call()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -1,271 +1,371 @@
-from fastapi import APIRouter, Depends, HTTPException ,Header
+from fastapi import APIRouter, Depends, HTTPException ,Header, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, func
+from sqlalchemy.exc import IntegrityError
 import logging
-from models.schemas import Message as MessageSchema, Chat as ChatSchema
+from models.schemas import Message as MessageSchema, Chat as ChatSchema, ChatDelta, ChatPage, MessageOut, MessagePage
 from models.models import Chat, Message,User
 from helper import get_db
+from database import SessionLocal
+import asyncio
 import base64, uuid
 import os, json
+from typing import Literal
+from functools import lru_cache
 from pathlib import Path
 import llm
+import answer_filter
+import context_builder
+import chat_summary
+import chat_title
+import scoring
+import admission
+import blob_store
+import pagination
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 # Read from environment: True → user must be logged in, False → guest allowed
 CHAT_AUTH_REQUIRED = os.getenv("CHAT_AUTH_REQUIRED", "true").lower() == "true"
+
+
+@lru_cache(maxsize=1)
+def _syllabus() -> dict:
+    """syllabus/topics.json, parsed once per process ({} if unavailable)."""
+    try:
+        base = Path(__file__).resolve().parents[1] / "syllabus" / "topics.json"
+        with open(base, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _topics_for_class(level):
+    """Syllabus topics for a class from syllabus/topics.json (None if unavailable)."""
+    key = f"class_{str(level).strip().replace('class_', '')}"
+    return _syllabus().get(key)
+
+
+def _image_b64(image: str | None) -> str | None:
+    # Extract base64 cleanly (support both with/without 'data:' prefix)
+    if not image:
+        return None
+    return image.split(",")[1] if image.startswith("data:") else image
+
+
+def _load_turn(db: Session, username: str, message: MessageSchema, grader_tokens: int | None = None):
+    """Read everything a chat turn needs before the LLM calls.
+
+    Sync so handlers can run it with `asyncio.to_thread` and keep the queries
+    off the event loop. Returns (user, session id, chat or None, hint context,
+    grader conversation, class topics); the last two are None unless
+    `grader_tokens` is given.
+    """
+    user = db.query(User).filter(User.username == username).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    session_id = message.session_id or str(uuid.uuid4())
+    chat = db.query(Chat).filter(Chat.session_id == session_id).first()
+
+    # Rolling summary + newest messages (and this one, not saved yet) that fit the hint budget
+    pending = [("user", message.text)]
+    last_context = chat_summary.hint_context(db, chat, pending=pending).text
+    conversation = topics = None
+    if grader_tokens is not None:
+        # Load previous messages once and pack the grader's share by token budget
+        previous_messages = (context_builder.fetch_recent(db, chat.id) if chat else []) + pending
+        conversation = context_builder.pack(previous_messages, grader_tokens).conversation
+        topics = _topics_for_class(user.class_level or user.level)
+    return user, session_id, chat, last_context, conversation, topics
+
+
+def _save_turn(
+    db: Session,
+    session_id: str,
+    chat: Chat | None,
+    message: MessageSchema,
+    user_id: int,
+    bot_text: str | None,
+    time_taken: float | None = None,
+    judge: dict | None = None,
+    is_final: bool | None = None,
+) -> tuple[Chat, Message, Message | None, bool]:
+    """Write one chat turn as a single unit of work with one commit.
+
+    Called after the LLM calls are done, so SQLite's write lock is taken once
+    and only held for these few statements: create the chat (if `chat` is
+    None), save the user message, add `time_taken`, apply a final answer's
+    grade and save the bot reply.
+
+    Returns (chat, user message, bot message, whether the chat was created).
+    The returned rows stay loaded after the commit, so callers on the event
+    loop can read them without another query.
+    """
+    # Image bytes go to the blob store (outside the transaction); the row keeps its URL
+    image = blob_store.store_image(message.image)
+    for attempt in range(2):
+        created = chat is None
+        try:
+            if created:
+                # Local keyword title now; /send/instant and /send/check patch in the LLM title later
+                chat = Chat(title=chat_title.local_title(message.text), session_id=session_id)
+                db.add(chat)
+                db.flush()
+            user_msg = Message(
+                text=message.text,
+                image=image,
+                sender="user",
+                chat_id=chat.id,
+                user_id=user_id,
+                is_final=is_final,
+            )
+            db.add(user_msg)
+            if time_taken and time_taken > 0:
+                # Column expression as the key; coalesce handles NULLs in the DB
+                db.query(User).filter(User.id == user_id).update(
+                    {User.total_time_taken: func.coalesce(User.total_time_taken, 0.0) + time_taken / 60},
+                    synchronize_session=False,
+                )
+            if judge and judge.get("final"):
+                apply_answer_grade(db, user_id, judge)
+            bot_msg = None
+            if bot_text:
+                bot_msg = Message(text=bot_text, sender="bot", chat_id=chat.id)
+                db.add(bot_msg)
+            # Keeps history ordered by last activity (keyset cursor for chat pages)
+            db.flush()
+            chat.last_message_id = (bot_msg or user_msg).id
+            expire_on_commit, db.expire_on_commit = db.expire_on_commit, False
+            try:
+                db.commit()
+            finally:
+                db.expire_on_commit = expire_on_commit
+            return chat, user_msg, bot_msg, created
+        except IntegrityError:
+            # A concurrent request created this session's chat first; write into it
+            db.rollback()
+            chat = db.query(Chat).filter(Chat.session_id == session_id).first() if created and not attempt else None
+            if chat is None:
+                raise
+
+
 @router.post("/send/instant/{username}")
-def send_message_instant(
+async def send_message_instant(
     username: str,
     message: MessageSchema,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     """Send a message using username — return only bot’s reply."""
-    # --- Look up user ---
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    # --- Look up user, chat and context (DB reads run in a worker thread) ---
+    user, session_id, chat, last_context, _, _ = await asyncio.to_thread(_load_turn, db, username, message)
     user_id = user.id
+    admission.set_user(username)
 
     try:
-        session_id = message.session_id or str(uuid.uuid4())
-
-        # --- Find or create chat ---
-        chat = db.query(Chat).filter(Chat.session_id == session_id).first()
-        if not chat:
-            chat = Chat(
-                title=llm.get_chat_title(message.text),
-                session_id=session_id,
-            )
-            db.add(chat)
-            db.commit()
-            db.refresh(chat)
-
-        # --- Save user message ---
-        user_msg = Message(
-            text=message.text,
-            image=message.image,
-            sender="user",
-            chat_id=chat.id,
-            user_id=user_id,
-        )
-        db.add(user_msg)
-        db.commit()
-
-        # ✅ Update user's time metrics
-        if message.time_taken and message.time_taken > 0:
-            # Use the column expression (User.total_time_taken) as the key
-            # — don't use the instance value `user.total_time_taken` which is a float
-            # (that caused the "got 0.0" error when used as a dict key).
-            from sqlalchemy import func
-
-            # Safely add time_taken; coalesce handles NULLs in the DB.
-            db.query(User).filter(User.id == user_id).update(
-                {
-                    User.total_time_taken: (func.coalesce(User.total_time_taken, 0.0) + (message.time_taken)/60),
-                },
-                synchronize_session=False,
-            )
-            db.commit()
-        #  Check if user has given final answer
-        
-        
-            # Load previous messages for context
-            previous_messages = (
-                db.query(Message)
-                .filter(Message.chat_id == chat.id)
-                .order_by(desc(Message.id))
-                .limit(10)
-                .all()
-            )
-            previous_messages.reverse()
-
-            # Convert to conversation format
-            conversation = [
-                {"role": "assistant" if m.sender == "bot" else "user", "content": m.text}
-                for m in previous_messages
-                if m.text
-            ]
-
-            # Helper to load class topics
-            def get_topics_for_class(level):
-                try:
-                    base = Path(__file__).resolve().parents[1] / "syllabus" / "topics.json"
-                    if not base.exists():
-                        return None
-                    data = json.load(open(base, encoding="utf-8"))
-                    key = f"class_{str(level).strip().replace('class_', '')}"
-                    return data.get(key)
-                except Exception:
-                    return None
-
-            topics = get_topics_for_class(user.class_level or user.level)
-
-        previous_messages = (
-            db.query(Message)
-            .filter(Message.chat_id == chat.id)
-            .order_by(desc(Message.id))
-            .limit(6)
-            .all()
-        )
-        previous_messages.reverse()
-        last_context = "\n".join(
-            [f"{msg.sender.capitalize()}: {msg.text}" for msg in previous_messages if msg.text]
-        )
-
         # Generate hint
-        if message.image:
-            image_b64 = (
-                message.image.split(",")[1]
-                if message.image.startswith("data:")
-                else message.image
-            )
-            bot_text = llm.generate_hint(
-                question=message.text,
-                last_context=last_context,
-                    image_b64=image_b64,
-                    user_class=user.class_level or user.level,
-                    parent_feedback=getattr(user, "Parent_feedback", None),
-            )
-        else:
-            bot_text = llm.generate_hint(
-                question=message.text,
-                last_context=last_context,
-                    user_class=user.class_level or user.level,
-                    topics=topics,
-                    parent_feedback=getattr(user, "Parent_feedback", None),
-            )
-
+        bot_text = await llm.agenerate_hint(
+            question=message.text,
+            last_context=last_context,
+            image_b64=_image_b64(message.image),
+            user_class=user.class_level or user.level,
+            parent_feedback=getattr(user, "Parent_feedback", None),
+        )
         logger.info(f"Generated bot response for send_message_instant")
 
-        # --- Save bot reply ---
-        bot_msg = Message(
-            text=bot_text,
-            sender="bot",
-            chat_id=chat.id,
+        # --- Save the turn (chat, user message, time, bot reply) in one commit ---
+        chat, _, bot_msg, created = await asyncio.to_thread(
+            _save_turn, db, session_id, chat, message, user_id, bot_text, time_taken=message.time_taken,
         )
-        db.add(bot_msg)
-        db.commit()
+        if created:
+            background_tasks.add_task(chat_title.refine_title, chat.id, message.text, chat.title)
+        background_tasks.add_task(chat_summary.refresh, chat.id)
 
         # Return only current interaction
         return {
             "bot_message": {
-                "text": bot_msg.text,
-                "sender": bot_msg.sender,
+                "text": bot_msg.text if bot_msg else bot_text,
+                "sender": "bot",
                 "session_id": session_id,
             }
         }
 
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         logger.error(f"Error in send_message_instant: {e}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/send/{username}", response_model=ChatSchema)
-def send_message_by_username(
+def _full_chat(db: Session, chat: Chat) -> ChatSchema:
+    """The chat with all its messages, loaded and serialized off the event loop."""
+    db.refresh(chat)
+    return ChatSchema.model_validate(chat, from_attributes=True)
+
+
+@router.post("/send/{username}", response_model=ChatSchema | ChatDelta)
+async def send_message_by_username(
     username: str,                       # path variable
     message: MessageSchema,
+    background_tasks: BackgroundTasks,
+    mode: Literal["full", "delta"] = "full",
     db: Session = Depends(get_db),
 ):
     """
     Send a message using the username instead of user_id.
     Backend looks up user_id from username.
+
+    `mode=full` returns the whole chat with every message. `mode=delta`
+    returns only this turn's user and bot messages plus cursors; older
+    history is loaded page by page from `GET /chat/{chat_id}/messages?before=...`,
+    so the response size doesn't grow with the chat.
     """
 
-    # --- Look up user_id from username ---
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    # --- Look up user_id from username, chat and context (in a worker thread) ---
+    user, session_id, chat, last_context, _, _ = await asyncio.to_thread(_load_turn, db, username, message)
     user_id = user.id
+    admission.set_user(username)
 
     try:
-        session_id = message.session_id or str(uuid.uuid4())
-
-        # --- Find or create chat ---
-        chat = db.query(Chat).filter(Chat.session_id == session_id).first()
-        if not chat:
-            chat = Chat(
-                title=message.text[:20] if message.text else "Image Chat",
-                session_id=session_id,
-            )
-            db.add(chat)
-            db.commit()
-            db.refresh(chat)
-
-        # --- Save user message ---
-        user_msg = Message(
-            text=message.text,
-            image=message.image,
-            sender="user",
-            chat_id=chat.id,
-            user_id=user_id,
-        )
-        db.add(user_msg)
-        db.commit()
-
-        # --- Fetch previous 6 messages as context ---
-        previous_messages = (
-            db.query(Message)
-            .filter(Message.chat_id == chat.id)
-            .order_by(desc(Message.id))
-            .limit(6)
-            .all()
+        bot_text = await llm.agenerate_hint(
+            question=message.text,
+            last_context=last_context,
+            image_b64=_image_b64(message.image),
+            user_class=user.class_level or user.level,
+            parent_feedback=getattr(user, "Parent_feedback", None),
         )
+        logger.info(f"Generated bot response for user {username}")
 
-        # Reverse so oldest first
-        previous_messages.reverse()
-        # Combine messages into readable context text
-        last_context = "\n".join(
-            [f"{msg.sender.capitalize()}: {msg.text}" for msg in previous_messages if msg.text]
+        # --- Save the turn (chat, user message, bot reply) in one commit ---
+        # New chats keep the local keyword title here (no title LLM call on this endpoint)
+        chat, user_msg, bot_msg, created = await asyncio.to_thread(
+            _save_turn, db, session_id, chat, message, user_id, bot_text,
         )
+        background_tasks.add_task(chat_summary.refresh, chat.id)
+
+        if mode == "delta":
+            new_messages = [m for m in (user_msg, bot_msg) if m is not None]
+            return ChatDelta(
+                id=chat.id,
+                title=chat.title,
+                session_id=chat.session_id,
+                messages=[MessageOut.model_validate(m) for m in new_messages],
+                before=None if created else user_msg.id,  # a new chat has no older messages
+                after=new_messages[-1].id,
+            )
 
+        return await asyncio.to_thread(_full_chat, db, chat)
 
-        if message.image:
-            # Extract base64 cleanly (support both with/without 'data:' prefix)
-            image_b64 = (
-                message.image.split(",")[1]
-                if message.image.startswith("data:")
-                else message.image
-            )
-            bot_text = llm.generate_hint(
-                question=message.text,
-                last_context=last_context,
-                image_b64=image_b64,
-                user_class=user.class_level or user.level,
-                parent_feedback=getattr(user, "Parent_feedback", None),
-            )
-        else:
-            bot_text = llm.generate_hint(
-                question=message.text,
-                last_context=last_context,
-                user_class=user.class_level or user.level,
-                parent_feedback=getattr(user, "Parent_feedback", None),
-            )
+    except Exception as e:
+        logger.error(f"Error in send_message_by_username: {e}", exc_info=True)
+        db.rollback()
+        raise e
 
-       
-        #try
-        # bot_text=llm.generate_hint(message.text)
-        logger.info(f"Generated bot response for user {username}")
 
+def _create_chat(db: Session, session_id: str, text: str) -> Chat:
+    # Local keyword title only, like the baseline's truncated text: no title LLM call
+    chat = Chat(title=chat_title.local_title(text), session_id=session_id)
+    db.add(chat)
+    db.commit()
+    db.refresh(chat)
+    return chat
 
-        # --- Save bot reply ---
-        bot_msg = Message(
-            text=bot_text,
-            sender="bot",
-            chat_id=chat.id,
-        )
-        db.add(bot_msg)
-        db.commit()
-        db.refresh(chat)
 
-        return chat
+def _save_streamed_turn(session_id: str, chat_id: int, message: MessageSchema, user_id: int, bot_text: str):
+    # Own session: the request-scoped one may already be closed when the stream ends
+    save_db = SessionLocal()
+    try:
+        save_chat = save_db.get(Chat, chat_id)
+        _save_turn(save_db, session_id, save_chat, message, user_id, bot_text)
+    except Exception as save_err:
+        save_db.rollback()
+        logger.error(f"Could not save streamed turn for chat {chat_id}: {save_err}")
+    finally:
+        save_db.close()
+
 
+@router.post("/stream/{username}")
+async def stream_message_by_username(
+    username: str,
+    message: MessageSchema,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    """Send a message and stream the tutor's reply as Server-Sent Events.
+
+    Events:
+      - `start`: {"session_id", "chat_id"} before the first token
+      - default (`data:` only): {"token": "..."} for each chunk of the reply
+      - `done`: {"session_id", "text"} with the full reply
+      - `error`: {"detail"} if generation fails mid-stream; when the LLM is
+        overloaded also {"status": 429|503, "retry_after": seconds}
+
+    The user message and the bot message are saved together in one commit
+    when the stream completes or the client disconnects, with whatever text
+    was generated up to that point. Only a new chat is created up front, so
+    its id can go out in `start`.
+    """
+    user, session_id, chat, last_context, _, _ = await asyncio.to_thread(_load_turn, db, username, message)
+    user_id = user.id
+    admission.set_user(username)
+
+    try:
+        # --- Create the chat if new (in a worker thread, like every DB write here) ---
+        # It keeps the local keyword title; streaming never waits on or adds a title LLM call
+        if not chat:
+            chat = await asyncio.to_thread(_create_chat, db, session_id, message.text)
+        chat_id = chat.id
+
+        hint_kwargs = dict(
+            question=message.text,
+            last_context=last_context,
+            image_b64=_image_b64(message.image),
+            user_class=user.class_level or user.level,
+            parent_feedback=getattr(user, "Parent_feedback", None),
+        )
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
-        logger.error(f"Error in send_message_by_username: {e}", exc_info=True)
+        logger.error(f"Error in stream_message_by_username: {e}", exc_info=True)
         db.rollback()
-        raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def sse(data: dict, event: str | None = None) -> str:
+        prefix = f"event: {event}\n" if event else ""
+        return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def event_stream():
+        parts = []
+        try:
+            yield sse({"session_id": session_id, "chat_id": chat_id}, "start")
+            async for token in llm.astream_hint(**hint_kwargs):
+                parts.append(token)
+                yield sse({"token": token})
+            yield sse({"session_id": session_id, "text": "".join(parts).strip()}, "done")
+        except admission.Overloaded as e:
+            logger.warning(f"Streaming rejected for user {username}: {e.detail}")
+            yield sse({"detail": e.detail, "status": e.status_code, "retry_after": e.retry_after}, "error")
+        except Exception as e:
+            logger.error(f"Streaming failed for user {username}: {e}", exc_info=True)
+            yield sse({"detail": str(e)}, "error")
+        finally:
+            # Runs on completion and on client disconnect (cancellation), so the
+            # turn is always persisted. The worker thread finishes the save
+            # even if this task is cancelled while awaiting it.
+            await asyncio.to_thread(_save_streamed_turn, session_id, chat_id, message, user_id, "".join(parts).strip())
+
+    # Background tasks run after the stream ends, once the turn is saved
+    background_tasks.add_task(chat_summary.refresh, chat_id)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/user/{username}", response_model=list[ChatSchema])
@@ -284,6 +384,39 @@ def get_chats_by_username(username: str, db: Session = Depends(get_db)):
     )
     return chats
 
+@router.get("/user/{username}/chats", response_model=ChatPage)
+def get_chat_page_by_username(
+    username: str,
+    limit: int = pagination.PAGE_DEFAULT,
+    before: int | None = None,
+    after: int | None = None,
+    mode: Literal["list", "full"] = "list",
+    db: Session = Depends(get_db),
+):
+    """A page of the user's chats, most recently active first.
+
+    Paged by cursor (`before`/`after` from the previous page) instead of
+    returning every chat at once like `/chat/user/{username}`. `mode=list`
+    leaves out message bodies and returns a preview of the last message.
+    """
+    user = db.query(User).filter(User.username == username).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return pagination.chat_page(db, user.id, limit, before, after, mode)
+
+
+@router.get("/{chat_id}/messages", response_model=MessagePage)
+def get_message_page(
+    chat_id: int,
+    limit: int = 50,
+    before: int | None = None,
+    after: int | None = None,
+    db: Session = Depends(get_db),
+):
+    """A page of a chat's messages, oldest first: the newest `limit` without
+    cursors, older ones with `before`, newer ones with `after`."""
+    return pagination.message_page(db, chat_id, limit, before, after)
+
 # --- New: Get chats by session_id ---
 @router.get("/session/{session_id}", response_model=list[ChatSchema])
 def get_chats_by_session(session_id: str, db: Session = Depends(get_db)):
@@ -293,261 +426,102 @@ def get_chats_by_session(session_id: str, db: Session = Depends(get_db)):
     return chats
 
 
+def apply_answer_grade(db: Session, user_id: int, judge: dict):
+    """Apply a final-answer grade to the user's score, level and streak counters.
+
+    Runs inside the chat turn's transaction (see `_save_turn`); the caller commits.
+    """
+    is_correct = bool(judge.get("correct"))
+    logger.info(f"✅ FINAL ANSWER for user {user_id}: correct={is_correct}")
+    result = scoring.apply_attempt(db, user_id, is_correct)
+    if result is None:
+        logger.warning(f"User id={user_id} not found when applying grade")
+        return
+    logger.debug(f"Post-update user id={user_id} -> {result}")
+
+
 @router.post("/send/check/{username}")
 ##divide the check answer
-def check_message_instant(
+async def check_message_instant(
     username: str,
     message: MessageSchema,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
-    """Send a message using username — return only bot’s reply."""
-    # --- Look up user ---
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    """Send a message using username — return only bot’s reply.
+
+    Grading and hint generation run concurrently. Nothing is written until
+    both are done; then the user message, time, grade and bot reply are
+    saved in one commit.
+    """
+    # --- Look up user, chat, hint context and grader conversation (in a worker thread) ---
+    user, session_id, chat, last_context, conversation, topics = await asyncio.to_thread(
+        _load_turn, db, username, message, context_builder.CONTEXT_GRADER_TOKENS,
+    )
     user_id = user.id
+    admission.set_user(username)
 
     try:
-        session_id = message.session_id or str(uuid.uuid4())
-
-        # --- Find or create chat ---
-        chat = db.query(Chat).filter(Chat.session_id == session_id).first()
-        if not chat:
-            chat = Chat(
-                title=llm.get_chat_title(message.text),
-                session_id=session_id,
-            )
-            db.add(chat)
-            db.commit()
-            db.refresh(chat)
-
-        # --- Save user message ---
-        user_msg = Message(
-            text=message.text,
-            image=message.image,
-            sender="user",
-            chat_id=chat.id,
-            user_id=user_id,
-        )
-        db.add(user_msg)
-        db.commit()
-
-        # ✅ Update user's time metrics
-        if message.time_taken and message.time_taken > 0:
-            # Use the column expression (User.total_time_taken) as the key
-            # — don't use the instance value `user.total_time_taken` which is a float
-            # (that caused the "got 0.0" error when used as a dict key).
-            from sqlalchemy import func
-
-            # Safely add time_taken; coalesce handles NULLs in the DB.
-            db.query(User).filter(User.id == user_id).update(
-                {
-                    User.total_time_taken: (func.coalesce(User.total_time_taken, 0.0) + (message.time_taken)/60),
-                },
-                synchronize_session=False,
-            )
-            db.commit()
-        #  Check if user has given final answer
-        
-        try:
-            # Load previous messages for context
-            previous_messages = (
-                db.query(Message)
-                .filter(Message.chat_id == chat.id)
-                .order_by(desc(Message.id))
-                .limit(10)
-                .all()
-            )
-            previous_messages.reverse()
-
-            # Convert to conversation format
-            conversation = [
-                {"role": "assistant" if m.sender == "bot" else "user", "content": m.text}
-                for m in previous_messages
-                if m.text
-            ]
-
-            # Helper to load class topics
-            def get_topics_for_class(level):
-                try:
-                    base = Path(__file__).resolve().parents[1] / "syllabus" / "topics.json"
-                    if not base.exists():
-                        return None
-                    data = json.load(open(base, encoding="utf-8"))
-                    key = f"class_{str(level).strip().replace('class_', '')}"
-                    return data.get(key)
-                except Exception:
-                    return None
-
-            topics = get_topics_for_class(user.class_level or user.level)
-
-            # Ask LLM to detect if final + correct
-            judge = llm.check_answer(conversation=conversation, class_topics=topics)
-            logger.debug(f"Judge output: {judge}")
-
-            if isinstance(judge, dict):
-                is_final = judge.get("final", False)
-                logger.info(f"🔍 Answer Check for user {user_id}: final={is_final}, judge={judge}")
-                
-                if is_final:
-                    # Use atomic UPDATEs to avoid race conditions and ensure counters increment correctly.
-                    try:
-                        is_correct = bool(judge.get("correct"))
-                        logger.info(f"✅ FINAL ANSWER for user {user_id}: correct={is_correct}")
-
-                        if is_correct:
-                            logger.info(f"✓ Correct answer detected for user {user_id} (atomic update)")
-                            db.query(User).filter(User.id == user_id).update(
-                                {
-                                    User.total_attempts: (User.total_attempts + 1),
-                                    User.correct_attempts: (User.correct_attempts + 1),
-                                    User.score: (User.score + 1.0),
-                                },
-                                synchronize_session=False,
-                            )
-                        else:
-                            logger.info(f"✗ Incorrect answer detected for user {user_id} (atomic update)")
-                            db.query(User).filter(User.id == user_id).update(
-                                {
-                                    User.total_attempts: (User.total_attempts + 1),
-                                    User.score: (User.score - 0.25),
-                                },
-                                synchronize_session=False,
-                            )
-
-                        # Commit the atomic update
-                        db.commit()
-
-                        # Clamp negative score to 0.0 if it happened
-                        try:
-                            u_after = db.query(User).filter(User.id == user_id).first()
-
-                            # Level-up when score crosses threshold
-                            if is_correct and u_after and (u_after.score or 0.0) > 50.0:
-                                db.query(User).filter(User.id == user_id).update(
-                                    {
-                                        User.level: (User.level + 1),
-                                        User.score: 0.0,
-                                    },
-                                    synchronize_session=False,
-                                )
-                                db.commit()
-                                u_after = db.query(User).filter(User.id == user_id).first()
-
-                            if u_after and (u_after.score or 0.0) < 0.0:
-                                db.query(User).filter(User.id == user_id).update({User.score: 0.0}, synchronize_session=False)
-                                db.commit()
-
-                            # Log resulting values for verification
-                            if u_after:
-                                logger.debug(
-                                    f"Post-update user id={user_id} -> total_attempts={u_after.total_attempts}, "
-                                    f"correct_attempts={u_after.correct_attempts}, score={u_after.score}"
-                                )
-                            else:
-                                logger.warning(f"User id={user_id} not found after update")
-                        except Exception as requery_err:
-                            # Non-fatal: log and continue
-                            db.rollback()
-                            logger.warning(f"Could not re-query/normalize user id={user_id} after commit: {requery_err}")
-
-                        # Update streaks based on correctness: maintain current_streak and max_streak
-                        try:
-                            u_after = db.query(User).filter(User.id == user_id).first()
-                            if u_after:
-                                prev_streak = int(u_after.current_streak or 0)
-                                prev_max = int(u_after.max_streak or 0)
-                                # Compute new streak: if last update was a correct answer, increment, else reset to 0
-                                if is_correct:
-                                    new_streak = prev_streak + 1
-                                else:
-                                    new_streak = 0
-
-                                new_max = prev_max
-                                if new_streak > prev_max:
-                                    new_max = new_streak
-
-                                # Only write if changed
-                                if new_streak != prev_streak or new_max != prev_max:
-                                    db.query(User).filter(User.id == user_id).update(
-                                        {
-                                            User.current_streak: new_streak,
-                                            User.max_streak: new_max,
-                                        },
-                                        synchronize_session=False,
-                                    )
-                                    db.commit()
-                        except Exception as streak_err:
-                            db.rollback()
-                            logger.warning(f"Could not update streaks for user id={user_id}: {streak_err}")
-                    except Exception as commit_err:
-                        db.rollback()
-                        logger.error(f"Failed to apply atomic user update for id={user_id}: {commit_err}")
-                else:
-                    logger.info(f"⏳ Not a final answer yet for user {user_id} - awaiting final submission")
-
-        except Exception as e:
-            logger.warning(f"Answer-check skipped due to error: {e}")
-
         # ------------------------------------------
-        #  2️⃣ Generate bot’s reply (LLM Hint)
+        #  1️⃣ Check final answer and 2️⃣ generate the hint — the hint does not
+        #  depend on the grade, so both LLM calls run at the same time.
+        #  Obvious non-answers ("I don't understand", questions) skip grading.
         # ------------------------------------------
-        previous_messages = (
-            db.query(Message)
-            .filter(Message.chat_id == chat.id)
-            .order_by(desc(Message.id))
-            .limit(6)
-            .all()
-        )
-        previous_messages.reverse()
-        last_context = "\n".join(
-            [f"{msg.sender.capitalize()}: {msg.text}" for msg in previous_messages if msg.text]
+        hint_kwargs = dict(
+            question=message.text,
+            last_context=last_context,
+            image_b64=_image_b64(message.image),
+            user_class=user.class_level or user.level,
+            parent_feedback=getattr(user, "Parent_feedback", None),
         )
-
-        # Generate hint
-        if message.image:
-            image_b64 = (
-                message.image.split(",")[1]
-                if message.image.startswith("data:")
-                else message.image
-            )
-            bot_text = llm.generate_hint(
-                question=message.text,
-                last_context=last_context,
-                    image_b64=image_b64,
-                    user_class=user.class_level or user.level,
-                    parent_feedback=getattr(user, "Parent_feedback", None),
-            )
+        judge = None if message.image else answer_filter.check(message.text)
+        if judge is not None:
+            bot_text = await llm.agenerate_hint(**hint_kwargs)
+        elif llm.GRADE_HINT_MODE == "combined":
+            # One structured completion returns both the grade and the hint
+            judge, bot_text = await llm.agrade_and_hint(conversation=conversation, **hint_kwargs)
         else:
-            bot_text = llm.generate_hint(
-                question=message.text,
-                last_context=last_context,
-                user_class=user.class_level or user.level,
-                parent_feedback=getattr(user, "Parent_feedback", None),
+            judge, bot_text = await asyncio.gather(
+                llm.acheck_answer(conversation=conversation, class_topics=topics),
+                llm.agenerate_hint(**hint_kwargs),
             )
-
+        logger.debug(f"Judge output: {judge}")
         logger.info(f"Generated bot response for user {username}")
 
-        # --- Save bot reply ---
-        bot_msg = Message(
-            text=bot_text,
-            sender="bot",
-            chat_id=chat.id,
+        is_final = None
+        if isinstance(judge, dict):
+            final = judge.get("final", False)
+            logger.info(f"🔍 Answer Check for user {user_id}: final={final}, judge={judge}")
+            # Keep real grader verdicts as training labels for the answer pre-filter
+            if judge.get("source") != "prefilter" and judge.get("feedback") != "Error or invalid JSON":
+                is_final = bool(final)
+            if not final:
+                logger.info(f"⏳ Not a final answer yet for user {user_id} - awaiting final submission")
+        else:
+            judge = None
+
+        # --- Save the turn (chat, user message, time, grade, bot reply) in one commit ---
+        chat, _, bot_msg, created = await asyncio.to_thread(
+            _save_turn, db, session_id, chat, message, user_id, bot_text,
+            time_taken=message.time_taken, judge=judge, is_final=is_final,
         )
-        db.add(bot_msg)
-        db.commit()
+        if created:
+            background_tasks.add_task(chat_title.refine_title, chat.id, message.text, chat.title)
+        background_tasks.add_task(chat_summary.refresh, chat.id)
 
         # Return only current interaction
         return {
             "bot_message": {
-                "text": bot_msg.text,
-                "sender": bot_msg.sender,
+                "text": bot_msg.text if bot_msg else bot_text,
+                "sender": "bot",
                 "session_id": session_id,
             }
         }
 
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
-        print(f"❌ Error: {e}")
+        logger.exception(f"Error in check_message_instant: {e}")
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-
@@ -1,8 +1,11 @@
+from typing import Literal
+
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from models.schemas import Chat as ChatSchema
+from models.schemas import Chat as ChatSchema, ChatPage
 from models.models import Chat
 from helper import get_db
+import pagination
 
 router = APIRouter(prefix="/history", tags=["history"])
 
@@ -11,3 +14,15 @@ router = APIRouter(prefix="/history", tags=["history"])
 def get_history(db: Session = Depends(get_db)):
     chats = db.query(Chat).all()
     return chats
+
+
+@router.get("/chats", response_model=ChatPage)
+def get_history_page(
+    limit: int = pagination.PAGE_DEFAULT,
+    before: int | None = None,
+    after: int | None = None,
+    mode: Literal["list", "full"] = "list",
+    db: Session = Depends(get_db),
+):
+    """Cursor-paginated version of `/history/`: all chats, most recently active first."""
+    return pagination.chat_page(db, None, limit, before, after, mode)
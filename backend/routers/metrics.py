@@ -0,0 +1,54 @@
+from fastapi import APIRouter
+
+import admission
+import answer_filter
+import context_builder
+import hint_cache
+import image_prep
+import llm
+import llm_metrics
+import llm_transport
+import local_grader
+import prompt_cache
+
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get("/admission", summary="LLM admission control stats")
+def get_admission_stats():
+    """
+    In-flight calls, queue depth and wait times of the LLM admission controller,
+    plus rejection counts — for capacity planning.
+    """
+    return admission.stats()
+
+
+@router.get("/resilience", summary="LLM circuit breaker and fallback stats")
+def get_resilience_stats():
+    """
+    Circuit state, failures and p50/p95 latency per model, plus how many calls
+    were served by a fallback model, hedged, or cut off by their deadline.
+    """
+    return llm.resilience_stats()
+
+
+@router.get("/llm", summary="LLM call latency, tokens and cost per endpoint")
+def get_llm_stats():
+    """
+    Calls, errors, cache hits, p50/p95 wall time, time-to-first-token, tokens
+    and estimated cost per (LLM function, route) and per model, alongside the
+    hint cache, coalescing, local grader, answer filter, prompt size, image
+    prep, record/replay transport and provider prompt cache stats.
+    """
+    return {
+        **llm_metrics.stats(),
+        "hint_cache": hint_cache.stats(),
+        "coalescing": llm.coalescing_stats(),
+        "local_grader": local_grader.stats(),
+        "answer_filter": answer_filter.stats(),
+        "prompts": context_builder.stats(),
+        "images": image_prep.stats(),
+        "transport": llm_transport.stats(),
+        "prompt_cache": prompt_cache.stats(),
+    }
@@ -18,6 +18,7 @@ from auth import create_access_token, verify_token, hash_password, verify_passwo
 from datetime import timedelta
 from sqlalchemy import func
 from llm import generate_parent_report
+import admission
 from io import BytesIO
 from fastapi.responses import StreamingResponse
 from reportlab.lib.pagesizes import LETTER
@@ -258,10 +259,13 @@ def generate_child_report(payload: ParentReportRequest, username: str = Depends(
         raise HTTPException(status_code=403, detail="Parent not found or not authenticated as parent")
 
     try:
+        admission.set_user(username)
         text = generate_parent_report(
             child=dict(payload.child),
             comparison=dict(payload.comparison) if payload.comparison is not None else None,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM error: {e}")
 
@@ -288,6 +292,7 @@ def generate_child_report_pdf(payload: ParentReportRequest, username: str = Depe
         # Get report text via LLM
         try:
             logger.info("Starting LLM report generation...")
+            admission.set_user(username)
             report_text = generate_parent_report(
                 child=dict(payload.child),
                 comparison=dict(payload.comparison) if payload.comparison is not None else None,
@@ -458,10 +463,13 @@ def email_child_report(payload: ParentReportRequest, username: str = Depends(ver
 
     # Get report text via LLM
     try:
+        admission.set_user(username)
         report_text = generate_parent_report(
             child=dict(payload.child),
             comparison=dict(payload.comparison) if payload.comparison is not None else None,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM error: {e}")
 
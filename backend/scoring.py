@@ -0,0 +1,94 @@
+"""Score bookkeeping for a graded final answer, in one atomic UPDATE.
+
+A correct answer adds CORRECT_POINTS, a wrong one subtracts WRONG_PENALTY.
+When a correct answer takes the score past LEVEL_UP_SCORE the user goes up
+a level and the score restarts at 0; a negative score is clamped to 0.
+A correct answer extends the current streak (and the max streak with it),
+a wrong one resets it.
+
+All of that is computed by the database in a single
+`UPDATE users SET ... RETURNING ...`. Every SET expression reads the row as
+it was before the statement, so there is no window between reading and
+writing the counters for a concurrent submission to slip into.
+"""
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+
+from models.models import User
+
+logger = logging.getLogger(__name__)
+
+CORRECT_POINTS = 1.0
+WRONG_PENALTY = 0.25
+LEVEL_UP_SCORE = 50.0
+
+
+@dataclass(frozen=True)
+class ScoreResult:
+    """User counters after an attempt was applied."""
+    level: int
+    score: float
+    total_attempts: int
+    correct_attempts: int
+    current_streak: int
+    max_streak: int
+
+
+_RESULT_COLUMNS = (
+    User.level, User.score, User.total_attempts, User.correct_attempts, User.current_streak, User.max_streak,
+)
+
+
+def _values(correct: bool) -> dict:
+    """SET clause for one attempt; every expression uses the pre-update row."""
+    score = func.coalesce(User.score, 0.0) + (CORRECT_POINTS if correct else -WRONG_PENALTY)
+    streak = func.coalesce(User.current_streak, 0)
+    max_streak = func.coalesce(User.max_streak, 0)
+    level_up = score > LEVEL_UP_SCORE if correct else False
+    values = {
+        User.total_attempts: func.coalesce(User.total_attempts, 0) + 1,
+        User.score: case((score < 0.0, 0.0), else_=score),
+        User.current_streak: 0,
+    }
+    if correct:
+        values.update({
+            User.correct_attempts: func.coalesce(User.correct_attempts, 0) + 1,
+            User.score: case((level_up, 0.0), (score < 0.0, 0.0), else_=score),
+            User.level: func.coalesce(User.level, 1) + case((level_up, 1), else_=0),
+            User.current_streak: streak + 1,
+            User.max_streak: case((streak + 1 > max_streak, streak + 1), else_=max_streak),
+        })
+    return values
+
+
+def apply_attempt(db: Session, user_id: int, correct: bool) -> ScoreResult | None:
+    """Apply one graded final answer to the user's counters.
+
+    Runs in the caller's transaction (the caller commits). Returns the new
+    counters, or None if the user doesn't exist.
+    """
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(_values(correct))
+        .execution_options(synchronize_session=False)
+    )
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(stmt.returning(*_RESULT_COLUMNS)).first()
+    else:
+        # No RETURNING (SQLite < 3.35): read the row back inside the same transaction
+        db.execute(stmt)
+        row = db.execute(select(*_RESULT_COLUMNS).where(User.id == user_id)).first()
+    if row is None:
+        return None
+    return ScoreResult(
+        level=int(row.level or 1),
+        score=float(row.score or 0.0),
+        total_attempts=int(row.total_attempts or 0),
+        correct_attempts=int(row.correct_attempts or 0),
+        current_streak=int(row.current_streak or 0),
+        max_streak=int(row.max_streak or 0),
+    )
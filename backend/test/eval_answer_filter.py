@@ -0,0 +1,94 @@
+"""Offline evaluation of the final-answer pre-filter against stored grader verdicts.
+
+Uses user messages whose `is_final` label was written by the LLM/local grader,
+splits them by chat (so one session never lands in both sets), trains the naive
+Bayes model on the training split and reports, for each threshold, how the
+filter's "skip grading" decision compares with the grader's historical judgment.
+
+Run from the backend folder:
+    python test/eval_answer_filter.py --db app.db --thresholds 0.05 0.1 0.15 0.25
+"""
+import argparse
+import sqlite3
+import sys
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import answer_filter  # noqa: E402
+
+
+def load_samples(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT chat_id, text, is_final FROM messages "
+            "WHERE sender = 'user' AND is_final IS NOT NULL AND text IS NOT NULL"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(chat_id, text, bool(is_final)) for chat_id, text, is_final in rows]
+
+
+def split(samples, test_percent):
+    train, test = [], []
+    for chat_id, text, label in samples:
+        bucket = zlib.crc32(str(chat_id).encode()) % 100
+        (test if bucket < test_percent else train).append((text, label))
+    return train, test
+
+
+def evaluate(test, threshold, model):
+    """Precision/recall of the 'final answer' class as seen through the filter.
+
+    A message the filter skips is predicted not-final; everything else goes to
+    the grader and counts as predicted final. Recall is the share of real final
+    answers that still reach the grader (the number that must stay near 1.0).
+    """
+    tp = fp = fn = tn = 0
+    for text, is_final in test:
+        passed = answer_filter.should_skip_grading(text, threshold=threshold, model=model) is None
+        if passed and is_final:
+            tp += 1
+        elif passed:
+            fp += 1
+        elif is_final:
+            fn += 1
+        else:
+            tn += 1
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    skipped = (fn + tn) / len(test) if test else 0.0
+    return {"precision": precision, "recall": recall, "skip_rate": skipped, "missed_finals": fn, "saved_calls": tn}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="app.db", help="SQLite database file")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.05, 0.1, 0.15, 0.25, 0.5])
+    parser.add_argument("--test-percent", type=int, default=20)
+    args = parser.parse_args()
+
+    samples = load_samples(args.db)
+    if not samples:
+        print("❌ No labelled messages (messages.is_final) found in", args.db)
+        sys.exit(1)
+    train, test = split(samples, args.test_percent)
+    finals = sum(1 for _, label in test if label)
+    print(f"Labelled messages: {len(samples)} (train {len(train)}, test {len(test)}, finals in test {finals})")
+
+    model = answer_filter.NaiveBayes.train(train) if train else None
+    print(f"\n{'mode':<14}{'threshold':>10}{'precision':>11}{'recall':>9}{'skip_rate':>11}{'missed':>8}{'saved':>7}")
+    rows = [("rules only", None, None)] + [("rules+model", t, model) for t in args.thresholds]
+    for name, threshold, m in rows:
+        r = evaluate(test, threshold if threshold is not None else 0.0, m)
+        shown = f"{threshold:.2f}" if threshold is not None else "-"
+        print(
+            f"{name:<14}{shown:>10}{r['precision']:>11.3f}{r['recall']:>9.3f}"
+            f"{r['skip_rate']:>11.3f}{r['missed_finals']:>8}{r['saved_calls']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
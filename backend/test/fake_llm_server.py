@@ -0,0 +1,173 @@
+"""Local OpenAI-compatible completion server for exercising the LLM layer offline.
+
+Serves POST /v1/chat/completions (plain and `stream: true`). Behaviour is set
+per model name: a reply text, a delay, an HTTP error status, or a queue of
+one-shot behaviours for scripted scenarios. Every request is counted per model.
+
+It also fakes Gemini's cachedContents API (POST to create, PATCH to extend
+the TTL); created entries are kept in `cached_contents`.
+
+Point the backend at it with, e.g.:
+    python test/fake_llm_server.py --port 8765 --delay 0.3 --fail-rate 0.2
+    LLM_MODEL=openai/fake-primary LLM_FALLBACK_MODELS=openai/fake-backup \\
+    LLM_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake uvicorn main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLLMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.default = {"reply": "fake reply", "delay": 0.0, "status": 200, "fail_rate": 0.0}
+        self.behaviour: dict[str, dict] = {}
+        self.scripts: dict[str, deque] = defaultdict(deque)
+        self.hits = Counter()
+        self.cached_contents: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def set(self, model: str, **behaviour):
+        """Set the standing behaviour for `model` (reply, delay, status, fail_rate)."""
+        self.behaviour[model] = {**self.default, **behaviour}
+
+    def script(self, model: str, *behaviours: dict):
+        """Queue one-shot behaviours used by the next requests for `model`."""
+        self.scripts[model].extend({**self.behaviour.get(model, self.default), **b} for b in behaviours)
+
+    def reset(self):
+        with self._lock:
+            self.behaviour.clear()
+            self.scripts.clear()
+            self.hits.clear()
+            self.cached_contents.clear()
+
+    def _next(self, model: str) -> dict:
+        with self._lock:
+            self.hits[model] += 1
+            if self.scripts[model]:
+                return self.scripts[model].popleft()
+            return self.behaviour.get(model, self.default)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                try:
+                    if "/cachedContents" in self.path:
+                        self._create_cached_content()
+                    else:
+                        self._respond()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (deadline, cancelled hedge)
+
+            def do_PATCH(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                name = self.path.split("?")[0].split("/v1beta/", 1)[-1]
+                with server._lock:
+                    server.hits["cachedContents.patch"] += 1
+                    entry = server.cached_contents.get(name)
+                    if entry is not None:
+                        entry["ttl"] = body.get("ttl")
+                if entry is None:
+                    self._send_json(404, {"error": {"code": 404, "message": f"CachedContent not found: {name}"}})
+                else:
+                    self._send_json(200, entry)
+
+            def _create_cached_content(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                b = server._next("cachedContents.create")
+                if b["status"] != 200:
+                    self._send_json(b["status"], {"error": {"code": b["status"], "message": "fake cache failure"}})
+                    return
+                with server._lock:
+                    name = f"cachedContents/fake-{len(server.cached_contents) + 1}"
+                    server.cached_contents[name] = {"name": name, **body}
+                self._send_json(200, server.cached_contents[name])
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                model = request.get("model", "")
+                b = server._next(model)
+                time.sleep(b["delay"])
+                if b["status"] != 200 or random.random() < b["fail_rate"]:
+                    status = b["status"] if b["status"] != 200 else 500
+                    self._send_json(status, {"error": {"message": f"fake failure for {model}", "type": "server_error"}})
+                    return
+                words = b["reply"].split(" ")
+                if request.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for i, word in enumerate(words):
+                        chunk = {
+                            "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                            "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word}, "finish_reason": None}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.close_connection = True
+                    return
+                self._send_json(200, {
+                    "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": b["reply"]}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": len(words), "total_tokens": 10 + len(words)},
+                })
+
+        return Handler
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reply", default="Try breaking the problem into smaller steps.")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    args = parser.parse_args()
+    server = FakeLLMServer(port=args.port)
+    server.default.update(reply=args.reply, delay=args.delay, fail_rate=args.fail_rate)
+    print(f"Fake LLM server on {server.base_url}")
+    server._httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
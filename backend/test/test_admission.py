@@ -0,0 +1,174 @@
+"""Admission control for upstream LLM calls: FIFO queueing, the per-user 429,
+queue-full and queue-timeout 503s with Retry-After, and cancelled waiters.
+
+    python -m pytest test/test_admission.py
+"""
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import admission  # noqa: E402
+from admission import AdmissionController, Overloaded  # noqa: E402
+
+
+def controller(max_in_flight=1, max_per_user=10, max_queue=10, queue_timeout=5.0):
+    return AdmissionController(max_in_flight, max_per_user, max_queue, queue_timeout)
+
+
+async def hold(ctrl, name, entered, release, user=None):
+    """Take a slot as `user`, note the order it was entered in, keep it until `release` is set."""
+    admission.set_user(user)
+    async with ctrl.aslot():
+        entered.append(name)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_admitted_in_fifo_order():
+    async def scenario():
+        ctrl = controller()
+        entered, releases = [], {n: asyncio.Event() for n in "abcd"}
+        tasks = {}
+        for name in "abcd":
+            tasks[name] = asyncio.create_task(hold(ctrl, name, entered, releases[name]))
+            await settle()
+        assert entered == ["a"] and ctrl.stats()["queue_depth"] == 3
+        for name in "abcd":
+            releases[name].set()
+            await tasks[name]
+            await settle()
+        assert entered == ["a", "b", "c", "d"]
+        stats = ctrl.stats()
+        assert (stats["admitted"], stats["queued"], stats["in_flight"], stats["queue_depth"]) == (4, 3, 0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_user_over_limit_gets_429():
+    async def scenario():
+        ctrl = controller(max_in_flight=4, max_per_user=1)
+        entered, release = [], asyncio.Event()
+        task = asyncio.create_task(hold(ctrl, "first", entered, release, user="kid"))
+        await settle()
+        with pytest.raises(Overloaded) as exc:
+            await hold(ctrl, "second", entered, release, user="kid")
+        # Other users are not affected
+        other = asyncio.create_task(hold(ctrl, "other", entered, release, user="other"))
+        await settle()
+        release.set()
+        await asyncio.gather(task, other)
+        return exc.value, entered, ctrl.stats()
+
+    error, entered, stats = asyncio.run(scenario())
+    assert error.status_code == 429 and int(error.headers["Retry-After"]) >= 1
+    assert entered == ["first", "other"] and stats["rejected_per_user"] == 1
+
+
+def test_full_queue_gets_503():
+    async def scenario():
+        ctrl = controller(max_queue=1)
+        entered, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(ctrl, n, entered, release)) for n in ("running", "queued")]
+        await settle()
+        with pytest.raises(Overloaded) as exc:
+            await hold(ctrl, "rejected", entered, release)
+        release.set()
+        await asyncio.gather(*tasks)
+        return exc.value, entered, ctrl.stats()
+
+    error, entered, stats = asyncio.run(scenario())
+    assert error.status_code == 503 and int(error.headers["Retry-After"]) >= 1
+    assert entered == ["running", "queued"] and stats["rejected_queue_full"] == 1
+
+
+def test_queue_timeout_gets_503():
+    async def scenario():
+        ctrl = controller(queue_timeout=0.05)
+        entered, release = [], asyncio.Event()
+        task = asyncio.create_task(hold(ctrl, "running", entered, release))
+        await settle()
+        with pytest.raises(Overloaded) as exc:
+            await hold(ctrl, "waiting", entered, release)
+        release.set()
+        await task
+        return exc.value, entered, ctrl.stats()
+
+    error, entered, stats = asyncio.run(scenario())
+    assert error.status_code == 503 and error.headers["Retry-After"] == str(error.retry_after)
+    assert entered == ["running"]
+    assert (stats["timed_out"], stats["queue_depth"], stats["in_flight"]) == (1, 0, 0)
+
+
+def test_sync_slot_times_out_in_queue():
+    ctrl = controller(queue_timeout=0.05)
+    holding, release = threading.Event(), threading.Event()
+
+    def run():
+        with ctrl.slot():
+            holding.set()
+            release.wait()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    holding.wait()
+    with pytest.raises(Overloaded) as exc:
+        with ctrl.slot():
+            pass
+    release.set()
+    thread.join()
+    assert exc.value.status_code == 503 and ctrl.stats()["in_flight"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        ctrl = controller()
+        entered, release = [], asyncio.Event()
+        running = asyncio.create_task(hold(ctrl, "running", entered, release))
+        await settle()
+        cancelled = asyncio.create_task(hold(ctrl, "cancelled", entered, release))
+        await settle()
+        nxt = asyncio.create_task(hold(ctrl, "next", entered, release))
+        await settle()
+        cancelled.cancel()
+        await settle()
+        assert ctrl.stats()["queue_depth"] == 1
+        release.set()
+        await asyncio.gather(running, nxt)
+        return entered, ctrl.stats()
+
+    entered, stats = asyncio.run(scenario())
+    assert entered == ["running", "next"]
+    assert (stats["cancelled"], stats["in_flight"], stats["queue_depth"]) == (1, 0, 0)
+
+
+def test_waiter_cancelled_after_grant_hands_slot_on():
+    async def scenario():
+        ctrl = controller()
+        entered, release = [], asyncio.Event()
+        running = ctrl.aslot()
+        await running.__aenter__()
+        granted = asyncio.create_task(hold(ctrl, "granted", entered, release))
+        await settle()
+        nxt = asyncio.create_task(hold(ctrl, "next", entered, release))
+        await settle()
+        # Hand the slot to "granted", then cancel it before it gets to run
+        await running.__aexit__(None, None, None)
+        granted.cancel()
+        await settle()
+        release.set()
+        await nxt
+        return entered, granted.cancelled(), ctrl.stats()
+
+    entered, was_cancelled, stats = asyncio.run(scenario())
+    assert was_cancelled and entered == ["next"]
+    # Granted before the cancel landed: not counted as a cancelled waiter
+    assert (stats["cancelled"], stats["in_flight"], stats["queue_depth"]) == (0, 0, 0)
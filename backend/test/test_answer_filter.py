@@ -0,0 +1,134 @@
+"""Final-answer pre-filter: rules, the naive Bayes model, the skip decision
+and retraining a saved model once it is stale, against a temp SQLite file.
+
+    python -m pytest test/test_answer_filter.py
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import answer_filter  # noqa: E402
+from answer_filter import NaiveBayes  # noqa: E402
+from database import Base  # noqa: E402
+from models.models import Chat, Message  # noqa: E402
+
+FINAL = ["12", "x = 4", "the answer is 3/4", "7/8", "it is 36", "15"]
+NOT_FINAL = ["i think we add them", "do we multiply first", "wait let me try", "hmm not sure", "so we carry the one", "what next"]
+
+
+def samples(n=1):
+    return [(t, True) for t in FINAL] * n + [(t, False) for t in NOT_FINAL] * n
+
+
+@pytest.fixture(autouse=True)
+def no_model(monkeypatch):
+    monkeypatch.setattr(answer_filter, "_model", None)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(answer_filter, "ANSWER_FILTER_MODEL_PATH", str(tmp_path / "model.json"))
+    monkeypatch.setattr(answer_filter, "ANSWER_FILTER_MIN_SAMPLES", 10)
+    engine = create_engine(f"sqlite:///{tmp_path / 'filter.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(autoflush=False, bind=engine)()
+    chat = Chat(title="c", session_id="s")
+    session.add(chat)
+    session.flush()
+    add_labels(session, chat.id, samples())
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def add_labels(db, chat_id, pairs):
+    db.add_all(Message(text=t, sender="user", chat_id=chat_id, is_final=label) for t, label in pairs)
+    db.commit()
+
+
+@pytest.mark.parametrize("text, verdict", [
+    ("hello", False),
+    ("I don't understand", False),
+    ("another hint please", False),
+    ("is it positive?", False),
+    ("12", None),
+    ("is it 12?", None),  # has a number: may be an answer
+    ("", None),  # image-only
+    ("because they are equal", None),
+    ("ok thanks!", False),
+    ("hi, can you help me", False),
+    # Starts like a non-answer but is a word answer
+    ("ok the answer is seven", None),
+    ("okay twelve", None),
+    ("thanks, it is seven", None),
+    ("hi its seven", None),
+    ("how about seven", None),
+])
+def test_rule_verdict(text, verdict):
+    assert answer_filter.rule_verdict(text) is verdict
+
+
+def test_naive_bayes_separates_classes_and_round_trips():
+    model = NaiveBayes.train(samples(3))
+    assert model.size == 36
+    assert model.probability_final("the answer is 9") > 0.5 > model.probability_final("let me try again")
+    again = NaiveBayes.from_dict(json.loads(json.dumps(model.to_dict())))
+    assert again.probability_final("9") == pytest.approx(model.probability_final("9"))
+
+
+def test_should_skip_grading():
+    model = NaiveBayes.train(samples(3))
+    assert answer_filter.should_skip_grading("thanks", model=model) == "rule"
+    assert answer_filter.should_skip_grading("wait let me try", threshold=0.15, model=model) == "model"
+    assert answer_filter.should_skip_grading("wait let me try", threshold=0.0, model=model) is None
+    assert answer_filter.should_skip_grading("x = 5", model=model) is None
+    # No model: only the rules can skip
+    assert answer_filter.should_skip_grading("wait let me try") is None
+    assert answer_filter.should_skip_grading("") is None
+
+
+def test_check_marks_skips_as_prefilter(monkeypatch):
+    monkeypatch.setattr(answer_filter, "ANSWER_FILTER_ENABLED", True)
+    assert answer_filter.check("hello")["source"] == "prefilter"
+    assert answer_filter.check("12") is None
+    for text in ("ok the answer is seven", "okay twelve", "thanks, it is seven", "hi its seven", "how about seven"):
+        assert answer_filter.check(text) is None
+    monkeypatch.setattr(answer_filter, "ANSWER_FILTER_ENABLED", False)
+    assert answer_filter.check("hello") is None
+
+
+def test_trains_when_no_saved_model(db):
+    answer_filter.load_or_train(db)
+    assert answer_filter._model.size == 12
+    assert os.path.exists(answer_filter.ANSWER_FILTER_MODEL_PATH)
+
+
+def test_fresh_saved_model_is_kept(db):
+    answer_filter.load_or_train(db)
+    add_labels(db, 1, [("99", True)])  # under the growth threshold
+    answer_filter.load_or_train(db)
+    assert answer_filter._model.size == 12
+
+
+def test_retrains_after_label_growth(db):
+    answer_filter.load_or_train(db)
+    add_labels(db, 1, samples())
+    answer_filter.load_or_train(db)
+    assert answer_filter._model.size == 24
+
+
+def test_retrains_old_model(db):
+    answer_filter.load_or_train(db)
+    add_labels(db, 1, [("99", True)])
+    old = time.time() - (answer_filter.ANSWER_FILTER_RETRAIN_DAYS + 1) * 86400
+    os.utime(answer_filter.ANSWER_FILTER_MODEL_PATH, (old, old))
+    answer_filter.load_or_train(db)
+    assert answer_filter._model.size == 13
@@ -0,0 +1,86 @@
+"""Content-addressed image store, its static mount and the batch migration
+of inline images, against a temp directory and SQLite file.
+
+    python -m pytest test/test_blob_store.py
+"""
+import base64
+import io
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import blob_store  # noqa: E402
+import migrate_images  # noqa: E402
+
+
+def png(color=(255, 0, 0)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def data_url(data: bytes, mime="image/png") -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+
+@pytest.fixture(autouse=True)
+def blob_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(blob_store, "_counters", dict.fromkeys(blob_store._counters, 0))
+    return tmp_path / "blobs"
+
+
+def test_store_is_content_addressed_and_deduplicated(blob_dir):
+    data = png()
+    url = blob_store.store_image(data_url(data))
+    assert url.startswith("/blobs/") and url.endswith(".png")
+    assert blob_store.path_for(url).read_bytes() == data
+    # Same bytes without the data: prefix (type sniffed) -> same blob
+    assert blob_store.store_image(base64.b64encode(data).decode()) == url
+    assert blob_store.store_image(url) == url  # already stored
+    assert blob_store.store_image(data_url(png((0, 0, 255)))) != url
+    assert blob_store.stats()["stored"] == 2 and blob_store.stats()["deduplicated"] == 1
+    assert len(list(blob_dir.rglob("*.png"))) == 2
+
+
+def test_undecodable_image_kept_inline():
+    assert blob_store.store_image("data:image/png;base64,@@not base64@@") == "data:image/png;base64,@@not base64@@"
+    assert blob_store.store_image(None) is None
+
+
+def test_served_with_immutable_cache_headers(blob_dir):
+    url = blob_store.store_image(data_url(png()))
+    app = FastAPI()
+    app.mount(blob_store.BLOB_URL_PREFIX, blob_store.ImmutableStaticFiles(directory=str(blob_dir)))
+    r = TestClient(app).get(url)
+    assert r.status_code == 200 and r.content == png()
+    assert r.headers["cache-control"] == blob_store.BLOB_CACHE_CONTROL
+    assert r.headers["content-type"] == "image/png"
+
+
+def test_migration_moves_rows_in_batches(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE messages (id INTEGER PRIMARY KEY, image TEXT)"))
+        images = [data_url(png((i, i, i))) for i in range(4)] + [data_url(png((0, 0, 0))), None, "not an image!"]
+        conn.execute(text("INSERT INTO messages (image) VALUES (:image)"), [{"image": i} for i in images])
+    monkeypatch.setattr(migrate_images, "engine", engine)
+
+    assert migrate_images.migrate(batch_size=2, dry_run=True)["converted"] == 6
+    totals = migrate_images.migrate(batch_size=2)
+    assert (totals["rows"], totals["converted"], totals["kept"], totals["batches"]) == (6, 5, 1, 3)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT image FROM messages ORDER BY id")).scalars().all()
+    assert all(blob_store.is_blob_url(r) for r in rows[:5])
+    assert rows[0] == rows[4]  # identical uploads share one blob
+    assert rows[5:] == [None, "not an image!"]
+    assert blob_store.path_for(rows[1]).read_bytes() == png((1, 1, 1))
+    # Re-running only revisits rows that could not be converted
+    assert migrate_images.migrate(batch_size=2)["rows"] == 1
@@ -0,0 +1,133 @@
+"""Rolling chat summaries: the hint context (summary first, then only the
+messages it doesn't cover) and the background refresh, whose guarded update
+never lets an older summary overwrite a newer one. Uses a temp SQLite file.
+
+    python -m pytest test/test_chat_summary.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import chat_summary  # noqa: E402
+import context_builder  # noqa: E402
+import llm  # noqa: E402
+from database import Base  # noqa: E402
+from models.models import Chat, Message  # noqa: E402
+
+
+@pytest.fixture
+def Session(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'summary.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autoflush=False, bind=engine)
+    monkeypatch.setattr(chat_summary, "SessionLocal", factory)
+    monkeypatch.setattr(chat_summary, "CHAT_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(chat_summary, "CHAT_SUMMARY_EVERY", 4)
+    monkeypatch.setattr(chat_summary, "CHAT_SUMMARY_KEEP_TURNS", 2)
+    with factory() as db:
+        db.add(Chat(title="fractions", session_id="s"))
+        db.commit()
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def summarize(monkeypatch):
+    calls = []
+
+    def fake_summarize(previous, transcript, max_tokens=200):
+        calls.append((previous, transcript))
+        return f"summary #{len(calls)}"
+
+    monkeypatch.setattr(llm, "summarize_chat", fake_summarize)
+    return calls
+
+
+def add_messages(Session, n, start=0):
+    with Session() as db:
+        for i in range(start, start + n):
+            db.add(Message(text=f"m{i}", sender="user" if i % 2 == 0 else "bot", chat_id=1))
+        db.commit()
+
+
+def chat_row(Session):
+    with Session() as db:
+        chat = db.get(Chat, 1)
+        return chat.summary, chat.summary_upto_id
+
+
+def test_hint_context_for_a_new_chat():
+    ctx = chat_summary.hint_context(None, None, budget=100, pending=[("user", "What is 1/2 + 1/4?")])
+    assert ctx.text == "User: What is 1/2 + 1/4?"
+
+
+def test_hint_context_without_summary(Session):
+    add_messages(Session, 3)
+    with Session() as db:
+        ctx = chat_summary.hint_context(db, db.get(Chat, 1), budget=100, pending=[("user", "next")])
+    assert ctx.text.splitlines() == ["User: m0", "Bot: m1", "User: m2", "User: next"]
+
+
+def test_hint_context_puts_summary_first(Session):
+    add_messages(Session, 6)
+    with Session() as db:
+        chat = db.get(Chat, 1)
+        chat.summary, chat.summary_upto_id = "Adding fractions.", 4
+        db.commit()
+        ctx = chat_summary.hint_context(db, chat, budget=100, pending=[("user", "next")])
+    # Messages up to id 4 (m0..m3) are covered by the summary and left out
+    assert ctx.text.splitlines() == [context_builder._SUMMARY_LABEL + "Adding fractions.", "User: m4", "Bot: m5", "User: next"]
+
+
+def test_hint_context_respects_budget(Session):
+    add_messages(Session, 30)
+    with Session() as db:
+        ctx = chat_summary.hint_context(db, db.get(Chat, 1), budget=20)
+    assert ctx.tokens <= 20 and ctx.turns[-1] == ("bot", "m29") and ctx.dropped > 0
+
+
+def test_refresh_waits_for_enough_messages(Session, summarize):
+    add_messages(Session, 5)  # EVERY + KEEP_TURNS is 6
+    chat_summary.refresh(1)
+    assert summarize == [] and chat_row(Session) == (None, None)
+
+
+def test_refresh_folds_all_but_the_kept_turns(Session, summarize):
+    add_messages(Session, 7)
+    chat_summary.refresh(1)
+    assert chat_row(Session) == ("summary #1", 5)
+    assert summarize == [(None, "User: m0\nBot: m1\nUser: m2\nBot: m3\nUser: m4")]
+
+    add_messages(Session, 6, start=7)
+    chat_summary.refresh(1)
+    assert chat_row(Session) == ("summary #2", 11)
+    assert summarize[1][0] == "summary #1" and summarize[1][1].startswith("Bot: m5")
+
+
+def test_older_summary_does_not_overwrite_newer(Session, monkeypatch):
+    add_messages(Session, 7)
+
+    def racing_summarize(previous, transcript, max_tokens=200):
+        # Another refresh moves the summary further while this LLM call is running
+        with Session() as db:
+            chat = db.get(Chat, 1)
+            chat.summary, chat.summary_upto_id = "newer summary", 6
+            db.commit()
+        return "older summary"
+
+    monkeypatch.setattr(llm, "summarize_chat", racing_summarize)
+    chat_summary.refresh(1)
+    assert chat_row(Session) == ("newer summary", 6)
+    assert not chat_summary._running
+
+
+def test_refresh_disabled(Session, summarize, monkeypatch):
+    monkeypatch.setattr(chat_summary, "CHAT_SUMMARY_ENABLED", False)
+    add_messages(Session, 20)
+    chat_summary.refresh(1)
+    assert summarize == []
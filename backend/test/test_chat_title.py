@@ -0,0 +1,103 @@
+"""Chat titles: the local keyword title, and the background LLM title that
+only replaces a title still equal to its placeholder, against a temp SQLite file.
+
+    python -m pytest test/test_chat_title.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import chat_title  # noqa: E402
+import llm  # noqa: E402
+from database import Base  # noqa: E402
+from models.models import Chat  # noqa: E402
+
+
+@pytest.mark.parametrize("text, title", [
+    ("What is 3/4 + 1/8?", "Fractions"),
+    ("how do I find the area of a triangle", "Geometry Area Triangle"),
+    ("Solve 2x + 3 = 11", "Equations"),
+    ("please help me with long division", "Long Division"),
+    ("12 x 4", "Multiplication"),
+    ("", "Image Chat"),
+    (None, "Image Chat"),
+    ("?!", "?!"),
+])
+def test_local_title(text, title):
+    assert chat_title.local_title(text) == title
+
+
+def test_local_title_is_short():
+    title = chat_title.local_title("photosynthesis " * 40 + "chlorophyll mitochondria ribosome nucleus cytoplasm")
+    assert len(title) <= chat_title._MAX_LEN and len(title.split()) <= chat_title._MAX_WORDS
+
+
+@pytest.fixture
+def Session(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'titles.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autoflush=False, bind=engine)
+    monkeypatch.setattr(chat_title, "SessionLocal", factory)
+    monkeypatch.setattr(chat_title, "LLM_CHAT_TITLES", True)
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def llm_title(monkeypatch):
+    calls = []
+    reply = {"text": '"Adding Fractions"'}
+
+    def fake_title(text):
+        calls.append(text)
+        return reply["text"]
+
+    monkeypatch.setattr(llm, "get_chat_title", fake_title)
+    return reply, calls
+
+
+def make_chat(Session, title):
+    with Session() as db:
+        chat = Chat(title=title, session_id=title)
+        db.add(chat)
+        db.commit()
+        return chat.id
+
+
+def title_of(Session, chat_id):
+    with Session() as db:
+        return db.get(Chat, chat_id).title
+
+
+def test_refine_replaces_placeholder(Session, llm_title):
+    chat_id = make_chat(Session, "Fractions")
+    chat_title.refine_title(chat_id, "What is 3/4 + 1/8?", "Fractions")
+    assert title_of(Session, chat_id) == "Adding Fractions"
+
+
+def test_refine_keeps_a_title_changed_meanwhile(Session, llm_title):
+    chat_id = make_chat(Session, "Renamed by student")
+    chat_title.refine_title(chat_id, "What is 3/4 + 1/8?", "Fractions")
+    assert title_of(Session, chat_id) == "Renamed by student"
+
+
+def test_refine_ignores_llm_errors(Session, llm_title):
+    reply, _ = llm_title
+    reply["text"] = "Error: timed out"
+    chat_id = make_chat(Session, "Fractions")
+    chat_title.refine_title(chat_id, "What is 3/4 + 1/8?", "Fractions")
+    assert title_of(Session, chat_id) == "Fractions"
+
+
+def test_refine_disabled_makes_no_call(Session, llm_title, monkeypatch):
+    _, calls = llm_title
+    monkeypatch.setattr(chat_title, "LLM_CHAT_TITLES", False)
+    chat_id = make_chat(Session, "Fractions")
+    chat_title.refine_title(chat_id, "What is 3/4 + 1/8?", "Fractions")
+    chat_title.refine_title(chat_id, "", "Fractions")
+    assert calls == [] and title_of(Session, chat_id) == "Fractions"
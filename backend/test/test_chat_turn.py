@@ -0,0 +1,148 @@
+"""Saving a chat turn: one commit per turn, the retry that writes into the
+existing chat when a concurrent request created it first, and what
+`/chat/send?mode=delta` returns. Uses a temp SQLite file.
+
+    python -m pytest test/test_chat_turn.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import chat_summary  # noqa: E402
+import llm  # noqa: E402
+from database import Base  # noqa: E402
+from helper import get_db  # noqa: E402
+from models.models import Chat, Message, User  # noqa: E402
+from models.schemas import Message as MessageSchema  # noqa: E402
+from routers import chat as chat_router  # noqa: E402
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'turn.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autoflush=False, bind=engine)
+    with factory() as db:
+        db.add(User(username="kid", password="x"))
+        db.commit()
+    yield factory
+    engine.dispose()
+
+
+def count_commits(db):
+    commits = []
+    event.listen(db, "after_commit", lambda session: commits.append(1))
+    return commits
+
+
+def test_turn_is_saved_in_one_commit(Session):
+    db = Session()
+    commits = count_commits(db)
+    message = MessageSchema(text="What is 7 + 5? 12", sender="user", time_taken=90)
+    judge = {"final": True, "correct": True, "feedback": "ok"}
+
+    chat, user_msg, bot_msg, created = chat_router._save_turn(
+        db, "s1", None, message, 1, "Well done!", time_taken=90, judge=judge, is_final=True,
+    )
+    assert created and len(commits) == 1
+    assert (chat.last_message_id, user_msg.is_final, bot_msg.text) == (bot_msg.id, True, "Well done!")
+    db.close()
+
+    with Session() as check:
+        user = check.get(User, 1)
+        assert (user.total_time_taken, user.total_attempts, user.correct_attempts) == (1.5, 1, 1)
+        assert [(m.sender, m.chat_id) for m in check.query(Message).order_by(Message.id)] == [("user", 1), ("bot", 1)]
+
+
+def test_turn_in_existing_chat_is_one_commit(Session):
+    with Session() as db:
+        db.add(Chat(title="t", session_id="s1"))
+        db.commit()
+    db = Session()
+    commits = count_commits(db)
+    existing = db.query(Chat).filter_by(session_id="s1").one()
+    chat, _, _, created = chat_router._save_turn(db, "s1", existing, MessageSchema(text="hi", sender="user"), 1, "Hello!")
+    assert not created and chat.id == existing.id and len(commits) == 1
+    db.close()
+
+
+def test_concurrently_created_chat_is_reused(Session):
+    db = Session()
+    commits = count_commits(db)
+    # This request looked the session up before it existed...
+    chat = db.query(Chat).filter_by(session_id="s1").first()
+    assert chat is None
+    # ...and another request created the chat and saved its turn meanwhile
+    with Session() as other:
+        other.add(Chat(title="other", session_id="s1"))
+        other.flush()
+        other.add(Message(text="first", sender="user", chat_id=1, user_id=1))
+        other.commit()
+
+    chat, user_msg, bot_msg, created = chat_router._save_turn(
+        db, "s1", chat, MessageSchema(text="second", sender="user"), 1, "reply",
+    )
+    assert not created and chat.title == "other" and len(commits) == 1
+    db.close()
+
+    with Session() as check:
+        assert check.query(Chat).count() == 1
+        rows = check.query(Message.text, Message.chat_id).order_by(Message.id).all()
+        assert rows == [("first", 1), ("second", 1), ("reply", 1)]
+        assert check.get(Chat, 1).last_message_id == bot_msg.id
+
+
+@pytest.fixture
+def client(Session, monkeypatch):
+    async def fake_hint(**kwargs):
+        return f"hint for {kwargs['question']}"
+
+    monkeypatch.setattr(llm, "agenerate_hint", fake_hint)
+    monkeypatch.setattr(chat_summary, "refresh", lambda chat_id: None)
+    app = FastAPI()
+    app.include_router(chat_router.router)
+
+    def temp_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = temp_db
+    with TestClient(app) as c:
+        yield c
+
+
+def send_delta(client, text, session_id=None):
+    r = client.post("/chat/send/kid?mode=delta", json={"text": text, "sender": "user", "session_id": session_id})
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_delta_for_a_new_chat(client):
+    body = send_delta(client, "What is 3/4 + 1/8?")
+    assert [(m["sender"], m["text"]) for m in body["messages"]] == [
+        ("user", "What is 3/4 + 1/8?"), ("bot", "hint for What is 3/4 + 1/8?"),
+    ]
+    # Nothing older to page back to
+    assert body["before"] is None and body["after"] == body["messages"][-1]["id"]
+    assert body["session_id"] and body["title"]
+
+
+def test_delta_for_an_existing_chat(client):
+    first = send_delta(client, "What is 3/4 + 1/8?")
+    body = send_delta(client, "is it 7/8", first["session_id"])
+    # Only this turn comes back; `before` pages back into the earlier turn
+    assert [(m["sender"], m["text"]) for m in body["messages"]] == [("user", "is it 7/8"), ("bot", "hint for is it 7/8")]
+    assert body["id"] == first["id"]
+    assert body["before"] == body["messages"][0]["id"] and body["after"] == body["messages"][-1]["id"]
+    older = client.get(f"/chat/{body['id']}/messages", params={"before": body["before"]}).json()
+    assert [m["id"] for m in older["messages"]] == [m["id"] for m in first["messages"]]
@@ -0,0 +1,99 @@
+"""Token-budget packing of chat history: newest turns first, the newest one
+always kept, a summary placed first and capped at half the budget.
+
+    python -m pytest test/test_context_builder.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import context_builder  # noqa: E402
+from context_builder import estimate_tokens, fit_conversation, fit_text, pack  # noqa: E402
+from database import Base  # noqa: E402
+from models.models import Chat, Message  # noqa: E402
+
+# Each "User: turn N xx..." / "Bot: turn N xx..." line is 9 tokens, +1 per line
+TURNS = [("user" if i % 2 == 0 else "bot", f"turn {i} " + "x" * 22) for i in range(10)]
+
+
+def test_pack_keeps_newest_within_budget():
+    ctx = pack(TURNS, budget=35)
+    assert [text[:6] for _, text in ctx.turns] == ["turn 7", "turn 8", "turn 9"]
+    assert ctx.dropped == 7 and ctx.tokens <= 35
+    assert ctx.text.splitlines()[0].startswith("Bot: turn 7")
+    assert ctx.conversation[-1] == {"role": "assistant", "content": TURNS[9][1]}
+
+
+def test_pack_everything_fits():
+    ctx = pack(TURNS, budget=1000)
+    assert len(ctx.turns) == 10 and ctx.dropped == 0
+
+
+def test_pack_trims_an_oversized_newest_message():
+    ctx = pack(TURNS[:-1] + [("user", "y" * 400 + " end")], budget=20)
+    (sender, text), = ctx.turns
+    assert sender == "user" and text.startswith("…") and text.endswith(" end")
+    assert ctx.tokens <= 20 and ctx.dropped == 9
+
+
+def test_pack_skips_empty_and_accepts_rows():
+    rows = [Message(sender="user", text="3 + 4?"), Message(sender="bot", text=None), Message(sender="bot", text="7")]
+    assert pack(rows, budget=100).turns == [("user", "3 + 4?"), ("bot", "7")]
+
+
+def test_summary_goes_first_and_uses_at_most_half():
+    ctx = pack(TURNS, budget=40, summary="Student is adding fractions. " * 20)
+    lines = ctx.text.splitlines()
+    assert lines[0].startswith(context_builder._SUMMARY_LABEL + "…")
+    assert estimate_tokens(ctx.summary) <= 20
+    assert ctx.tokens <= 40 and len(ctx.turns) >= 1
+    assert ctx.conversation[0]["content"] == ctx.turns[0][1]  # the grader view has no summary
+
+
+def test_fit_text_drops_old_lines_first():
+    text = "\n".join(f"{s.capitalize()}: {t}" for s, t in TURNS)
+    assert fit_text(text, 1000) == text
+    fitted = fit_text(text, 25)
+    assert fitted.splitlines() == text.splitlines()[-2:]
+    one = fit_text("z" * 400, 10)
+    assert one.startswith("…") and estimate_tokens(one) <= 10
+    assert fit_text(None, 10) == ""
+
+
+def test_fit_conversation_keeps_newest_turns():
+    conversation = [{"role": "user", "content": t} for _, t in TURNS]
+    assert fit_conversation(conversation, 1000) == conversation
+    kept = fit_conversation(conversation, 30)
+    assert kept == conversation[-2:]
+    # An image part costs a flat amount
+    image_turn = {"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:..."}}]}
+    assert fit_conversation(conversation[:1] + [image_turn], 270) == [image_turn]
+    trimmed = fit_conversation([{"role": "user", "content": "q" * 400}], 20)
+    assert trimmed[0]["content"].startswith("…")
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'context.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(autoflush=False, bind=engine)()
+    session.add_all([Chat(title="a", session_id="a"), Chat(title="b", session_id="b")])
+    session.flush()
+    for i in range(6):
+        session.add(Message(text=f"a{i}", sender="user", chat_id=1))
+        session.add(Message(text=f"b{i}", sender="user", chat_id=2))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_fetch_recent_oldest_first(db):
+    assert [m.text for m in context_builder.fetch_recent(db, 1, limit=3)] == ["a3", "a4", "a5"]
+    after = context_builder.fetch_recent(db, 1, limit=10, after_id=7)  # ids 1..12 interleaved
+    assert [m.text for m in after] == ["a4", "a5"]
@@ -0,0 +1,107 @@
+"""Combined grade-and-hint completion: a valid reply is used as is; a
+truncated or invalid one falls back to the separate grade + hint calls. An
+overloaded upstream (429/503) is raised, never turned into a grade.
+
+    python -m pytest test/test_grade_and_hint.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import admission  # noqa: E402
+import llm  # noqa: E402
+import resilience  # noqa: E402
+
+# "why" keeps the local grader out of the way
+CONVERSATION = [
+    {"role": "assistant", "content": "Explain why 3/4 is bigger than 1/2."},
+    {"role": "user", "content": "because 3/4 is 6/8 and 1/2 is 4/8"},
+]
+VALID = (
+    '```json\n{"final": true, "correct": true, "feedback": "Well reasoned", '
+    '"correct_answer": 0.75, "hint": "Now try comparing 2/3 and 3/5."}\n```'
+)
+FALLBACK_JUDGE = {"final": True, "correct": False, "feedback": "from check_answer", "correct_answer": ""}
+FALLBACK_HINT = "hint from generate_hint"
+
+
+@pytest.fixture
+def combined(monkeypatch):
+    """Script the combined completion's reply and record fallback calls."""
+    state = {"reply": VALID, "fallback": 0}
+
+    async def fake_complete(messages, **kwargs):
+        return state["reply"]
+
+    async def fake_check(conversation, class_topics=None):
+        state["fallback"] += 1
+        return FALLBACK_JUDGE
+
+    async def fake_hint(**kwargs):
+        return FALLBACK_HINT
+
+    monkeypatch.setattr(llm, "_acomplete", fake_complete)
+    monkeypatch.setattr(llm, "acheck_answer", fake_check)
+    monkeypatch.setattr(llm, "agenerate_hint", fake_hint)
+    return state
+
+
+def run():
+    return asyncio.run(llm.agrade_and_hint(CONVERSATION, question=CONVERSATION[-1]["content"], user_class=5))
+
+
+def test_valid_reply_is_used(combined):
+    judge, hint = run()
+    assert judge == {"final": True, "correct": True, "feedback": "Well reasoned", "correct_answer": "0.75"}
+    assert hint == "Now try comparing 2/3 and 3/5."
+    assert combined["fallback"] == 0
+
+
+@pytest.mark.parametrize("cut", [
+    '"hint": "Now try compar',   # cut off mid-hint
+    '"hint": "Now try comparing 2/3 and 3/5."',  # object never closed
+])
+def test_truncated_reply_falls_back(combined, cut):
+    combined["reply"] = '{"final": true, "correct": true, "feedback": "ok", ' + cut
+    assert run() == (FALLBACK_JUDGE, FALLBACK_HINT)
+    assert combined["fallback"] == 1
+
+
+def test_truncated_verdict_falls_back(combined):
+    combined["reply"] = '{"final": true, "correct": fa'
+    assert run() == (FALLBACK_JUDGE, FALLBACK_HINT)
+
+
+@pytest.mark.parametrize("reply", [
+    '{"final": true, "correct": true, "feedback": "ok"}',  # no hint
+    '{"final": true, "correct": true, "hint": ""}',  # empty hint
+    '{"final": "true", "correct": 1, "hint": "Keep going."}',  # verdicts not booleans
+    "I think the student is right.",  # not JSON at all
+])
+def test_invalid_reply_falls_back(combined, reply):
+    combined["reply"] = reply
+    assert run() == (FALLBACK_JUDGE, FALLBACK_HINT)
+    assert combined["fallback"] == 1
+
+
+@pytest.mark.parametrize("error", [
+    admission.Overloaded(429, "Too many tutor requests at once, please wait", 2),
+    resilience.CircuitOpen(30),
+])
+def test_overload_is_not_turned_into_a_grade(monkeypatch, error):
+    async def rejected(messages, **kwargs):
+        raise error
+
+    async def fake_hint(**kwargs):
+        return FALLBACK_HINT
+
+    monkeypatch.setattr(llm, "_acomplete", rejected)
+    monkeypatch.setattr(llm, "agenerate_hint", fake_hint)
+    with pytest.raises(type(error)):
+        asyncio.run(llm.acheck_answer(conversation=CONVERSATION))
+    with pytest.raises(type(error)):
+        run()
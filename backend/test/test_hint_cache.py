@@ -0,0 +1,63 @@
+"""Hint cache hits: last_used_at is written at most once per touch interval,
+with the hits in between added on that write, against a temp SQLite file.
+
+    python -m pytest test/test_hint_cache.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import hint_cache  # noqa: E402
+from database import Base  # noqa: E402
+from models.models import HintCache  # noqa: E402
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(hint_cache, "SessionLocal", sessionmaker(autoflush=False, bind=engine))
+    monkeypatch.setattr(hint_cache, "_pending_hits", {})
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(hint_cache.time, "time", lambda: now[0])
+    return now
+
+
+def row(engine, key):
+    with sessionmaker(bind=engine)() as db:
+        r = db.get(HintCache, key)
+        return r.last_used_at, r.hits
+
+
+def test_hits_touch_row_once_per_interval(engine, clock):
+    hint_cache.put("k", 5, "2+2", "Count on your fingers.")
+    writes = []
+    event.listen(engine, "before_cursor_execute", lambda *a: writes.append(a[2]) if a[2].startswith("UPDATE") else None)
+
+    for _ in range(3):
+        assert hint_cache.get("k") == "Count on your fingers."
+    assert writes == [] and row(engine, "k") == (clock[0], 0)
+
+    clock[0] += hint_cache._TOUCH_EVERY_SECONDS
+    assert hint_cache.get("k") == "Count on your fingers."
+    assert len(writes) == 1 and row(engine, "k") == (clock[0], 4)
+
+
+def test_put_resets_pending_hits(engine, clock):
+    hint_cache.put("k", 5, "2+2", "old")
+    hint_cache.get("k")
+    hint_cache.put("k", 5, "2+2", "new")
+    clock[0] += hint_cache._TOUCH_EVERY_SECONDS
+    assert hint_cache.get("k") == "new"
+    assert row(engine, "k") == (clock[0], 1)
@@ -0,0 +1,84 @@
+"""image_prep: downscaling, orientation, passthrough and reuse of uploaded
+images, and rejection of decompression bombs.
+
+    python -m pytest test/test_image_prep.py
+"""
+import base64
+import io
+import random
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import image_prep  # noqa: E402
+
+
+def _b64(img: Image.Image, fmt: str = "PNG", **save) -> str:
+    out = io.BytesIO()
+    img.save(out, fmt, **save)
+    return base64.b64encode(out.getvalue()).decode("ascii")
+
+
+def _decode(prepared: image_prep.PreparedImage) -> Image.Image:
+    return Image.open(io.BytesIO(base64.b64decode(prepared.b64)))
+
+
+def _photo(width: int, height: int) -> Image.Image:
+    # Noisy colour image so PNG can't compress it away, like a camera photo
+    return Image.frombytes("RGB", (width, height), random.Random(width).randbytes(width * height * 3))
+
+
+def test_large_photo_is_downscaled_to_grayscale_jpeg():
+    src = _b64(_photo(3000, 2000))
+    prepared = image_prep.prepare(src)
+    img = _decode(prepared)
+    assert prepared.mime == "image/jpeg"
+    assert prepared.data_url.startswith("data:image/jpeg;base64,")
+    assert (prepared.width, prepared.height) == img.size
+    assert img.size == (1024, 683)
+    assert img.mode == "L"
+    assert len(prepared.b64) < len(src) / 10
+
+
+def test_exif_orientation_is_applied():
+    img = _photo(1600, 800)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90° clockwise on display
+    prepared = image_prep.prepare(_b64(img, "JPEG", exif=exif.tobytes()))
+    assert prepared.height > prepared.width
+
+
+def test_data_url_and_identical_images_are_reused():
+    src = _b64(_photo(1500, 1500))
+    before = image_prep.stats()["reused"]
+    first = image_prep.prepare("data:image/png;base64," + src)
+    second = image_prep.prepare(src)
+    assert second is first
+    assert image_prep.stats()["reused"] == before + 1
+
+
+def test_small_image_keeps_original_bytes():
+    src = _b64(Image.new("L", (40, 20), 255))
+    prepared = image_prep.prepare(src)
+    assert prepared.b64 == src
+    assert prepared.mime == "image/png"
+
+
+def test_undecodable_image_is_passed_through():
+    src = base64.b64encode(b"not an image at all").decode("ascii")
+    prepared = image_prep.prepare(src)
+    assert prepared.b64 == src
+    assert prepared.mime == "image/png"
+
+
+def test_decompression_bomb_is_rejected(monkeypatch):
+    src = _b64(Image.new("L", (100, 100), 255))
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(image_prep.ImageTooLarge) as exc:
+        image_prep.prepare(src)
+    assert exc.value.status_code == 413
+    assert image_prep.stats()["rejected"] >= 1
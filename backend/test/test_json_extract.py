@@ -0,0 +1,109 @@
+"""Fuzz and benchmark suite for json_extract, built from recorded grader outputs.
+
+`data/grader_raw_outputs.jsonl` holds raw `check_answer` replies (fenced,
+prose-wrapped, single-quoted, truncated, ...) with the dict we expect back.
+
+    python -m pytest test/test_json_extract.py      # corpus + fuzz
+    python test/test_json_extract.py                # benchmark
+"""
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from json_extract import extract_json_object  # noqa: E402
+
+CORPUS_PATH = Path(__file__).resolve().parent / "data" / "grader_raw_outputs.jsonl"
+CORPUS = [json.loads(line) for line in CORPUS_PATH.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+PREFIXES = ["", "Sure! ", "Here is the JSON:\n", "```json\n", "```\n", "Result -> ", "  \n"]
+SUFFIXES = ["", "\n```", "\nHope this helps.", " Let me know!", "\n\n", "```"]
+
+
+def test_corpus():
+    for case in CORPUS:
+        assert extract_json_object(case["raw"]) == case["expected"], case["raw"]
+
+
+def _mutations(raw, rng):
+    """Wrapper/format mutations that must not change the extracted object."""
+    # Truncated outputs end the reply, so they only get a prefix
+    suffix = rng.choice(SUFFIXES) if raw.rstrip().endswith("}") else ""
+    yield rng.choice(PREFIXES) + raw + suffix
+    # Re-indent / squeeze only the separators between fields, never string contents
+    yield re.sub(r",\s*(?=[\"'“]?\w+[\"'”]?\s*:)", ",\n    ", raw).replace("{", "{\n  ", 1)
+    yield re.sub(r"([\"'”])\s*:\s*", r"\1:", raw)
+    if raw.rstrip().endswith("}"):
+        body = raw.rstrip()[:-1].rstrip()
+        yield body + ",}"  # trailing comma
+        yield body + "\n}\n" + "{\"final\": false}"  # a second object must be ignored
+
+
+def test_fuzz_wrappers_and_whitespace():
+    rng = random.Random(1234)
+    for _ in range(25):
+        for case in CORPUS:
+            if case["expected"] is None or not case["raw"].lstrip().startswith("{"):
+                continue
+            for mutated in _mutations(case["raw"], rng):
+                assert extract_json_object(mutated) == case["expected"], mutated
+
+
+def test_fuzz_never_raises():
+    rng = random.Random(99)
+    alphabet = '{}[]"\':,\\/ \n\ttruefalsenull0123456789.-abc`*'
+    for _ in range(3000):
+        noise = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+        result = extract_json_object(noise)
+        assert result is None or type(result) is dict
+
+
+def test_truncation_keeps_leading_fields():
+    raw = '{"final": true, "correct": false, "feedback": "Close, but 3/4 + 1/8 is 7/8", "correct_answer": "7/8"}'
+    for cut in range(len('{"final": true,'), len(raw)):
+        result = extract_json_object(raw[:cut])
+        assert result is not None and result["final"] is True, raw[:cut]
+        # A value cut off inside `false` is dropped or null, never a truthy string
+        assert result.get("correct") in (False, None), raw[:cut]
+
+
+def test_truncated_literals_are_dropped():
+    assert extract_json_object('{"final": true, "correct": fa') == {"final": True}
+    assert extract_json_object('{"final": tr') == {}
+    assert extract_json_object("{final: true, correct: fals") == {"final": True}
+    assert extract_json_object('{"steps": [1, tr') == {"steps": [1]}
+    # Complete literals and ordinary bare words still come through
+    assert extract_json_object('{"final": true, "correct": false') == {"final": True, "correct": False}
+    assert extract_json_object('{"correct_answer": seven}') == {"correct_answer": "seven"}
+
+
+def test_judge_output_requires_boolean_verdicts():
+    import llm
+
+    for raw in ['{"final": true, "correct": fa', '{"final": tr', '{"final": true,',
+                '{"final": "yes", "correct": true}', '{"final": true, "correct": null}']:
+        verdict = llm._parse_judge_output(raw)
+        assert verdict["final"] is False and verdict["raw"] == raw, raw
+    verdict = llm._parse_judge_output('{"final": true, "correct": false, "feedback": "Close"')
+    assert (verdict["final"], verdict["correct"], verdict["feedback"]) == (True, False, "Close")
+
+
+def benchmark(rounds=2000):
+    raws = [case["raw"] for case in CORPUS]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for raw in raws:
+            extract_json_object(raw)
+    elapsed = time.perf_counter() - start
+    calls = rounds * len(raws)
+    recovered = sum(1 for case in CORPUS if extract_json_object(case["raw"]) is not None)
+    print(f"{calls} extractions in {elapsed:.3f}s -> {elapsed / calls * 1e6:.1f} µs/call")
+    print(f"recovered {recovered}/{len(raws)} corpus outputs")
+
+
+if __name__ == "__main__":
+    benchmark()
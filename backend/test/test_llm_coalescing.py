@@ -0,0 +1,133 @@
+"""Single-flight coalescing of identical in-flight completions, against the
+local fake completion server.
+
+    python -m pytest test/test_llm_coalescing.py
+"""
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import llm  # noqa: E402
+from fake_llm_server import FakeLLMServer  # noqa: E402
+
+PRIMARY, BACKUP = "openai/primary", "openai/backup"
+MESSAGES = [{"role": "user", "content": "What is 3/4 + 1/8?"}]
+N = 8
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = FakeLLMServer().start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture(autouse=True)
+def llm_env(server, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(llm, "MODEL_NAME", PRIMARY)
+    monkeypatch.setattr(llm, "FALLBACK_MODELS", [BACKUP])
+    monkeypatch.setattr(llm, "LLM_API_BASE", server.base_url)
+    monkeypatch.setattr(llm, "_breakers", {})
+    monkeypatch.setattr(llm, "_latency", {})
+    monkeypatch.setattr(llm, "_coalesce_counters", dict.fromkeys(llm._coalesce_counters, 0))
+    server.reset()
+    server.set("primary", reply="7/8 it is", delay=0.2)
+    server.set("backup", reply="backup says 7/8", delay=0.2)
+    yield server
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await llm.aclose_clients()
+    return asyncio.run(main())
+
+
+def test_identical_async_requests_share_one_call(server):
+    async def burst():
+        return await asyncio.gather(*(llm._acomplete(MESSAGES) for _ in range(N)))
+
+    assert run(burst()) == ["7/8 it is"] * N
+    assert server.hits == {"primary": 1}
+    stats = llm.coalescing_stats()
+    assert (stats["upstream_calls"], stats["coalesced_calls"], stats["in_flight"]) == (1, N - 1, 0)
+
+
+def test_different_requests_are_not_coalesced(server):
+    async def burst():
+        other = [{"role": "user", "content": "What is 1/2 + 1/4?"}]
+        return await asyncio.gather(llm._acomplete(MESSAGES), llm._acomplete(other), llm._acomplete(MESSAGES, max_tokens=5))
+
+    run(burst())
+    assert server.hits == {"primary": 3}
+    assert llm.coalescing_stats()["coalesced_calls"] == 0
+
+
+def test_every_async_waiter_gets_the_same_error(server):
+    server.set("primary", status=500, delay=0.2)
+    server.set("backup", status=500)
+
+    async def burst():
+        return await asyncio.gather(*(llm._acomplete(MESSAGES) for _ in range(N)), return_exceptions=True)
+
+    errors = run(burst())
+    assert isinstance(errors[0], Exception)
+    assert all(e is errors[0] for e in errors)
+    assert server.hits == {"primary": 1, "backup": 1}
+    assert llm.coalescing_stats()["in_flight"] == 0
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call(server):
+    async def scenario():
+        leader = asyncio.create_task(llm._acomplete(MESSAGES))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(llm._acomplete(MESSAGES))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        result = await follower
+        return leader.cancelled(), result
+
+    cancelled, result = run(scenario())
+    assert cancelled and result == "7/8 it is"
+    assert server.hits == {"primary": 1}
+    assert llm.coalescing_stats()["upstream_calls"] == 1
+
+
+def test_identical_sync_requests_share_one_call(server):
+    results, errors = [], []
+    barrier = threading.Barrier(N)
+
+    def call():
+        barrier.wait()
+        try:
+            results.append(llm._complete(MESSAGES))
+        except Exception as e:
+            errors.append(e)
+
+    def burst():
+        threads = [threading.Thread(target=call) for _ in range(N)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    burst()
+    assert results == ["7/8 it is"] * N and server.hits == {"primary": 1}
+    stats = llm.coalescing_stats()
+    assert (stats["upstream_calls"], stats["coalesced_calls"]) == (1, N - 1)
+
+    server.set("primary", status=500, delay=0.2)
+    server.set("backup", status=500)
+    results.clear()
+    burst()
+    assert results == [] and len(errors) == N
+    assert all(e is errors[0] for e in errors)
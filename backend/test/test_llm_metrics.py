@@ -0,0 +1,74 @@
+"""`instrument` keeps each call's record in the context variable only while
+the wrapped function runs, including async generators, and aggregates it.
+
+    python -m pytest test/test_llm_metrics.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import llm_metrics  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_buckets(monkeypatch):
+    monkeypatch.setattr(llm_metrics, "_by_endpoint", llm_metrics.defaultdict(llm_metrics._new_bucket))
+    monkeypatch.setattr(llm_metrics, "_by_model", llm_metrics.defaultdict(llm_metrics._new_bucket))
+
+
+def bucket(op):
+    return llm_metrics._by_endpoint[(op, "-")]
+
+
+@llm_metrics.instrument("stream_test")
+async def stream(n, fail=False):
+    for i in range(n):
+        llm_metrics.note_cache("hint_cache")  # only reaches this call's record
+        yield i
+    if fail:
+        raise RuntimeError("upstream broke")
+
+
+def test_stream_record_does_not_leak_into_caller():
+    async def consume():
+        seen = []
+        async for _ in stream(3):
+            seen.append(llm_metrics.current())
+        return seen, llm_metrics.current()
+
+    seen, after = asyncio.run(consume())
+    assert seen == [None, None, None] and after is None
+    b = bucket("stream_test")
+    assert (b["calls"], b["cache_hits"], b["errors"], b["ttft_count"]) == (1, 1, 0, 1)
+
+
+def test_stream_error_and_early_close_are_recorded():
+    async def consume():
+        with pytest.raises(RuntimeError):
+            async for _ in stream(1, fail=True):
+                pass
+        gen = stream(5)
+        await gen.__anext__()
+        await gen.aclose()  # e.g. the client disconnected
+        return llm_metrics.current()
+
+    assert asyncio.run(consume()) is None
+    assert dict(bucket("stream_test")["outcomes"]) == {"error": 1, "cancelled": 1}
+
+
+def test_coroutine_record_is_reset():
+    @llm_metrics.instrument("coro_test")
+    async def call():
+        return llm_metrics.current()
+
+    async def run():
+        rec = await call()
+        return rec, llm_metrics.current()
+
+    rec, after = asyncio.run(run())
+    assert rec.op == "coro_test" and after is None
+    assert bucket("coro_test")["calls"] == 1
@@ -0,0 +1,139 @@
+"""Offline tests for the LLM resilience layer (deadlines, circuit breaker,
+hedging, fallback models) against the local fake completion server.
+
+    python -m pytest test/test_llm_resilience.py
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import llm  # noqa: E402
+import resilience  # noqa: E402
+from fake_llm_server import FakeLLMServer  # noqa: E402
+
+PRIMARY, BACKUP = "openai/primary", "openai/backup"
+MESSAGES = [{"role": "user", "content": "What is 3 + 4?"}]
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = FakeLLMServer().start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture(autouse=True)
+def llm_env(server, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(llm, "MODEL_NAME", PRIMARY)
+    monkeypatch.setattr(llm, "FALLBACK_MODELS", [BACKUP])
+    monkeypatch.setattr(llm, "LLM_API_BASE", server.base_url)
+    monkeypatch.setattr(llm, "_breakers", {})
+    monkeypatch.setattr(llm, "_latency", {})
+    monkeypatch.setattr(llm, "_resilience_counters", dict.fromkeys(llm._resilience_counters, 0))
+    server.reset()
+    server.set("primary", reply="primary says hi")
+    server.set("backup", reply="backup says hi")
+    yield server
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await llm.aclose_clients()
+    return asyncio.run(main())
+
+
+def test_primary_serves_when_healthy(server):
+    assert run(llm._acomplete_upstream(MESSAGES)) == "primary says hi"
+    assert llm._complete_upstream(MESSAGES) == "primary says hi"
+    assert server.hits == {"primary": 2}
+
+
+def test_falls_back_when_primary_fails(server):
+    server.set("primary", status=500)
+    assert run(llm._acomplete_upstream(MESSAGES)) == "backup says hi"
+    assert llm._complete_upstream(MESSAGES) == "backup says hi"
+    assert server.hits == {"primary": 2, "backup": 2}  # no SDK retries
+    assert llm.resilience_stats()["fallback_calls"] == 2
+
+
+def test_breaker_opens_after_consecutive_failures(server):
+    llm._breakers[PRIMARY] = resilience.CircuitBreaker(PRIMARY, failures=2, reset_seconds=60)
+    server.set("primary", status=503)
+    for _ in range(5):
+        assert run(llm._acomplete_upstream(MESSAGES)) == "backup says hi"
+    assert server.hits["primary"] == 2
+    assert llm._breakers[PRIMARY].state == "open"
+
+
+def test_slow_calls_trip_breaker(server):
+    llm._breakers[PRIMARY] = resilience.CircuitBreaker(PRIMARY, failures=2, slow_seconds=0.05, reset_seconds=60)
+    server.set("primary", reply="primary says hi", delay=0.1)
+    assert run(llm._acomplete_upstream(MESSAGES)) == "primary says hi"
+    assert run(llm._acomplete_upstream(MESSAGES)) == "primary says hi"
+    assert llm._breakers[PRIMARY].state == "open"
+    assert run(llm._acomplete_upstream(MESSAGES)) == "backup says hi"
+
+
+def test_half_open_probe_closes_breaker(server):
+    llm._breakers[PRIMARY] = resilience.CircuitBreaker(PRIMARY, failures=1, reset_seconds=0.2)
+    server.set("primary", status=500)
+    assert run(llm._acomplete_upstream(MESSAGES)) == "backup says hi"
+    assert llm._breakers[PRIMARY].state == "open"
+    server.set("primary", reply="primary is back")
+    time.sleep(0.25)
+    assert run(llm._acomplete_upstream(MESSAGES)) == "primary is back"
+    assert llm._breakers[PRIMARY].state == "closed"
+
+
+def test_all_circuits_open_fails_fast(server):
+    for model in (PRIMARY, BACKUP):
+        llm._breakers[model] = resilience.CircuitBreaker(model, failures=1, reset_seconds=30)
+        llm._breakers[model].record_failure()
+    with pytest.raises(resilience.CircuitOpen) as exc:
+        run(llm._acomplete_upstream(MESSAGES))
+    assert exc.value.status_code == 503
+    assert int(exc.value.headers["Retry-After"]) >= 1
+    assert not server.hits
+
+
+def test_deadline_bounds_the_whole_call(server):
+    server.set("primary", delay=1.0)
+    server.set("backup", delay=1.0)
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        run(llm._acomplete_upstream(MESSAGES, deadline=0.3))
+    assert time.perf_counter() - started < 0.9
+    assert llm.resilience_stats()["deadline_exceeded"] == 1
+
+
+def test_hedges_after_p95(server, monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(resilience, "LLM_HEDGE_MIN_SAMPLES", 5)
+    for _ in range(10):
+        llm._tracker(PRIMARY).add(0.05)
+    # The first request stalls; the hedged copy answers at once
+    server.script("primary", {"delay": 1.5, "reply": "stalled"}, {"delay": 0.0, "reply": "hedged"})
+    started = time.perf_counter()
+    assert run(llm._acomplete_upstream(MESSAGES)) == "hedged"
+    assert time.perf_counter() - started < 1.0
+    assert server.hits["primary"] == 2
+    assert llm.resilience_stats()["hedged_calls"] == 1
+
+
+def test_stream_falls_back_before_first_token(server):
+    server.set("primary", status=500)
+
+    async def collect():
+        return [delta async for delta in llm._astream(MESSAGES)]
+
+    assert "".join(run(collect())) == "backup says hi"
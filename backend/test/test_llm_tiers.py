@@ -0,0 +1,97 @@
+"""Cheap-model-first hint tiers: routing, escalation and per-tier stats,
+against the local fake completion server.
+
+    python -m pytest test/test_llm_tiers.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import llm  # noqa: E402
+import llm_metrics  # noqa: E402
+from fake_llm_server import FakeLLMServer  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = FakeLLMServer().start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture(autouse=True)
+def llm_env(server, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(llm, "MODEL_NAME", "openai/strong")
+    monkeypatch.setattr(llm, "FALLBACK_MODELS", [])
+    monkeypatch.setattr(llm, "LLM_CHEAP_MODEL", "openai/cheap")
+    monkeypatch.setattr(llm, "LLM_STRONG_MODEL", None)
+    monkeypatch.setattr(llm, "LLM_API_BASE", server.base_url)
+    monkeypatch.setattr(llm, "_breakers", {})
+    monkeypatch.setattr(llm, "_latency", {})
+    monkeypatch.setattr(llm_metrics, "_by_tier", llm_metrics.defaultdict(llm_metrics._new_tier_bucket))
+    server.reset()
+    server.set("cheap", reply="Count on from 7: 8, 9, 10.")
+    server.set("strong", reply="Think of 7 + 3 as making a ten first.")
+    yield server
+
+
+def hint(question, **kwargs):
+    return llm.generate_hint(question, user_class=kwargs.pop("user_class", 2), use_cache=False, **kwargs)
+
+
+def test_choose_tier():
+    assert llm.choose_tier("7 + 3", 2) == "cheap"
+    assert llm.choose_tier("7 + 3", 9) == "strong"
+    assert llm.choose_tier("7 + 3", 2, has_image=True) == "strong"
+    assert llm.choose_tier("7 + 3 " * 100, 2) == "strong"
+    assert llm.choose_tier("7 + 3", 2, repeat=True) == "strong"
+
+
+def test_tiering_off_without_cheap_model(monkeypatch, server):
+    monkeypatch.setattr(llm, "LLM_CHEAP_MODEL", None)
+    assert llm.choose_tier("7 + 3", 2) is None
+    assert hint("what is 7 + 3") == "Think of 7 + 3 as making a ten first."
+    assert server.hits == {"strong": 1}
+
+
+def test_easy_hint_uses_cheap_model(server):
+    assert hint("what is 7 + 3") == "Count on from 7: 8, 9, 10."
+    assert server.hits == {"cheap": 1}
+    tiers = llm_metrics.stats()["by_tier"]
+    assert tiers["cheap"]["upstream_calls"] == 1 and "strong" not in tiers
+
+
+def test_low_confidence_escalates(server):
+    server.script("cheap", {"reply": "I'm not sure what you mean."})
+    assert hint("what is 7 + 3") == "Think of 7 + 3 as making a ten first."
+    assert server.hits == {"cheap": 1, "strong": 1}
+    assert llm_metrics.stats()["by_tier"]["cheap"]["escalations"] == {"low_confidence": 1}
+
+
+def test_asking_again_goes_to_strong_model(server):
+    context = "User: what is 7 + 3\nBot: Count on from 7.\nUser: what is 7 + 3"
+    assert hint("what is 7 + 3", last_context=context) == "Think of 7 + 3 as making a ten first."
+    assert hint("I still don't understand") == "Think of 7 + 3 as making a ten first."
+    # The current message alone (last line of the context) is not a repeat
+    assert hint("what is 7 + 3", last_context="User: what is 7 + 3") == "Count on from 7: 8, 9, 10."
+    assert server.hits == {"strong": 2, "cheap": 1}
+    assert llm_metrics.stats()["by_tier"]["cheap"]["escalations"] == {"repeat": 2}
+
+
+def test_cheap_model_falls_back_to_strong(server):
+    server.set("cheap", status=500)
+    assert asyncio.run(_ahint("what is 7 + 3")) == "Think of 7 + 3 as making a ten first."
+    assert server.hits == {"cheap": 1, "strong": 1}
+
+
+async def _ahint(question):
+    try:
+        return await llm.agenerate_hint(question, user_class=2, use_cache=False)
+    finally:
+        await llm.aclose_clients()
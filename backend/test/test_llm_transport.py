@@ -0,0 +1,102 @@
+"""Record/replay transport: record calls against the fake completion server,
+then replay them with the server stopped.
+
+    python -m pytest test/test_llm_transport.py
+"""
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import llm  # noqa: E402
+import llm_transport  # noqa: E402
+from fake_llm_server import FakeLLMServer  # noqa: E402
+
+MODEL = "openai/primary"
+HINT = [{"role": "user", "content": "What is 3 + 4?"}]
+JUDGE = [{"role": "user", "content": "Is 7 correct?"}]
+
+
+@pytest.fixture(autouse=True)
+def llm_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(llm, "MODEL_NAME", MODEL)
+    monkeypatch.setattr(llm, "FALLBACK_MODELS", [])
+    monkeypatch.setattr(llm, "_breakers", {})
+    monkeypatch.setattr(llm, "_latency", {})
+    monkeypatch.setattr(llm_transport, "LLM_CASSETTE", str(tmp_path / "cassette.jsonl"))
+    monkeypatch.setattr(llm_transport, "LLM_REPLAY_LATENCY_MS", "recorded")
+    yield
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await llm.aclose_clients()
+    return asyncio.run(main())
+
+
+async def _stream(messages):
+    return "".join([d async for d in llm._astream(messages)])
+
+
+def _record(monkeypatch):
+    server = FakeLLMServer().start()
+    try:
+        monkeypatch.setattr(llm, "LLM_API_BASE", server.base_url)
+        monkeypatch.setattr(llm_transport, "LLM_TRANSPORT", "record")
+        server.set("primary", reply="Add the ones first", delay=0.2)
+        assert llm._complete_upstream(HINT) == "Add the ones first"
+        assert run(_stream(HINT)) == "Add the ones first"
+        server.script("primary", {"reply": '{"correct": true}'}, {"reply": '{"correct": false}'})
+        assert run(llm._acomplete_upstream(JUDGE, temperature=0.0)) == '{"correct": true}'
+        assert run(llm._acomplete_upstream(JUDGE, temperature=0.0)) == '{"correct": false}'
+    finally:
+        server.stop()
+    monkeypatch.setattr(llm, "LLM_API_BASE", "http://127.0.0.1:9/v1")  # nothing listens here
+    monkeypatch.setattr(llm_transport, "LLM_TRANSPORT", "replay")
+
+
+def test_record_writes_cassette(monkeypatch):
+    _record(monkeypatch)
+    entries = [json.loads(line) for line in Path(llm_transport.LLM_CASSETTE).read_text().splitlines()]
+    assert [e["reply"] for e in entries] == ["Add the ones first", "Add the ones first", '{"correct": true}', '{"correct": false}']
+    assert entries[0]["key"] == entries[1]["key"]  # streamed or not, same request
+    assert entries[0]["latency_ms"] >= 200 and entries[1]["ttft_ms"] >= 200
+    assert entries[2]["request"]["params"] == {"temperature": 0.0}
+
+
+def test_replay_is_offline_and_deterministic(monkeypatch):
+    _record(monkeypatch)
+    monkeypatch.setattr(llm_transport, "_cassette", None)  # fresh process: load from disk
+    assert llm._complete_upstream(HINT) == "Add the ones first"
+    assert run(_stream(HINT)) == "Add the ones first"
+    # Repeated requests replay the recorded replies in order, then cycle
+    replies = [run(llm._acomplete_upstream(JUDGE, temperature=0.0)) for _ in range(3)]
+    assert replies == ['{"correct": true}', '{"correct": false}', '{"correct": true}']
+    assert llm_transport.stats()["misses"] == 0
+
+
+def test_replay_latency(monkeypatch):
+    _record(monkeypatch)
+    started = time.perf_counter()
+    llm._complete_upstream(HINT)
+    assert time.perf_counter() - started >= 0.2  # recorded latency
+    monkeypatch.setattr(llm_transport, "LLM_REPLAY_LATENCY_MS", "0")
+    started = time.perf_counter()
+    llm._complete_upstream(HINT)
+    assert time.perf_counter() - started < 0.1
+
+
+def test_replay_miss_fails(monkeypatch):
+    _record(monkeypatch)
+    with pytest.raises(llm_transport.CassetteMiss):
+        llm._complete_upstream([{"role": "user", "content": "never recorded"}])
@@ -0,0 +1,108 @@
+"""Local grading of simple numeric answers: happy paths, and word questions
+and tutor sub-steps that must fall back to the LLM grader instead of being
+misgraded.
+
+    python -m pytest test/test_local_grader.py
+"""
+import sys
+from fractions import Fraction
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import local_grader  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(local_grader, "LOCAL_GRADER_ENABLED", True)
+
+
+def grade(question, answer, asked=None):
+    """The student asks `asked` (default: the same question), the bot asks `question`."""
+    return local_grader.grade([
+        {"role": "user", "content": question if asked is None else asked},
+        {"role": "assistant", "content": question},
+        {"role": "user", "content": answer},
+    ])
+
+
+@pytest.mark.parametrize("question, answer, correct, shown", [
+    ("What is 7 + 5?", "12", True, "12"),
+    ("What is 7 + 5?", "13", False, "12"),
+    ("Great job! Now, what is 3/4 + 1/8?", "7/8", True, "7/8"),
+    ("Calculate 12 × 3.", "the answer is 36", True, "36"),
+    ("Solve 2x + 3 = 11.", "x = 4", True, "x = 4"),
+    ("Solve for x: 2x + 3 = 11", "5", False, "x = 4"),
+    ("What is 1.5 + 2.25?", "3.75", True, "3.75"),
+])
+def test_happy_paths(question, answer, correct, shown):
+    verdict = grade(question, answer)
+    assert verdict["final"] is True
+    assert verdict["correct"] is correct
+    assert verdict["correct_answer"] == shown
+
+
+@pytest.mark.parametrize("question, answer", [
+    ("What is 2/3 of 12?", "8"),
+    ("3/4 of 100", "75"),
+    ("Find 1/5 of 25", "5"),
+    ("What is the reciprocal of 3/4?", "4/3"),
+    ("What is the square of 2+1?", "9"),
+    ("double 3+4", "14"),
+    ("If x = 3, what is 2x + 1?", "7"),
+    ("What is half of 10 + 4?", "9"),
+    ("Can you round 3.14159 to 2 decimals?", "3.14"),
+])
+def test_word_questions_fall_back_to_llm(question, answer):
+    assert grade(question, answer) is None
+
+
+def test_tutor_sub_steps_fall_back_to_llm():
+    # A scaffolding step is not the student's final answer
+    assert grade("Good start! First, what is 4 x 2?", "8", asked="What is 4 x 2 + 3?") is None
+    assert grade("What is 3/4 + 1/8?", "7/8", asked="can you help me with 2/3 + 1/6") is None
+    # Back at the original problem: graded locally
+    verdict = grade("Now, what is 4 × 2 + 3?", "11", asked="what is 4 x 2 + 3")
+    assert verdict["final"] is True and verdict["correct"] is True
+
+
+def test_needs_the_students_question():
+    conversation = [
+        {"role": "user", "content": "What is 6 + 6?"},
+        {"role": "assistant", "content": "What is 6 + 6?"},
+        {"role": "user", "content": "x = 12"},  # an answer, not a new problem
+        {"role": "assistant", "content": "Try again: what is 6 + 6?"},
+        {"role": "user", "content": "12"},
+    ]
+    assert local_grader.grade(conversation)["correct"] is True
+    assert local_grader.grade(conversation[1:2] + conversation[-1:]) is None
+    assert local_grader.student_problem("x = 4") is None
+    assert local_grader.student_problem("help me solve 2x + 3 = 11 please") == "2x + 3 = 11"
+
+
+def test_words_touching_the_expression():
+    # Not in the skip list, but still changes what is asked
+    assert local_grader.extract_problem("What is 3 + 4 minus nothing?") is None
+    assert local_grader.extract_problem("What does 3 + 4 equal?") is None
+    assert local_grader.extract_problem("What is 3 + 4?") == "3 + 4"
+
+
+def test_not_an_answer():
+    assert grade("What is 7 + 5?", "I don't know") is None
+    assert grade("What is 7 + 5?", "is it 12?") is None
+    # Unreduced fractions may be marked down for form
+    assert grade("What is 1/4 + 1/4?", "2/4") is None
+
+
+def test_parse_student_answer():
+    assert local_grader.parse_student_answer("So the answer is 1,000.") == Fraction(1000)
+    assert local_grader.parse_student_answer("x = -3", "x") == Fraction(-3)
+    assert local_grader.parse_student_answer("5/0") is None
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(local_grader, "LOCAL_GRADER_ENABLED", False)
+    assert grade("What is 7 + 5?", "12") is None
@@ -0,0 +1,107 @@
+"""Keyset pagination of chats (by last activity) and messages, against a
+throwaway SQLite file.
+
+    python -m pytest test/test_pagination.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pagination  # noqa: E402
+from database import Base  # noqa: E402
+from models.models import Chat, Message, User  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(autoflush=False, bind=engine)()
+    kid, other = User(username="kid", password="x"), User(username="other", password="x")
+    session.add_all([kid, other])
+    session.flush()
+    # Chats 1..5, each with 3 turns (user + bot), written round-robin so
+    # activity order differs from creation order; chat 5 belongs to "other"
+    chats = [Chat(title=f"chat {i}", session_id=f"s{i}") for i in range(1, 6)]
+    session.add_all(chats)
+    session.flush()
+    for turn in range(3):
+        for chat in (chats if turn < 2 else [chats[2], chats[0], chats[4], chats[1], chats[3]]):
+            owner = other if chat is chats[4] else kid
+            session.add(Message(text=f"{chat.title} q{turn} " + "x" * 300, sender="user", chat_id=chat.id, user_id=owner.id))
+            bot = Message(text=f"{chat.title} a{turn}", sender="bot", chat_id=chat.id, image="/blobs/ab/ab.png" if turn == 2 else None)
+            session.add(bot)
+            session.flush()
+            chat.last_message_id = bot.id
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def titles(page):
+    return [c.title for c in page.chats]
+
+
+def test_chats_by_last_activity(db):
+    kid = db.query(User).filter_by(username="kid").one()
+    page = pagination.chat_page(db, kid.id, limit=2)
+    assert titles(page) == ["chat 4", "chat 2"]
+    page2 = pagination.chat_page(db, kid.id, limit=2, before=page.before)
+    assert titles(page2) == ["chat 1", "chat 3"]
+    assert page2.before is None  # no older chats
+    assert titles(pagination.chat_page(db, None, limit=10)) == ["chat 4", "chat 2", "chat 5", "chat 1", "chat 3"]
+
+
+def test_chat_list_mode_has_previews_only(db):
+    item = pagination.chat_page(db, None, limit=1).chats[0]
+    assert (item.title, item.last_sender, item.preview, item.has_image) == ("chat 4", "bot", "chat 4 a2", True)
+    assert not hasattr(item, "messages")
+    db.add(Message(text="y" * 500, sender="user", chat_id=item.id))
+    db.flush()
+    db.get(Chat, item.id).last_message_id = db.query(Message).order_by(Message.id.desc()).first().id
+    db.commit()
+    item = pagination.chat_page(db, None, limit=1).chats[0]
+    assert len(item.preview) == pagination.PREVIEW_CHARS and item.has_image is False
+
+
+def test_chat_full_mode(db):
+    chat = pagination.chat_page(db, None, limit=1, mode="full").chats[0]
+    assert chat.title == "chat 4" and len(chat.messages) == 6
+
+
+def test_chats_after_cursor_returns_newer_activity(db):
+    page = pagination.chat_page(db, None, limit=10)
+    assert pagination.chat_page(db, None, after=page.after).chats == []
+    chat1 = db.query(Chat).filter_by(title="chat 1").one()
+    msg = Message(text="again", sender="user", chat_id=chat1.id)
+    db.add(msg)
+    db.flush()
+    chat1.last_message_id = msg.id
+    db.commit()
+    newer = pagination.chat_page(db, None, after=page.after)
+    assert titles(newer) == ["chat 1"] and newer.after == msg.id
+
+
+def test_messages_paged_by_id(db):
+    chat = db.query(Chat).filter_by(title="chat 2").one()
+    page = pagination.message_page(db, chat.id, limit=4)
+    assert [m.text[:10] for m in page.messages] == ["chat 2 q1 ", "chat 2 a1", "chat 2 q2 ", "chat 2 a2"]
+    older = pagination.message_page(db, chat.id, limit=4, before=page.before)
+    assert [m.text[:9] for m in older.messages] == ["chat 2 q0", "chat 2 a0"] and older.before is None
+    newer = pagination.message_page(db, chat.id, limit=3, after=older.after)
+    assert [m.id for m in newer.messages] == [m.id for m in page.messages[:3]]
+    assert newer.before == page.messages[0].id and newer.after == page.messages[2].id
+
+
+def test_page_is_one_query(db):
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *a: statements.append(a[2]))
+    pagination.chat_page(db, None, limit=2, before=10**6)
+    pagination.message_page(db, 1, limit=2, before=10**6)
+    assert len(statements) == 2 and all("LIMIT" in s for s in statements)
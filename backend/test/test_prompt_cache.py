@@ -0,0 +1,123 @@
+"""Gemini cached-content handles for the system prompt, against the fake
+server's cachedContents endpoints.
+
+    python -m pytest test/test_prompt_cache.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import llm  # noqa: E402
+import prompt_cache  # noqa: E402
+from fake_llm_server import FakeLLMServer  # noqa: E402
+
+MODEL = "gemini/gemini-2.5-flash"
+SYSTEM = {"role": "system", "content": "You are a patient maths tutor. " * 200}
+KWARGS = {"api_key": "fake", "temperature": 0.2}
+
+
+def messages(question="What is 3 + 4?"):
+    return [SYSTEM, {"role": "user", "content": question}]
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = FakeLLMServer().start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture(autouse=True)
+def cache_env(server, monkeypatch):
+    monkeypatch.setattr(prompt_cache, "GEMINI_API_BASE", server.base_url.replace("/v1", "/v1beta"))
+    monkeypatch.setattr(prompt_cache, "_handles", {})
+    monkeypatch.setattr(prompt_cache, "_counters", dict.fromkeys(prompt_cache._counters, 0))
+    server.reset()
+    yield server
+
+
+def wait_idle():
+    deadline = time.monotonic() + 5
+    while any(h.busy for h in prompt_cache._handles.values()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_handle_created_in_background_then_used(server):
+    sent, kw = prompt_cache.apply(MODEL, messages(), KWARGS)
+    assert sent == messages() and "cached_content" not in kw  # first request goes out uncached
+    wait_idle()
+    (name, entry), = server.cached_contents.items()
+    assert entry["model"] == "models/gemini-2.5-flash"
+    assert entry["systemInstruction"]["parts"] == [{"text": SYSTEM["content"]}]
+    assert entry["ttl"] == f"{prompt_cache.LLM_PROMPT_CACHE_TTL_SECONDS}s"
+
+    sent, kw = prompt_cache.apply(MODEL, messages("What is 5 + 6?"), KWARGS)
+    assert sent == [{"role": "user", "content": "What is 5 + 6?"}]
+    assert kw == {**KWARGS, "cached_content": name}
+    assert prompt_cache.stats()["created"] == 1
+
+
+def test_handle_refreshed_before_expiry(server):
+    prompt_cache.apply(MODEL, messages(), KWARGS)
+    wait_idle()
+    handle, = prompt_cache._handles.values()
+    handle.expires_at = time.monotonic() + prompt_cache.LLM_PROMPT_CACHE_TTL_SECONDS / 8
+    _, kw = prompt_cache.apply(MODEL, messages(), KWARGS)
+    assert kw["cached_content"] == handle.name  # still usable while it is extended
+    wait_idle()
+    assert server.hits["cachedContents.patch"] == 1
+    assert handle.expires_at - time.monotonic() > prompt_cache.LLM_PROMPT_CACHE_TTL_SECONDS / 2
+    assert len(server.cached_contents) == 1
+
+
+def test_expired_handle_is_recreated(server):
+    prompt_cache.apply(MODEL, messages(), KWARGS)
+    wait_idle()
+    server.cached_contents.clear()  # gone on the provider side
+    handle, = prompt_cache._handles.values()
+    handle.expires_at = time.monotonic() + 30
+    _, kw = prompt_cache.apply(MODEL, messages(), KWARGS)
+    assert "cached_content" not in kw  # too close to expiry to hand out
+    wait_idle()
+    assert list(server.cached_contents) == [handle.name] and prompt_cache.stats()["created"] == 2
+
+
+def test_failed_create_backs_off(server):
+    server.script("cachedContents.create", {"status": 400})
+    prompt_cache.apply(MODEL, messages(), KWARGS)
+    wait_idle()
+    prompt_cache.apply(MODEL, messages(), KWARGS)
+    wait_idle()
+    assert server.hits["cachedContents.create"] == 1
+    assert prompt_cache.stats()["failed"] == 1
+
+
+def test_skipped_for_small_prompts_and_other_models():
+    small = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+    assert prompt_cache.apply(MODEL, small, KWARGS) == (small, KWARGS)
+    assert prompt_cache.apply("openai/gpt-4o-mini", messages(), KWARGS) == (messages(), KWARGS)
+    assert prompt_cache.apply(MODEL, messages(), {**KWARGS, "api_base": "http://localhost"})[0] == messages()
+    assert prompt_cache._handles == {}
+
+
+def test_live_call_uses_handle_and_retries_without_it(monkeypatch):
+    prompt_cache.apply(MODEL, messages(), KWARGS)
+    wait_idle()
+    calls = []
+
+    def fake_completion(model, messages, **kwargs):
+        calls.append((len(messages), kwargs.get("cached_content")))
+        if kwargs.get("cached_content"):
+            raise RuntimeError("400 CachedContent not found (or permission denied)")
+        return "ok"
+
+    monkeypatch.setattr(llm, "completion", fake_completion)
+    assert llm._live_completion(MODEL, messages(), **KWARGS) == "ok"
+    handle, = prompt_cache._handles.values()
+    assert calls == [(1, "cachedContents/fake-1"), (2, None)]
+    assert handle.name is None and prompt_cache.stats()["invalidated"] == 1
@@ -0,0 +1,140 @@
+"""Single-statement scoring: attempt rules and concurrent submissions against
+a throwaway SQLite file.
+
+    python -m pytest test/test_scoring.py
+"""
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import scoring  # noqa: E402
+from database import Base  # noqa: E402
+from models.models import User  # noqa: E402
+
+
+@pytest.fixture
+def Session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'scoring.db'}", connect_args={"check_same_thread": False, "timeout": 30})
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def make_user(Session, **fields) -> int:
+    with Session() as db:
+        user = User(username="kid", password="x", **fields)
+        db.add(user)
+        db.commit()
+        return user.id
+
+
+def attempt(Session, user_id, correct):
+    with Session() as db:
+        result = scoring.apply_attempt(db, user_id, correct)
+        db.commit()
+        return result
+
+
+def test_correct_and_wrong_answers(Session):
+    uid = make_user(Session, score=0.0, level=1)
+    r = attempt(Session, uid, True)
+    assert (r.score, r.total_attempts, r.correct_attempts, r.current_streak, r.max_streak) == (1.0, 1, 1, 1, 1)
+    r = attempt(Session, uid, True)
+    assert (r.score, r.current_streak, r.max_streak) == (2.0, 2, 2)
+    r = attempt(Session, uid, False)
+    assert (r.score, r.total_attempts, r.correct_attempts, r.current_streak, r.max_streak) == (1.75, 3, 2, 0, 2)
+
+
+def test_level_up_past_threshold(Session):
+    uid = make_user(Session, score=50.0, level=3)
+    r = attempt(Session, uid, True)
+    assert (r.level, r.score) == (4, 0.0)
+    # Exactly at the threshold is not enough
+    with Session() as db:
+        db.query(User).filter(User.id == uid).update({User.score: 49.0})
+        db.commit()
+    r = attempt(Session, uid, True)
+    assert (r.level, r.score) == (4, 50.0)
+    # A wrong answer never levels up
+    r = attempt(Session, uid, False)
+    assert (r.level, r.score) == (4, 49.75)
+
+
+def test_score_clamped_at_zero(Session):
+    uid = make_user(Session, score=0.1)
+    assert attempt(Session, uid, False).score == 0.0
+    assert attempt(Session, uid, False).score == 0.0
+
+
+def test_null_counters_from_old_rows(Session):
+    uid = make_user(Session)
+    with Session() as db:
+        db.query(User).filter(User.id == uid).update(
+            {User.score: None, User.total_attempts: None, User.correct_attempts: None,
+             User.current_streak: None, User.max_streak: None, User.level: None}
+        )
+        db.commit()
+    r = attempt(Session, uid, True)
+    assert r == scoring.ScoreResult(level=1, score=1.0, total_attempts=1, correct_attempts=1, current_streak=1, max_streak=1)
+
+
+def test_missing_user(Session):
+    assert attempt(Session, 999, True) is None
+
+
+def test_one_statement_per_attempt(Session):
+    uid = make_user(Session)
+    statements = []
+    with Session() as db:
+        event.listen(db.get_bind(), "before_cursor_execute", lambda *a: statements.append(a[2]))
+        scoring.apply_attempt(db, uid, True)
+        db.commit()
+    assert len(statements) == 1 and statements[0].startswith("UPDATE users SET") and "RETURNING" in statements[0]
+
+
+def submit_concurrently(Session, uid, answers: list[bool]):
+    barrier = threading.Barrier(len(answers))
+    errors = []
+
+    def submit(is_correct):
+        try:
+            barrier.wait()
+            attempt(Session, uid, is_correct)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=submit, args=(a,)) for a in answers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_concurrent_correct_answers(Session):
+    uid = make_user(Session, score=45.0, level=1, current_streak=0, max_streak=3)
+    submit_concurrently(Session, uid, [True] * 10)
+    with Session() as db:
+        user = db.get(User, uid)
+        # No lost updates: 45 -> 50, 51 levels up to 0, then 4 more
+        assert (user.level, user.score) == (2, 4.0)
+        assert (user.total_attempts, user.correct_attempts) == (10, 10)
+        assert (user.current_streak, user.max_streak) == (10, 10)
+
+
+def test_concurrent_mixed_answers(Session):
+    uid = make_user(Session, score=0.0)
+    correct, wrong = 40, 8
+    submit_concurrently(Session, uid, [True] * correct + [False] * wrong)
+    with Session() as db:
+        user = db.get(User, uid)
+        # Every attempt is counted exactly once, in some serial order
+        assert (user.total_attempts, user.correct_attempts) == (correct + wrong, correct)
+        assert 0 <= user.current_streak <= user.max_streak <= correct
+        assert 0.0 <= user.score <= correct * scoring.CORRECT_POINTS
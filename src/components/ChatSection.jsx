@@ -1,6 +1,6 @@
 import { useState, useRef, useEffect } from "react";
 import { Image } from "lucide-react";
-import { sendToGemini, setSessionId ,sendCheckRequest} from "../utils/api";
+import { sendToGemini, setSessionId ,sendCheckRequest, assetUrl} from "../utils/api";
 import { useLanguage } from "../hooks/useLanguage";
 import { useHistoryStore } from "../hooks/useHistory";
 import { useUser } from "../contexts/UserContext";
@@ -317,7 +317,7 @@ export default function ChatSection({
             <div className={`max-w-[80%] ${msg.sender === "user" ? "text-right" : "text-left"}`}>
               {msg.image ? (
                 <img 
-                  src={msg.image} 
+                  src={assetUrl(msg.image)} 
                   alt="uploaded" 
                   loading="lazy"
                   decoding="async"
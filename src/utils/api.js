@@ -19,6 +19,9 @@ export const postRequest = async (url, data = {}, params = {}) => {
   return response.data;
 };
 
+// Stored chat images come back as backend paths (/blobs/...); data URLs pass through
+export const assetUrl = (src) => (src && src.startsWith("/") ? `${BACKEND_URL}${src}` : src);
+
 // 🧩 Session Management
 let currentSessionId = localStorage.getItem("session_id") || null;
 